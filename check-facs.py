@@ -3,58 +3,222 @@
 import argparse
 import json
 import logging
-import re
+import math
+import os
 import sys
 from argparse import ArgumentParser
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from pathlib import Path
+from typing import Optional
+
+sys.path.insert(0, str(Path(__file__).resolve().parent / 'utils'))
+
+from document_metadata import PageImage, load_page_images  # noqa: E402
+from find_sigil_refs import encode_sigil  # noqa: E402
+from instrumentation import add_profile_arguments, profile, stage  # noqa: E402
+from tilepack import PACK_SUFFIX, TilePack  # noqa: E402
 
 logger = logging.getLogger(__name__)
 
+SCALED_LEVELS = 9   # _0.jpg … _8.jpg, as produced by convert.sh
+
 
 def get_options(argv=None):
-    parser = ArgumentParser()
-    parser.add_argument('document_metadata', type=argparse.FileType(mode='rt'), help='js file with metadata')
+    parser = ArgumentParser(description="""
+        Checks whether all facsimiles referenced in the document metadata are available. The facsimile
+        directory is expected to have the layout produced by convert.sh, i.e. metadata, jpg and jpg_tiles
+        subdirectories; the tiles may be single files or tile packs. If it has no metadata subdirectory, it is taken to be the metadata directory and only
+        the JSON files are checked.""")
+    parser.add_argument('document_metadata', type=Path, help='js file with metadata')
     parser.add_argument('-d', '--facsimile-directory', help='root directory to check')
+    parser.add_argument('-o', '--output', type=argparse.FileType(mode='wt'), help='write a JSON report to this file')
+    parser.add_argument('-j', '--jobs', type=int, default=32, help='number of parallel directory scans')
+    add_profile_arguments(parser)
     options = parser.parse_args(argv)
     logger.debug(options)
     return options
 
-def _read_md(filelike):
-    md_str = filelike.read()
-    md_str = re.sub(r'var\s+\w+\s*=\s*', '', md_str)
-    md = json.loads(md_str)
-    return md['metadata']
-
 def _link(sigil, page, transcript, layer=0):
-    sigil_t = re.sub(r'[^A-Za-z0-9.-]', '_', sigil.replace('α', 'alpha'))
+    sigil_t = encode_sigil(sigil)
     href = 'http://dev.faustedition.net/document?sigil={}&page={}'.format(sigil_t, page)
     if layer > 0:
         href += '&layer={}'.format(layer)
     return '[{} S. {} Layer {}]({})'.format(sigil, page, layer, href)
 
-def _check_metadata(documents, rootdir):
-    img_root = Path(rootdir)
-    for document in documents:
-        sigil = document['sigils']['idno_faustedition']
-        for pageno, page in enumerate(document['page'], start=1):
-            for docno, doc in enumerate(page['doc'], start=1):
-                if 'img' in doc:
-                    for imgno, img in enumerate(doc['img'], start=0):
-                        img_json_file = img_root / (img + ".json")
-                        if not img_json_file.exists():
-                            logger.warning('%s: json file missing: %s', _link(sigil, pageno, docno, imgno), img_json_file)
+
+def _scan(directory):
+    files, dirs = [], []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                dirs.append(entry.path)
+            else:
+                files.append(entry.path)
+    return files, dirs
+
+
+def snapshot(root, jobs=32) -> set[str]:
+    """
+    Lists all files below root, scanning directories in parallel.
+
+    Returns:
+        set of the files' paths relative to root, with / as separator
+    """
+    root = os.fspath(root)
+    prefix = len(os.path.join(root, ''))
+    result = set()
+    with ThreadPoolExecutor(jobs) as executor:
+        running = {executor.submit(_scan, root)}
+        while running:
+            done, running = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                files, dirs = future.result()
+                result.update(path[prefix:].replace(os.sep, '/') for path in files)
+                running.update(executor.submit(_scan, directory) for directory in dirs)
+    return result
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        return e
+
+
+def expected_tiles(img_md: dict):
+    """
+    Yields (level, x, y) for all tiles implied by the image metadata.
+
+    Each zoom level halves the previous level's size (rounding up, like convert.sh).
+    """
+    width, height = img_md['imageWidth'], img_md['imageHeight']
+    tile_width, tile_height = img_md.get('tileWidth', 256), img_md.get('tileHeight', 256)
+    for level in range(img_md.get('zoomLevels', SCALED_LEVELS - 1) + 1):
+        for x in range(math.ceil(width / tile_width)):
+            for y in range(math.ceil(height / tile_height)):
+                yield level, x, y
+        width, height = (width + 1) // 2, (height + 1) // 2
+
+
+class FacsimileChecker:
+    """Checks the facsimile tree for completeness against a snapshot of its contents."""
+
+    def __init__(self, rootdir, jobs=32):
+        self.root = Path(rootdir)
+        self.jobs = jobs
+        self.full_layout = (self.root / 'metadata').is_dir()
+        self.md_prefix = 'metadata/' if self.full_layout else ''
+        logger.info('Scanning %s ...', self.root)
+        with stage('scan'):
+            self.files = snapshot(self.root, jobs)
+        logger.info('... found %d files', len(self.files))
+
+    def load_image_metadata(self, imgs) -> dict:
+        """Reads the JSON files for all imgs that have one, in parallel."""
+        imgs = [img for img in imgs if self.md_prefix + img + '.json' in self.files]
+        with ThreadPoolExecutor(self.jobs) as executor:
+            return dict(zip(imgs, executor.map(_read_json, (self.root / (self.md_prefix + img + '.json')
+                                                            for img in imgs))))
+
+    def open_pack(self, img) -> Optional[TilePack]:
+        """Opens the tile pack for the given image, if there is one, instead of single tile files."""
+        pack_file = f'jpg_tiles/{img}{PACK_SUFFIX}'
+        if pack_file in self.files:
+            try:
+                return TilePack(self.root / pack_file)
+            except (OSError, ValueError) as e:
+                logger.warning('%s: cannot read tile pack: %s', img, e)
+        return None
+
+    def check_image(self, img, img_md) -> dict:
+        """
+        Returns the missing artifacts for a single image, as dictionary, empty if the image is complete.
+        """
+        missing = {}
+        md_file = self.md_prefix + img + '.json'
+        if md_file not in self.files:
+            missing['metadata'] = [md_file]
+        elif isinstance(img_md, Exception):
+            missing['metadata'] = [md_file]
+            missing['metadata_error'] = str(img_md)
+            img_md = None
+        if not self.full_layout:
+            return missing
+
+        levels = img_md.get('zoomLevels', SCALED_LEVELS - 1) + 1 if img_md else SCALED_LEVELS
+        scaled = [f'jpg/{img}_{level}.jpg' for level in range(levels)] + [f'jpg/{img}_preview.jpg']
+        missing_scaled = [file for file in scaled if file not in self.files]
+        if missing_scaled:
+            missing['scaled'] = missing_scaled
+
+        if img_md:
+            tiles_missing = Counter()
+            tiles_expected = Counter()
+            pack = self.open_pack(img)
+            for level, x, y in expected_tiles(img_md):
+                tiles_expected[level] += 1
+                if pack:
+                    present = (level, x, y) in pack
                 else:
-                    logger.debug('%s: Page %3d, transcript %d has no images', sigil, pageno, docno)
+                    present = f'jpg_tiles/{img}_{level}_{x}_{y}.jpg' in self.files
+                if not present:
+                    tiles_missing[level] += 1
+            if pack:
+                pack.close()
+            if tiles_missing:
+                missing['tiles'] = {str(level): f'{tiles_missing[level]}/{tiles_expected[level]}'
+                                    for level in sorted(tiles_missing)}
+        return missing
+
+    def check(self, references: list[PageImage]) -> dict:
+        """Checks all images referenced in the document metadata and returns a report."""
+        imgs = sorted({ref.img for ref in references})
+        with stage('load'):
+            img_mds = self.load_image_metadata(imgs)
+        with stage('compute'):
+            results = {img: self.check_image(img, img_mds.get(img)) for img in imgs}
+
+        problems = []
+        summary = Counter()
+        for ref in references:
+            sigil, pageno, docno, imgno, img = ref.sigil, ref.page, ref.doc, ref.img_index, ref.img
+            missing = results[img]
+            if missing:
+                link = _link(sigil, pageno, docno, imgno)
+                logger.warning('%s: incomplete facsimile %s: %s', link, img, ', '.join(missing))
+                problems.append(dict(sigil=sigil, page=pageno, doc=docno, img_index=imgno, img=img, link=link,
+                                     missing=missing))
+        for missing in results.values():
+            summary.update(key for key in missing if key != 'metadata_error')
+        return dict(root=os.fspath(self.root),
+                    files=len(self.files),
+                    references=len(references),
+                    images=len(imgs),
+                    complete_images=sum(1 for missing in results.values() if not missing),
+                    incomplete_images=dict(summary),
+                    problems=problems)
+
+
+def _check_metadata(references, rootdir, jobs=32):
+    return FacsimileChecker(rootdir, jobs).check(references)
 
 
 
 def _main():
     logging.basicConfig(level=logging.INFO)
     options = get_options()
-    md = _read_md(options.document_metadata)
-    _check_metadata(md, options.facsimile_directory)
+    with profile('check-facs', options):
+        with stage('load'):
+            md = load_page_images(options.document_metadata)
+        report = _check_metadata(md, options.facsimile_directory, options.jobs)
+        logger.info('%d of %d images complete', report['complete_images'], report['images'])
+        if options.output:
+            with stage('write'), options.output:
+                json.dump(report, options.output, indent=1, ensure_ascii=False)
 
 
 
 if __name__ == '__main__':
-    _main()
\ No newline at end of file
+    _main()
@@ -58,7 +58,8 @@ if (process.argv.length !== 4) {
                     }
                 }
 
-                await page.evaluate(s => transcriptGeneration.addAboutPage(s), job.sigil);
+                if (job.aboutPage !== false)    // false for all but the last part of a split job
+                    await page.evaluate(s => transcriptGeneration.addAboutPage(s), job.sigil);
                 const htmlName = job.pdfname.replace(/pdf$/, 'html');
                 const html = await page.evaluate(() => { return transcriptGeneration.serialize(document.getRootNode()); });
                 await fsP.writeFile(htmlName, html, {encoding: "utf-8"});
@@ -71,6 +71,9 @@ public class DiplomaticConversion {
 
 	private static boolean onlyWebServer;
 
+	/** Only write the JSON files and job descriptions, the rendering is done externally (utils/render_planner.py) */
+	private static boolean onlyJobs;
+
 	public static class TranscriptPage {
 		public final Document document;
 		private final String page;
@@ -385,6 +388,7 @@ public class DiplomaticConversion {
 		System.setProperty("java.util.logging.SimpleFormatter.format", "%4$s: %5$s%n");
 		onlyWebServer = Boolean.valueOf((String) properties.getOrDefault("faust.diplo.server", "false"));
 		debugPhantomJS = Boolean.valueOf((String) properties.getOrDefault("faust.diplo.debug", "false"));
+		onlyJobs = Boolean.valueOf((String) properties.getOrDefault("faust.diplo.jobsOnly", "false"));
 		final int listeningPort = Integer.valueOf((String) properties.getOrDefault("faust.diplo.port", "0"));
 		final SimpleWebServer webServer = new SimpleWebServer("localhost", listeningPort, renderWebapp, true);
 		webServer.start(60, true);
@@ -415,6 +419,13 @@ public class DiplomaticConversion {
 				// TODO writeJob(getDocuments());
 				 
 				 
+				if (onlyJobs) {
+					final long jobCount = getDocuments().map(Document::writeJob).filter(Objects::nonNull).count();
+					logger.info(MessageFormat.format("Wrote {0} render job descriptions to {1}, not rendering.",
+							jobCount, target.resolve("pages")));
+					return;
+				}
+
 				int nThreads = Integer.valueOf(System.getProperty("faust.diplo.threads", "0"));
 				if (nThreads <= 0)
 					nThreads = Runtime.getRuntime().availableProcessors();
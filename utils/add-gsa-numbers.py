@@ -7,58 +7,95 @@ ns=dict(f='http://www.faustedition.net/ns')
 import os
 import sys
 import logging
+
+from xml_batch import XMLBatch
+
 logging.basicConfig(level=logging.INFO,
                     format='%(levelname)s:%(funcName)s:%(message)s')
 logger = logging.getLogger(__name__ if __name__ != '__main__' else sys.argv[0])
 
 
+def index_idnos(idno_xml):
+    """
+    Indexes the transcript list by idno.
+
+    Returns:
+        dictionary idno value → list of the distinct document paths of the
+        elements that have an f:idno child with this value, in document order
+    """
+    index = {}
+    for idno in idno_xml.iter('{%s}idno' % ns['f']):
+        docpath = idno.getparent().get('document')
+        if docpath is None:
+            continue
+        docpaths = index.setdefault(''.join(idno.itertext()), [])
+        if docpath not in docpaths:
+            docpaths.append(docpath)
+    return index
+
+
 def read_table(mapping_filename,
                transcript_filename='../target/faust-transcripts.xml'):
     table = pd.read_excel(mapping_filename, index_col="Signatur")
     table['docpath'] = None
     idno_xml = etree.parse(transcript_filename)
+    idno_index = index_idnos(idno_xml)
 
+    ambiguous = {}
     for idno_gsa in table.index:
-        transcript_el = idno_xml.xpath("//*[f:idno = 'GSA %s']" % idno_gsa,
-                                       namespaces=ns)
-        if not transcript_el:
+        docpaths = idno_index.get('GSA %s' % idno_gsa)
+        if not docpaths:
             logger.warn("No file found for signature %s", idno_gsa)
             continue
         else:
             logger.debug("Found an entry for signature %s", idno_gsa)
+        if len(docpaths) > 1:
+            ambiguous[idno_gsa] = docpaths
 
-        docpath = transcript_el[0].attrib['document']
+        docpath = docpaths[0]
         oldpath = table.loc[idno_gsa, "docpath"]
         if oldpath is not None and oldpath != docpath:
             logger.warn("Overwriting %s with %s for signature %s", oldpath,
                         docpath, idno_gsa)
         table.loc[idno_gsa, "docpath"] = docpath
+
+    if ambiguous:
+        logger.warning("%d signatures match more than one document, using the first one:\n%s",
+                       len(ambiguous),
+                       "\n".join("  GSA %s: %s" % (idno_gsa, ", ".join(docpaths))
+                                 for idno_gsa, docpaths in ambiguous.items()))
     return table
 
 
+def add_gsa_ident(md_xml, ident, signature, docpath):
+    """Edit for XMLBatch: adds the gsa_ident idno after the document's GSA signature idno."""
+    if md_xml.xpath("//f:idno[. = '%s']" % ident,
+                    namespaces=ns):
+        logger.info("Skipping %s (%s): Already present in %s",
+                    ident, signature, docpath)
+        return False
+
+    first_idno = md_xml.xpath("//f:idno[. = 'GSA %s']" % signature,
+                              namespaces=ns)[0]
+    tail = first_idno.tail
+    new_idno = etree.Element("{http://www.faustedition.net/ns}idno")
+    new_idno.attrib['type'] = 'gsa_ident'
+    new_idno.text = str(ident)
+    first_idno.addnext(new_idno)
+    first_idno.tail = tail
+    return True
+
+
 def write_idnos(table, rootdir='../data/xml'):
+    batch = XMLBatch()
     for entry in table.itertuples():
         if entry.docpath is None:
             logger.warn("Skipping %s: Signature not in edition", entry)
             continue
 
         fullpath = os.path.join(rootdir, entry.docpath)
-        md_xml = etree.parse(fullpath)
-        if md_xml.xpath("//f:idno[. = '%s']" % entry.Ident,
-                        namespaces=ns):
-            logger.info("Skipping %s (%s): Already present in %s",
-                        entry.Ident, entry.Index, entry.docpath)
-            continue
-
-        first_idno = md_xml.xpath("//f:idno[. = 'GSA %s']" % entry.Index,
-                                  namespaces=ns)[0]
-        tail = first_idno.tail
-        new_idno = etree.Element("{http://www.faustedition.net/ns}idno")
-        new_idno.attrib['type'] = 'gsa_ident'
-        new_idno.text = str(entry.Ident)
-        first_idno.addnext(new_idno)
-        first_idno.tail = tail
-        md_xml.write(fullpath, encoding='utf-8', xml_declaration=True)
+        batch.add(fullpath, add_gsa_ident, entry.Ident, entry.Index, entry.docpath)
+    batch.apply()
 
 
 def main():
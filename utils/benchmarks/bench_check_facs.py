@@ -0,0 +1,13 @@
+"""Benchmarks the facsimile completeness check of check-facs.py on the corpus' facsimile tree."""
+
+from conftest import ROOT, load_script, rounds
+from document_metadata import load_page_images
+
+check_facs = load_script(ROOT / 'check-facs.py', 'check_facs')
+
+
+def test_check_metadata(benchmark, corpus):
+    references = load_page_images(corpus.document_metadata, cache=False)
+    report = benchmark.pedantic(check_facs._check_metadata, (references, corpus.facsimile), rounds=rounds(corpus))
+    assert report['images'] == len(corpus.page_images())
+    assert 0 < report['complete_images'] < report['images']
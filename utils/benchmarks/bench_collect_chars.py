@@ -0,0 +1,14 @@
+"""Benchmarks the character statistics of collect_chars.py on the corpus' HTML files."""
+
+from conftest import rounds
+from collect_chars import collect_stats, count_in_file
+
+
+def test_count_in_file(benchmark, corpus):
+    counts = benchmark.pedantic(count_in_file, (str(corpus.faust_all_html),), rounds=rounds(corpus))
+    assert counts
+
+
+def test_collect_stats(benchmark, corpus):
+    stats = benchmark.pedantic(collect_stats, (str(corpus.edition / 'print'),), rounds=rounds(corpus, 3))
+    assert len(stats) > 1
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+"""
+Compares the multi-resolution page detection with the full resolution detection.
+
+For each image, the bounding box found by detect_pages.find_page_in (full
+resolution) serves as reference. The script reports the time per image and
+the deviation of the other modes from the reference: the maximum distance of
+any edge in pixels, and the intersection over union of the boxes.
+
+Without image folders, a set of synthetic facsimiles (dark background, bright
+page, a small bright color chart) is generated, including the scaled pyramid
+levels.
+"""
+
+import argparse
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from detect_pages import find_page_in, find_page_scaled  # noqa: E402
+
+
+def synthetic_facsimiles(folder: Path, count: int, width=4000, height=5000, levels=4, seed=42) -> list[Path]:
+    rng = np.random.default_rng(seed)
+    files = []
+    for i in range(count):
+        image = rng.normal(25, 8, (height, width)).clip(0, 255)
+        x, y = rng.integers(100, 600, 2)
+        xx, yy = width - rng.integers(100, 600), height - rng.integers(300, 900)
+        image[y:yy, x:xx] = rng.normal(200, 15, (yy - y, xx - x)).clip(0, 255)
+        image[yy + 80:yy + 200, x:x + 800] = 230    # color chart below the page
+        img = Image.fromarray(image.astype(np.uint8)).convert('RGB')
+        base = folder / f'page{i:03d}'
+        for level in range(levels + 1):
+            img.save(f'{base}_{level}.jpg', quality=90)
+            img = img.reduce(2)
+        files.append(Path(f'{base}_0.jpg'))
+    return files
+
+
+def deviation(bbox, reference):
+    return max(abs(a - b) for a, b in zip(bbox, reference))
+
+
+def iou(a, b):
+    ix = max(0, min(a[2], b[2]) - max(a[0], b[0]))
+    iy = max(0, min(a[3], b[3]) - max(a[1], b[1]))
+    intersection = ix * iy
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - intersection
+    return intersection / union if union else 1.0
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+@pytest.fixture(scope='module')
+def facsimile(tmp_path_factory) -> Path:
+    return synthetic_facsimiles(tmp_path_factory.mktemp('facsimiles'), 1)[0]
+
+
+def test_find_page_in(benchmark, facsimile):
+    bbox = benchmark.pedantic(find_page_in, (facsimile,), rounds=3)
+    assert bbox[0] < bbox[2] and bbox[1] < bbox[3]
+
+
+@pytest.mark.parametrize('level', [3, 4])
+def test_find_page_scaled(benchmark, facsimile, level):
+    bbox = benchmark(find_page_scaled, facsimile, level)
+    assert iou(bbox, find_page_in(facsimile)) > 0.95
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('folder', nargs='*', type=Path, help='folders with *_0.jpg images')
+    p.add_argument('-g', '--glob', default='*_0.jpg', help='glob pattern for the images')
+    p.add_argument('-l', '--levels', nargs='+', type=int, default=[3, 4], help='levels to compare')
+    p.add_argument('-n', '--synthetic', type=int, default=5, help='number of synthetic images if no folder is given')
+    options = p.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if options.folder:
+            files = [file for folder in options.folder for file in sorted(folder.glob(options.glob))]
+        else:
+            files = synthetic_facsimiles(Path(tmp), options.synthetic)
+
+        modes = {'full': lambda f: find_page_in(f)}
+        for level in options.levels:
+            modes[f'level {level}'] = lambda f, level=level: find_page_scaled(f, level)
+            modes[f'level {level} + refine'] = lambda f, level=level: find_page_scaled(f, level, refine=True)
+
+        times = {mode: [] for mode in modes}
+        deviations = {mode: [] for mode in modes}
+        ious = {mode: [] for mode in modes}
+        for file in files:
+            reference = None
+            for mode, function in modes.items():
+                bbox, seconds = timed(function, file)
+                if reference is None:
+                    reference = bbox
+                times[mode].append(seconds)
+                deviations[mode].append(deviation(bbox, reference))
+                ious[mode].append(iou(bbox, reference))
+
+    print(f'{len(files)} images')
+    print(f'{"mode":<20} {"s/image":>8} {"speedup":>8} {"max dev [px]":>13} {"mean IoU":>9} {"min IoU":>8}')
+    full = statistics.mean(times['full'])
+    for mode in modes:
+        mean = statistics.mean(times[mode])
+        print(f'{mode:<20} {mean:>8.3f} {full / mean:>8.1f} {max(deviations[mode]):>13} '
+              f'{statistics.mean(ious[mode]):>9.4f} {min(ious[mode]):>8.4f}')
+
+
+if __name__ == '__main__':
+    main()
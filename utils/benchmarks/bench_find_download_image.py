@@ -0,0 +1,17 @@
+"""Benchmarks find_allowed_facsimile from find-download-image.py on all page images of the corpus."""
+
+from conftest import UTILS, load_script, rounds
+
+find_download_image = load_script(UTILS / 'find-download-image.py', 'find_download_image')
+
+
+def test_find_allowed_facsimile(benchmark, corpus):
+    rules = find_download_image.download_config(str(corpus.archives))
+    images = corpus.page_images()
+    root = corpus.facsimile / 'jpg'
+
+    def find_all():
+        return [find_download_image.find_allowed_facsimile(root, img, rules[img.split('/')[0]]) for img in images]
+
+    allowances = benchmark.pedantic(find_all, rounds=rounds(corpus))
+    assert any(allowance.download for allowance in allowances)
@@ -0,0 +1,54 @@
+"""Benchmarks counting and linking sigil mentions with find_sigil_refs in an XHTML page."""
+
+import re
+
+import pytest
+
+from find_sigil_refs import SigilScanner, scan_file
+
+SIGILS = {f'H P{i}': f'H_P{i}' for i in range(1, 200)} | {'2 H': '2_H', 'C.1 4': 'C.1_4', 'H α 2': 'H_alpha_2'}
+
+PAGE = """<?xml version="1.0" encoding="utf-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml">
+<head><meta charset="utf-8"/><title>H P1</title><script src="faust.js"></script></head>
+<body><div id="container"></div><textarea name="q"></textarea><span class="icon"></span>
+{paragraphs}
+<p>Already linked: <a href="/document?sigil=H_P2" class="sigil-ref">H P2</a>.</p>
+</body>
+</html>
+"""
+PARAGRAPH = ('<p>Vgl. H P{n} und <i>2 H</i>, nicht aber H P{n}0x, C.1 4 oder H α 2.<br/>'
+             '<em></em> Siehe <a href="#n{n}">H P{n}</a>.</p>\n')
+
+
+@pytest.fixture
+def page(tmp_path):
+    path = tmp_path / 'page.html'
+    path.write_text(PAGE.format(paragraphs=''.join(PARAGRAPH.format(n=n % 150 + 1) for n in range(500))),
+                    encoding='utf-8')
+    return path
+
+
+def test_count_sigils(benchmark, page):
+    scanner = SigilScanner(SIGILS)
+    counts = benchmark(scan_file, page, scanner)
+    assert counts['2 H'] == counts['C.1 4'] == counts['H α 2'] == 500
+    assert counts['H P2'] == 4 + 1
+
+
+def test_link_xhtml_page(benchmark, page):
+    scanner = SigilScanner(SIGILS)
+    original = page.read_text(encoding='utf-8')
+
+    def link():
+        page.write_text(original, encoding='utf-8')
+        return scan_file(page, scanner, link=True)
+
+    counts = benchmark(link)
+    linked = page.read_text(encoding='utf-8')
+    assert linked.count('class="sigil-ref"') == sum(counts.values())
+    # apart from the inserted links, the page must be unchanged – in particular, empty elements stay open
+    inserted = re.compile(r'<a href="/document\?sigil=[^"]*" class="sigil-ref">([^<]*)</a>')
+    assert inserted.sub(r'\1', linked) == inserted.sub(r'\1', original)
+    assert 'H P2</a>' in linked and '>H P1</title>' in linked
@@ -0,0 +1,29 @@
+"""Benchmarks Converter.table2xml on a witness table derived from the corpus' document metadata."""
+
+import pandas as pd
+
+from conftest import rounds
+from document_metadata import read_document_metadata
+from table2xml import Converter
+
+
+def witness_table(corpus) -> pd.DataFrame:
+    records = []
+    for document in read_document_metadata(corpus.document_metadata):
+        records.append({'Sigle': document['sigils']['idno_faustedition'],
+                        'Repository': document['sigils']['repository'],
+                        'URI': 'faust://xml/document/' + document['base'].rstrip('/') + '.xml',
+                        'Seiten': len(document['page']),
+                        'Typ': document['type'],
+                        'Bemerkung': None if len(records) % 3 else 'siehe Apparat'})
+    return pd.DataFrame.from_records(records)
+
+
+def test_table2xml(benchmark, corpus):
+    table = witness_table(corpus)
+
+    def convert():
+        return Converter().table2xml(table)
+
+    root = benchmark.pedantic(convert, rounds=rounds(corpus, 10))
+    assert len(root) == len(table)
@@ -0,0 +1,40 @@
+"""Benchmarks serving tiles from packs with TilePackApp, for JPEG and WebP requests."""
+
+import pytest
+
+from tilepack import TilePackApp, write_pack
+
+FORMATS = ('jpg', 'webp')
+
+
+@pytest.fixture(scope='module')
+def tiles(tmp_path_factory):
+    """jpg_tiles and webp_tiles packs of a 4096×4096 image with distinct contents per format."""
+    root = tmp_path_factory.mktemp('tiles')
+    for fmt in FORMATS:
+        (root / f'{fmt}_tiles' / 'doc').mkdir(parents=True)
+        write_pack(root / f'{fmt}_tiles' / 'doc' / 'page.tilepack', 4096, 4096, 256, 256, 4,
+                   lambda level, x, y, fmt=fmt: f'{fmt} {level} {x} {y}'.encode())
+    return root
+
+
+def request(app, path):
+    status = []
+    body = b''.join(app({'PATH_INFO': path}, lambda code, headers: status.append((code, dict(headers)))))
+    return status[0], body
+
+
+@pytest.mark.parametrize('fmt', FORMATS)
+def test_serve_tiles(benchmark, tiles, fmt):
+    app = TilePackApp(tiles / 'jpg_tiles')
+    paths = [f'/doc/page_{level}_{x}_{y}.{fmt}' for level in range(3) for x in range(4) for y in range(4)]
+
+    def serve():
+        return [request(app, path) for path in paths]
+
+    responses = benchmark(serve)
+    for path, ((code, headers), body) in zip(paths, responses):
+        level, x, y = path.rsplit('.', 1)[0].split('_')[1:]
+        assert code == '200 OK'
+        assert headers['Content-Type'] == f'image/{"jpeg" if fmt == "jpg" else fmt}'
+        assert body == f'{fmt} {level} {x} {y}'.encode()
@@ -0,0 +1,38 @@
+"""Benchmarks building and querying the verse index of the corpus' faust.xml."""
+
+import pytest
+
+from conftest import rounds
+from verse_index import VerseIndex, build_index, tokenize
+
+
+@pytest.fixture(scope='session')
+def verse_index(corpus, tmp_path_factory):
+    path = tmp_path_factory.mktemp('verse-index') / 'verse-index.bin'
+    build_index(corpus.faust_xml, path)
+    with VerseIndex(path) as index:
+        yield index
+
+
+def test_build_index(benchmark, corpus, tmp_path):
+    header = benchmark.pedantic(build_index, args=(corpus.faust_xml, tmp_path / 'verse-index.bin'),
+                                rounds=rounds(corpus, 5))
+    assert header['lines'] >= corpus.scale * 1000
+
+
+def test_query_phrase(benchmark, verse_index):
+    tokens = tokenize(verse_index.line(len(verse_index) // 2).text)
+    lines = benchmark(verse_index.search, f'"{tokens[0]} {tokens[1]}"')
+    assert len(verse_index) // 2 in [line.id for line in lines]
+
+
+def test_query_prefix(benchmark, verse_index):
+    token = tokenize(verse_index.line(len(verse_index) // 2).text)[0]
+    lines = benchmark(verse_index.search, f'{token[:3]}* section:1.1')
+    assert all(line.section.startswith('1.1') for line in lines)
+
+
+def test_query_substring(benchmark, verse_index):
+    token = max(tokenize(verse_index.line(len(verse_index) // 2).text), key=len)
+    lines = benchmark(verse_index.search, f'*{token[1:-1]}*')
+    assert len(verse_index) // 2 in [line.id for line in lines]
@@ -0,0 +1,17 @@
+"""Benchmarks the per-line analysis of verse_stats.py on the synthetic edition."""
+
+import pytest
+
+from conftest import rounds
+
+verse_stats = pytest.importorskip('verse_stats')
+
+
+def test_verse_stats_lines(benchmark, corpus):
+    def setup():
+        stats = verse_stats.VerseStats(str(corpus.edition))
+        stats.load()
+        return (stats,), {}
+
+    lines = benchmark.pedantic(lambda stats: list(stats.lines()), setup=setup, rounds=rounds(corpus, 3))
+    assert len(lines) >= corpus.scale * 1000
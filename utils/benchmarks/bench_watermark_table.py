@@ -0,0 +1,44 @@
+"""
+Benchmarks watermark_image_table.generate_table on a synthetic watermark set.
+
+The synthetic set contains a label file with `labels` watermark ids and
+`signatures` signatures with three images each, multiplied by the scale
+factor. If table generation is linear, the time per table row stays roughly
+constant across the scales.
+"""
+
+from pathlib import Path
+
+import pytest
+
+from watermark_image_table import WMLabels, generate_table, NS
+
+
+def synthetic_labels(path: Path, count: int) -> Path:
+    lines = [f'<watermarks xmlns="{NS["f"]}">']
+    lines.extend(f'  <watermark id="WM {i}">Wasserzeichen {i}</watermark>' for i in range(count))
+    lines.append('  <watermark id="none">kein Wasserzeichen</watermark>')
+    lines.append('</watermarks>')
+    path.write_text('\n'.join(lines), encoding='utf-8')
+    return path
+
+
+def synthetic_watermarks(signatures: int, labels: int):
+    by_sigpart = {}
+    idmap = {}
+    for i in range(signatures):
+        sigpart = str(1000 + i)
+        by_sigpart[sigpart] = [
+            dict(path=Path(f'GSA_25-W_{sigpart}_wm_{cat}_150.jpg'), category=label, resolution='150')
+            for cat, label in [('all', 'Blatt'), ('detail', 'Detail'), ('hand_drawn', 'Zeichnung')]]
+        idmap[f'GSA 25/W {sigpart}'] = dict(sigil=f'H P{i}',
+                                            idnos=[f'GSA 25/W {sigpart}', f'H P{i}'],
+                                            wmids=[f'WM {i % labels}'])
+    return by_sigpart, idmap
+
+
+@pytest.mark.parametrize('scale', [1, 10])
+def test_generate_table(benchmark, tmp_path, scale, signatures=300, labels=400):
+    label_file = synthetic_labels(tmp_path / 'watermark-labels.xml', labels * scale)
+    by_sigpart, idmap = synthetic_watermarks(signatures * scale, labels * scale)
+    benchmark.pedantic(generate_table, setup=lambda: ((by_sigpart, idmap, WMLabels(label_file)), {}), rounds=5)
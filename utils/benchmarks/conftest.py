@@ -0,0 +1,67 @@
+"""
+Shared fixtures for the benchmark suite.
+
+The `corpus` fixture provides a synthetic edition corpus (see corpus.py) for
+each scale given with `--corpus-scales` (default: 1 and 10). Corpora are
+generated once per session in a temporary directory, or, with
+`--corpus-dir`, in subdirectories of that directory, where they are kept and
+reused across runs.
+"""
+
+import importlib.util
+import sys
+from pathlib import Path
+
+import pytest
+
+BENCHMARKS = Path(__file__).resolve().parent
+UTILS = BENCHMARKS.parent
+ROOT = UTILS.parent
+
+for path in (BENCHMARKS, UTILS):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
+
+from corpus import generate_corpus  # noqa: E402
+
+
+def load_script(path: Path, name: str):
+    """Imports a script whose file name is not a valid module name, like check-facs.py."""
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup('corpus', 'synthetic edition corpus')
+    group.addoption('--corpus-scales', default='1,10',
+                    help='comma separated scale factors of the synthetic corpus (1 ≈ a tenth of the edition)')
+    group.addoption('--corpus-dir', type=Path, help='keep the generated corpora in this directory')
+
+
+def pytest_generate_tests(metafunc):
+    if 'corpus' in metafunc.fixturenames:
+        scales = [int(scale) for scale in metafunc.config.getoption('corpus_scales').split(',')]
+        metafunc.parametrize('corpus', scales, indirect=True, ids=[f'{scale}x' for scale in scales], scope='session')
+
+
+@pytest.fixture(scope='session')
+def corpus(request, tmp_path_factory):
+    scale = request.param
+    corpus_dir = request.config.getoption('corpus_dir')
+    root = corpus_dir / f'scale-{scale}' if corpus_dir else tmp_path_factory.mktemp(f'corpus-{scale}')
+    return generate_corpus(root, scale)
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_configure(config):
+    # store the baselines next to the benchmarks, independent of the working directory
+    storage = getattr(config.option, 'benchmark_storage', None)
+    if storage and '://' not in storage and not Path(storage).is_absolute():
+        config.option.benchmark_storage = str(BENCHMARKS / storage)
+
+
+def rounds(corpus, base=5) -> int:
+    """Fewer rounds for the slow benchmarks on the larger corpora."""
+    return max(1, base // corpus.scale)
@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+
+"""
+Generates a synthetic edition corpus for the benchmarks.
+
+The corpus mimics the structure (not the content) of the files the utils read,
+so they can be benchmarked without the data submodule and a full build:
+
+- `www/downloads/faust.xml`: TEI text with sections, speeches, speakers,
+  stage directions, line groups, antilabial verses and textcrit notes,
+- `www/print/faust.all.html` and `www/print/variants/<group>.html`: the
+  reading text with data-n/-vargroup/-variants/-varcount attributes and the
+  variant apparatus, ten lines per variant group,
+- `www/data/genetic_bar_graph.json` and `www/data/document_metadata.js`,
+- `data/xml/archives.xml` with facsimile download rules, and the witness
+  metadata (`data/xml/document/…`) and textual transcripts
+  (`data/xml/transcript/…`),
+- `facsimile/`: metadata JSON, scaled JPEGs (levels 0–8 and preview) and tiles
+  for each page image, as produced by convert_facsimiles.py. All images share a
+  single rendered pyramid of a bright page on a dark background (hard linked
+  if possible); about 2% of the images are deliberately incomplete.
+
+The size is given as a scale factor: scale 1 is roughly a tenth of the
+edition (1200 verses, 30 witnesses with ~140 page images), so scale 10 is
+about the real edition, and scale 100 a stress test ten times its size.
+The output is deterministic for a given scale and seed.
+
+Usage: `corpus.py -s 10 /tmp/corpus-10`.
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+from dataclasses import dataclass
+from io import BytesIO
+from pathlib import Path
+
+import numpy as np
+from lxml import etree
+from lxml.builder import ElementMaker
+from PIL import Image
+
+VERSES = 1200
+WITNESSES = 30
+MAX_PAGES = 8
+VARGROUP_SIZE = 10
+IMAGE_SIZE = (512, 640)
+TILE_SIZE = 256
+ZOOM_LEVELS = 8
+INCOMPLETE_IMAGES = 50      # every 50th image misses a file
+
+TEI_NS = 'http://www.tei-c.org/ns/1.0'
+XHTML_NS = 'http://www.w3.org/1999/xhtml'
+FAUST_NS = 'http://www.faustedition.net/ns'
+
+ARCHIVES = {
+    'gsa': dict(downloadable='yes', **{'max-width': '300'}),
+    'fdh': dict(downloadable='yes', resolution='reduced'),
+    'ub_leipzig': dict(downloadable='yes', **{'max-dpi': '100'}),
+    'bodmer': dict(downloadable='no'),
+    'print': dict(downloadable='yes'),
+}
+SPEAKERS = ['Faust', 'Mephistopheles', 'Wagner', 'Gretchen', 'Marthe', 'Chor']
+WORDS = ('Ich Du er sie es wir Habe nun ach Philosophie Juristerey und Medicin leider auch Theologie durchaus studirt '
+         'mit heißem Bemühn Da steh ich nun armer Thor bin so klug als wie zuvor Heiße Magister Doktor gar zieh '
+         'schon an die zehen Jahr Herauf herab quer krumm meine Schüler bey der Nase herum seh daß wir nichts '
+         'wissen können Das will mir schier das Herz verbrennen Zwar bin gescheidter alle Laffen Pfaffen '
+         'Schreiber Mönch Gräfin Ähre Öl Übel').split()
+
+
+@dataclass
+class Corpus:
+    """Paths to the parts of a generated corpus."""
+    root: Path
+    scale: int
+
+    @property
+    def edition(self) -> Path:
+        """The edition directory, as expected by verse_stats"""
+        return self.root / 'www'
+
+    @property
+    def faust_xml(self) -> Path:
+        return self.edition / 'downloads' / 'faust.xml'
+
+    @property
+    def faust_all_html(self) -> Path:
+        return self.edition / 'print' / 'faust.all.html'
+
+    @property
+    def variants_dir(self) -> Path:
+        return self.edition / 'print' / 'variants'
+
+    @property
+    def bargraph(self) -> Path:
+        return self.edition / 'data' / 'genetic_bar_graph.json'
+
+    @property
+    def document_metadata(self) -> Path:
+        return self.edition / 'data' / 'document_metadata.js'
+
+    @property
+    def xml(self) -> Path:
+        return self.root / 'data' / 'xml'
+
+    @property
+    def archives(self) -> Path:
+        return self.xml / 'archives.xml'
+
+    @property
+    def facsimile(self) -> Path:
+        return self.root / 'facsimile'
+
+    def page_images(self) -> list[str]:
+        """All facsimile image paths (relative to facsimile/jpg, without level and extension)."""
+        with (self.root / 'images.json').open(encoding='utf-8') as f:
+            return json.load(f)
+
+
+class _Text:
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+
+    def line(self, words=(4, 9)) -> str:
+        return ' '.join(self.rng.choice(WORDS) for _ in range(self.rng.randint(*words)))
+
+    def variant(self, line: str) -> str:
+        words = line.split()
+        if words and self.rng.random() < 0.7:
+            words[self.rng.randrange(len(words))] = self.rng.choice(WORDS)
+        if self.rng.random() < 0.3:
+            words.append(self.rng.choice(WORDS))
+        return ' '.join(words)
+
+
+def _write(path: Path, tree_or_element, **kwargs):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    etree.ElementTree(tree_or_element).write(str(path), encoding='utf-8', xml_declaration=True, **kwargs)
+
+
+def _lines(scale: int, rng: random.Random) -> list[dict]:
+    """The 'lines' of the text: verses (some antilabial), speakers and stage directions, with section and speech."""
+    lines = []
+    verse_count = VERSES * scale
+    sections = max(1, verse_count // 150)
+    speech = 0
+    for n in range(1, verse_count + 1):
+        section = f'1.{1 + (n - 1) * sections // verse_count}'
+        if n == 1 or rng.random() < 0.08:
+            speech += 1
+            if rng.random() < 0.3:
+                lines.append(dict(n=f'before_{n}_a', element='stage', section=section, speech=speech))
+            lines.append(dict(n=f'before_{n}_b', element='speaker', section=section, speech=speech,
+                              speaker=rng.choice(SPEAKERS)))
+        if rng.random() < 0.03:
+            for part in 'imf':
+                lines.append(dict(n=f'{n}{part}', html_n=str(n), element='l', section=section, speech=speech))
+        else:
+            lines.append(dict(n=str(n), element='l', section=section, speech=speech))
+    return lines
+
+
+def write_text(corpus: Corpus, lines: list[dict], text: _Text, rng: random.Random) -> None:
+    """faust.xml, faust.all.html and the variant groups"""
+    T = ElementMaker(namespace=TEI_NS, nsmap={None: TEI_NS})
+    H = ElementMaker(namespace=XHTML_NS, nsmap={None: XHTML_NS})
+
+    body = T.body()
+    html_body = H.body()
+    sections = {}
+    speeches = {}
+    variant_groups = {}
+    html_lines = {}
+    for line in lines:
+        if line['section'] not in sections:
+            sections[line['section']] = T.div(n=line['section'])
+            body.append(sections[line['section']])
+        if line['speech'] not in speeches:
+            speeches[line['speech']] = T.sp()
+            sections[line['section']].append(speeches[line['speech']])
+        sp = speeches[line['speech']]
+        line['text'] = text.line((1, 2) if line['element'] == 'speaker' else (4, 9))
+
+        if line['element'] == 'speaker':
+            sp.append(T.speaker(line['speaker'], n=line['n']))
+        elif line['element'] == 'stage':
+            sp.append(T.stage(line['text'], n=line['n']))
+        else:
+            lg = sp[-1] if len(sp) and sp[-1].tag == f'{{{TEI_NS}}}lg' else None
+            if lg is None or rng.random() < 0.1:
+                lg = T.lg()
+                sp.append(lg)
+            l_el = T.l(line['text'], n=line['n'])
+            if rng.random() < 0.05:
+                l_el.append(T.note('Emendation', type='textcrit'))
+            lg.append(l_el)
+
+        html_n = line.get('html_n', line['n'])
+        if html_n in html_lines:
+            continue
+        group = f'{len(html_lines) // VARGROUP_SIZE:04d}'
+        variants = [text.variant(line['text']) for _ in range(rng.randint(1, 4))]
+        witnesses = rng.randint(len(variants), 12)
+        html_lines[html_n] = H.div(line['text'], {'class': 'verse', 'data-n': html_n, 'data-vargroup': group,
+                                                  'data-variants': str(len(variants)),
+                                                  'data-varcount': str(witnesses)})
+        html_body.append(html_lines[html_n])
+        variant_groups.setdefault(group, []).append(
+            H.div({'class': 'variants', 'data-n': html_n},
+                  *[H.div({'class': 'variant'}, variant, H.span(f'H P{rng.randrange(WITNESSES)}', {'class': 'sigils'}))
+                    for variant in variants],
+                  H.div(H.div(line['text'], {'class': 'verse'}), {'class': 'variant-lines'}),
+                  etree.Comment(' apparatus ')))
+
+    _write(corpus.faust_xml, T.TEI(T.teiHeader(T.fileDesc()), T.text(body)))
+    _write(corpus.faust_all_html, H.html(H.head(H.title('Faust')), html_body))
+    for group, divs in variant_groups.items():
+        _write(corpus.variants_dir / f'{group}.html', H.html(H.head(), H.body(*divs)))
+
+
+def _witnesses(scale: int, rng: random.Random) -> list[dict]:
+    witnesses = []
+    verse_count = VERSES * scale
+    for i in range(WITNESSES * scale):
+        repository = rng.choice(list(ARCHIVES))
+        sigil = f'{"D" if repository == "print" else "H"} P{i}' if rng.random() > 0.05 else f'H α {i}'
+        name = f'{repository}_{i:05d}'
+        start = rng.randint(1, verse_count)
+        end = min(verse_count, start + rng.randint(0, 400))
+        witnesses.append(dict(sigil=sigil, sigil_t=re.sub(r'[^A-Za-z0-9.-]', '_', sigil.replace('α', 'alpha')), name=name,
+                              repository=repository, pages=rng.randint(1, MAX_PAGES), start=start, end=end,
+                              print=repository == 'print'))
+    return witnesses
+
+
+def write_metadata(corpus: Corpus, witnesses: list[dict], rng: random.Random) -> list[str]:
+    """document_metadata.js, genetic_bar_graph.json, archives.xml, metadata and transcript XML. Returns the images."""
+    F = ElementMaker(namespace=FAUST_NS, nsmap={None: FAUST_NS})
+    T = ElementMaker(namespace=TEI_NS, nsmap={None: TEI_NS})
+
+    _write(corpus.archives, F.archives(*[F.archive(F.name(archive), F.facsimile(**rules), id=archive)
+                                         for archive, rules in ARCHIVES.items()]))
+    documents, bargraph, images = [], [], []
+    for witness in witnesses:
+        base = f'{witness["repository"]}/{witness["name"]}/'
+        pages = []
+        for page in range(1, witness['pages'] + 1):
+            img = f'{base}{page:04d}'
+            images.append(img)
+            pages.append(dict(doc=[dict(uri=f'faust://xml/transcript/{base}page_{page}.xml', img=[img])]))
+        documents.append(dict(sigil=witness['sigil_t'], base=base, type='archivalDocument', page=pages,
+                              sigils=dict(idno_faustedition=witness['sigil'], repository=witness['repository'])))
+        intervals = [dict(type='verseLine', start=witness['start'], end=witness['end'])]
+        if rng.random() < 0.2:
+            intervals.append(dict(type=rng.choice(['paralipomena', 'paralipomena_uncertain']),
+                                  start=witness['start'], end=min(witness['end'], witness['start'] + 20)))
+        bargraph.append(dict(sigil=witness['sigil'], print=witness['print'], intervals=intervals))
+
+        transcript_base = f'faust://xml/transcript/{base}'
+        _write(corpus.xml / 'document' / witness['repository'] / f'{witness["name"]}.xml',
+               F.archivalDocument(
+                   F.metadata(F.idno(witness['sigil'], type='faustedition'),
+                              F.idno(f'{witness["repository"].upper()} {witness["name"]}', type=witness['repository']),
+                              F.idno('none', type='wa_faust')),
+                   F.textTranscript({'{http://www.w3.org/XML/1998/namespace}base': transcript_base},
+                                    uri=f'{witness["name"]}.xml')))
+        _write(corpus.xml / 'transcript' / base / f'{witness["name"]}.xml',
+               T.TEI(T.text(T.body(*[T.l(f'Vers {n}', n=str(n)) for n in range(witness['start'], witness['end'] + 1)]))))
+
+    corpus.document_metadata.parent.mkdir(parents=True, exist_ok=True)
+    with corpus.document_metadata.open('wt', encoding='utf-8') as f:
+        f.write('var documentMetadata = ')
+        json.dump(dict(metadata=documents), f, ensure_ascii=False)
+        f.write(';\n')
+    with corpus.bargraph.open('wt', encoding='utf-8') as f:
+        json.dump(bargraph, f, ensure_ascii=False)
+    with (corpus.root / 'images.json').open('wt', encoding='utf-8') as f:
+        json.dump(images, f)
+    return images
+
+
+def _jpeg(image: Image.Image, **kwargs) -> bytes:
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', quality=80, **kwargs)
+    return buffer.getvalue()
+
+
+def facsimile_template(seed=42, size=IMAGE_SIZE):
+    """Renders the shared facsimile pyramid: a bright page on a dark background, a color chart below it."""
+    rng = np.random.default_rng(seed)
+    width, height = size
+    pixels = rng.normal(25, 3, (height, width)).clip(0, 255)
+    x, y, xx, yy = width // 10, height // 12, width - width // 8, height - height // 5
+    pixels[y:yy, x:xx] = rng.normal(200, 5, (yy - y, xx - x)).clip(0, 255)
+    pixels[yy + height // 40:yy + height // 15, x:x + width // 4] = 230
+    image = Image.fromarray(pixels.astype(np.uint8)).convert('RGB')
+
+    levels, tiles = [], {}
+    for level in range(ZOOM_LEVELS + 1):
+        levels.append(_jpeg(image, dpi=(300 / 2 ** level,) * 2))
+        for tx in range(math.ceil(image.width / TILE_SIZE)):
+            for ty in range(math.ceil(image.height / TILE_SIZE)):
+                tiles[level, tx, ty] = _jpeg(image.crop((tx * TILE_SIZE, ty * TILE_SIZE,
+                                                         min(image.width, (tx + 1) * TILE_SIZE),
+                                                         min(image.height, (ty + 1) * TILE_SIZE))))
+        image = image.resize(((image.width + 1) // 2, (image.height + 1) // 2))
+    preview = Image.open(BytesIO(levels[0]))
+    preview.thumbnail((240, 360))
+    return levels, _jpeg(preview), tiles
+
+
+def write_facsimiles(corpus: Corpus, images: list[str], rng: random.Random, seed=42):
+    """Writes the facsimile files for all images. They are hard links to a single template pyramid where possible."""
+    levels, preview, tiles = facsimile_template(seed)
+    metadata = json.dumps(dict(imageWidth=IMAGE_SIZE[0], imageHeight=IMAGE_SIZE[1], tileWidth=TILE_SIZE,
+                               tileHeight=TILE_SIZE, zoomLevels=ZOOM_LEVELS))
+    template = {'metadata/{}.json': metadata.encode(), 'jpg/{}_preview.jpg': preview}
+    template.update({f'jpg/{{}}_{level}.jpg': data for level, data in enumerate(levels)})
+    template.update({f'jpg_tiles/{{}}_{level}_{x}_{y}.jpg': data for (level, x, y), data in tiles.items()})
+    template_dir = corpus.root / 'facsimile-template'
+    template_files = {}
+    for i, (pattern, data) in enumerate(template.items()):
+        template_files[pattern] = template_dir / f'{i:03d}'
+        template_files[pattern].parent.mkdir(parents=True, exist_ok=True)
+        template_files[pattern].write_bytes(data)
+
+    link = True
+    for i, img in enumerate(images):
+        patterns = sorted(template)
+        if i % INCOMPLETE_IMAGES == INCOMPLETE_IMAGES // 2:
+            patterns.remove(rng.choice(patterns))
+        for pattern in patterns:
+            path = corpus.facsimile / pattern.format(img)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            if link:
+                try:
+                    os.link(template_files[pattern], path)
+                    continue
+                except OSError:
+                    link = False
+            path.write_bytes(template[pattern])
+
+
+def generate_corpus(root: Path, scale: int = 1, seed: int = 42, facsimiles: bool = True) -> Corpus:
+    """
+    Generates a synthetic corpus in root, unless a complete corpus with the same parameters is already there.
+    """
+    root = Path(root)
+    corpus = Corpus(root, scale)
+    marker = root / 'corpus.json'
+    parameters = dict(scale=scale, seed=seed, facsimiles=facsimiles, verses=VERSES, witnesses=WITNESSES)
+    if marker.exists() and json.loads(marker.read_text()) == parameters:
+        return corpus
+    root.mkdir(parents=True, exist_ok=True)
+    rng = random.Random(seed)
+    write_text(corpus, _lines(scale, rng), _Text(rng), rng)
+    images = write_metadata(corpus, _witnesses(scale, rng), rng)
+    if facsimiles:
+        write_facsimiles(corpus, images, rng, seed)
+    marker.write_text(json.dumps(parameters))
+    return corpus
+
+
+def main():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('output', type=Path, help='target directory')
+    p.add_argument('-s', '--scale', type=int, default=1, help='scale factor (1 ≈ a tenth of the edition)')
+    p.add_argument('--seed', type=int, default=42, help='random seed')
+    p.add_argument('--no-facsimiles', dest='facsimiles', action='store_false', help='skip the facsimile pyramids')
+    options = p.parse_args()
+    corpus = generate_corpus(options.output, options.scale, options.seed, options.facsimiles)
+    print(f'Generated scale {corpus.scale} corpus in {corpus.root}')
+
+
+if __name__ == '__main__':
+    main()
@@ -15,6 +15,8 @@ import pandas as pd
 import argparse
 import re
 
+from instrumentation import add_profile_arguments, profile, stage
+
 def count_in_file(filename):
     try:
         tree = etree.parse(filename)
@@ -193,11 +195,17 @@ def getargparser():
                       help='Keep unused characters in the table')
     font.add_argument('-m', '--missing', action='store_true',
                       help="Only include characters that are missing from at least one font")
+    add_profile_arguments(p)
     return p
 
 def main():
     parser = getargparser()
     options = parser.parse_args()
+    with profile('collect_chars', options):
+        summarize(parser, options)
+
+
+def summarize(parser, options):
     summary = None
     if options.directory and options.input_table:
         parser.error("Cannot combine -d and -i. Use --help for more info.")
@@ -209,67 +217,74 @@ def main():
         stats = None
         for directory in options.directory:
             print("Collecting characters in {} ...".format(directory))
-            dir_stat = collect_stats(directory, accept=options.accept)
+            with stage('parse'):
+                dir_stat = collect_stats(directory, accept=options.accept)
             if stats is None:
                 stats = dir_stat
             else:
                 stats.update(dir_stat)
 
         print("Summarizing over all files ...")
-        totals = sum_values(stats.values())
+        with stage('compute'):
+            totals = sum_values(stats.values())
 
         if options.by_char:
             fn = options.by_char
             if ".json" not in fn: fn += ".json"
             if not fn.endswith('.gz'): fn += '.gz'
             print("Writing by-char statistics to {}...".format(fn))
-            with gzip.open(fn, "wt", encoding="utf-8") as f:
+            with stage('write'), gzip.open(fn, "wt", encoding="utf-8") as f:
                 json.dump(ordered_by_char(file_by_char(stats), totals), f, indent=2,
                         ensure_ascii=False)
 
         if options.ranges:
-            with open(options.ranges, "w", encoding="UTF-8") as ranges:
+            with stage('write'), open(options.ranges, "w", encoding="UTF-8") as ranges:
                 intervs = intervals(map(ord, totals.keys()))
                 formatted = ("{:0>4X}-{:0>4X}".format(*i) for i in intervs)
                 ranges.write(",\n".join(formatted) + "\n")
 
         print("Preparing summary table ...")
         # now, prepare the support DF
-        summary = pd.DataFrame.from_records((
-            ("{:>04X}".format(ord(char)),
-             char if char >= " " else "",
-             unicodedata.name(char, None),
-             count) for char, count in totals.items()),
-            columns=['codepoint', 'character', 'name', 'count'],
-            index='codepoint')
+        with stage('compute'):
+            summary = pd.DataFrame.from_records((
+                ("{:>04X}".format(ord(char)),
+                 char if char >= " " else "",
+                 unicodedata.name(char, None),
+                 count) for char, count in totals.items()),
+                columns=['codepoint', 'character', 'name', 'count'],
+                index='codepoint')
 
     if options.input_table:
-        summary = pd.read_csv(options.input_table, sep='\t', index_col='codepoint')
+        with stage('load'):
+            summary = pd.read_csv(options.input_table, sep='\t', index_col='codepoint')
 
     if options.fonts:
         for font in options.fonts:
             print("Analyzing font {} ...".format(font))
-            support = font_support(font)
+            with stage('fonts'):
+                support = font_support(font)
             summary.loc[:,support.name] = support
 
-    if not(options.keep_unused):
-        summary.dropna(subset=['count'], inplace=True)
+    with stage('compute'):
+        if not(options.keep_unused):
+            summary.dropna(subset=['count'], inplace=True)
 
-    if options.missing:
-        summary = summary[~summary.character.isnull() &
-                          summary.iloc[:,3:].isnull().any(axis=1)]
+        if options.missing:
+            summary = summary[~summary.character.isnull() &
+                              summary.iloc[:,3:].isnull().any(axis=1)]
 
-    summary.sort_values(by='count', ascending=False, inplace=True)
+        summary.sort_values(by='count', ascending=False, inplace=True)
 
     for output in options.output:
         print("Saving summary to {} ...".format(output))
         ext = os.path.splitext(output)[1]
-        if ext == '.xls' or ext == '.xlsx':
-            summary.to_excel(output)
-        elif ext == '.html':
-            summary.to_html(output)
-        else:
-            summary.to_csv(output, sep='\t', encoding='utf-8')
+        with stage('write'):
+            if ext == '.xls' or ext == '.xlsx':
+                summary.to_excel(output)
+            elif ext == '.html':
+                summary.to_html(output)
+            else:
+                summary.to_csv(output, sep='\t', encoding='utf-8')
 
 
 if __name__ == "__main__":
@@ -0,0 +1,610 @@
+#!/usr/bin/env python3
+
+"""
+Converts the original TIFF scans to the JPEG pyramids used by the facsimile viewer.
+
+For each `<input>/<path>.tif`, the following files are created below the output directory:
+
+- `jpg/<path>_0.jpg` … `jpg/<path>_8.jpg`: the image at zoom levels 0 (full size) to 8, each level half the size of the previous
+- `jpg/<path>_preview.jpg`: a preview image fitting into 240×360 pixels
+- `jpg_tiles/<path>_<level>_<x>_<y>.jpg`: 256×256 tiles for each zoom level, or, with `--pack-tiles`,
+  a single `jpg_tiles/<path>.tilepack` containing all tiles (see tilepack.py)
+- `metadata/<path>.json`: image size, tile size and number of zoom levels
+- with `--formats webp,avif`: additional variants of the scaled images and tiles in `webp/` and
+  `webp_tiles/` (`avif/`, `avif_tiles/`), named like the JPEG files with the format's extension. The
+  available formats are then listed in the metadata JSON's `formats` entry.
+
+This is the same layout convert.sh used to produce with ImageMagick, but each
+TIFF is decoded only once: all zoom levels are derived in memory by successive
+halving, and the scaled images and tiles are encoded directly from these
+buffers. Images are processed in parallel.
+
+The conversion is incremental: a manifest (`.manifest.json` in the output
+directory) records, for each source image, its size, modification time and
+SHA-256 hash, together with what has been produced from it. Sources whose size
+and modification time are unchanged are skipped without being read; sources
+with a changed hash are reconverted. Each image is converted into a staging
+directory and then moved into place, the metadata JSON last, and files that
+are no longer produced – including all output for deleted sources – are
+removed. Output from before the manifest existed is adopted if its metadata
+JSON is newer than the source.
+
+The manifest also records the encoded bytes per format and zoom level, from
+which `--report` creates a comparison of the formats per zoom level and, given
+the document metadata, per witness.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from dataclasses import asdict, dataclass, replace
+from io import BytesIO
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Optional
+
+from PIL import Image, features
+from tqdm import tqdm
+
+from document_metadata import load_page_images
+
+from tilepack import PACK_SUFFIX, write_pack
+
+logger = logging.getLogger(__name__)
+
+Image.MAX_IMAGE_PIXELS = None   # our scans are large, and trusted
+
+MANIFEST_NAME = '.manifest.json'
+MANIFEST_VERSION = 1
+MANIFEST_SAVE_INTERVAL = 100    # images
+STAGING_NAME = '.staging'
+
+VARIANT_FORMATS = ('webp', 'avif')     # in addition to jpg
+_PIL_FORMATS = {'jpg': 'JPEG', 'webp': 'WEBP', 'avif': 'AVIF'}
+
+
+@dataclass
+class PyramidConfig:
+    zoom_levels: int = 8
+    tile_width: int = 256
+    tile_height: int = 256
+    preview_size: tuple[int, int] = (240, 360)
+    quality: int = 92
+    pack_tiles: bool = False    # write a tile pack (see tilepack.py) instead of single tile files
+    formats: tuple[str, ...] = ()  # variant formats in addition to jpg, from VARIANT_FORMATS
+    webp_quality: int = 80
+    avif_quality: int = 60
+
+    @property
+    def all_formats(self) -> tuple[str, ...]:
+        return ('jpg',) + tuple(self.formats)
+
+    def save_options(self, fmt: str) -> dict:
+        if fmt == 'webp':
+            return dict(quality=self.webp_quality, method=4)
+        elif fmt == 'avif':
+            return dict(quality=self.avif_quality, speed=6)
+        return dict(quality=self.quality)
+
+
+def format_available(fmt: str) -> bool:
+    """Checks whether Pillow can write the given format."""
+    if fmt == 'avif' and not features.check('avif'):
+        try:
+            import pillow_avif  # noqa: F401 – registers the AVIF plugin for Pillow < 11.2
+        except ImportError:
+            return False
+    elif fmt == 'webp' and not features.check('webp'):
+        return False
+    Image.init()
+    return _PIL_FORMATS[fmt] in Image.SAVE
+
+
+class FacsimileLayout:
+    """Paths of the files in the facsimile output directory."""
+
+    def __init__(self, output_dir: Path):
+        self.output_dir = Path(output_dir)
+        self.jpg = self.output_dir / 'jpg'
+        self.tiles = self.output_dir / 'jpg_tiles'
+        self.metadata = self.output_dir / 'metadata'
+
+    def scaled(self, rel: Path, level, fmt='jpg') -> Path:
+        return self.output_dir / fmt / f'{rel}_{level}.{fmt}'
+
+    def preview(self, rel: Path) -> Path:
+        return self.jpg / f'{rel}_preview.jpg'
+
+    def tile(self, rel: Path, level: int, x: int, y: int, fmt='jpg') -> Path:
+        return self.output_dir / f'{fmt}_tiles' / f'{rel}_{level}_{x}_{y}.{fmt}'
+
+    def pack(self, rel: Path, fmt='jpg') -> Path:
+        return self.output_dir / f'{fmt}_tiles' / f'{rel}{PACK_SUFFIX}'
+
+    def json(self, rel: Path) -> Path:
+        return self.metadata / f'{rel}.json'
+
+    def files(self, rel: Path, width: int, height: int, config: PyramidConfig):
+        """Yields all files of the conversion of an image with the given size. The JSON file comes last."""
+        yield self.preview(rel)
+        for fmt in config.all_formats:
+            if config.pack_tiles:
+                yield self.pack(rel, fmt)
+            for level, (level_width, level_height) in enumerate(level_sizes(width, height, config.zoom_levels)):
+                yield self.scaled(rel, level, fmt)
+                if config.pack_tiles:
+                    continue
+                for x in range(-(-level_width // config.tile_width)):
+                    for y in range(-(-level_height // config.tile_height)):
+                        yield self.tile(rel, level, x, y, fmt)
+        yield self.json(rel)
+
+
+def level_sizes(width: int, height: int, zoom_levels: int) -> list[tuple[int, int]]:
+    """Returns the image sizes at zoom levels 0 … zoom_levels, as produced by pyramid()."""
+    sizes = [(width, height)]
+    for _ in range(zoom_levels):
+        width, height = -(-width // 2), -(-height // 2)
+        sizes.append((width, height))
+    return sizes
+
+
+def find_sources(input_dir: Path, pattern='*.tif'):
+    """Yields (source, rel) for all source images below input_dir. rel is the path relative to input_dir without suffix."""
+    for source in sorted(Path(input_dir).rglob(pattern)):
+        if source.is_file():
+            yield source, source.relative_to(input_dir).with_suffix('')
+
+
+def _jpeg_compatible(img: Image.Image) -> Image.Image:
+    if img.mode in ('RGB', 'L'):
+        return img
+    if img.mode.startswith('I;16') or img.mode == 'I':
+        return img.point(lambda value: value * (1 / 256)).convert('L')
+    return img.convert('RGB')
+
+
+def pyramid(img: Image.Image, zoom_levels: int) -> list[Image.Image]:
+    """Returns the image at zoom levels 0 … zoom_levels, each level half the size (rounded up) of the previous."""
+    levels = [img]
+    for _ in range(zoom_levels):
+        levels.append(levels[-1].reduce(2))
+    return levels
+
+
+def preview(levels: list[Image.Image], size: tuple[int, int]) -> Image.Image:
+    """Creates the preview image from the smallest zoom level that is still larger than the preview."""
+    full = levels[0]
+    scale = min(size[0] / full.width, size[1] / full.height, 1)
+    target_width, target_height = round(full.width * scale), round(full.height * scale)
+    source = full
+    for level in levels:
+        if level.width < target_width or level.height < target_height:
+            break
+        source = level
+    result = source.copy()
+    result.thumbnail(size, Image.LANCZOS)
+    return result
+
+
+def tiles(img: Image.Image, tile_width: int, tile_height: int):
+    """Yields (x, y, tile) for all tiles of the image. Tiles at the right and bottom edges may be smaller."""
+    for x, left in enumerate(range(0, img.width, tile_width)):
+        for y, top in enumerate(range(0, img.height, tile_height)):
+            yield x, y, img.crop((left, top, min(left + tile_width, img.width), min(top + tile_height, img.height)))
+
+
+def image_metadata(width: int, height: int, config: PyramidConfig) -> dict:
+    metadata = {
+        "imageWidth": width,
+        "imageHeight": height,
+        "tileWidth": config.tile_width,
+        "tileHeight": config.tile_height,
+        "zoomLevels": config.zoom_levels
+    }
+    if config.formats:
+        metadata["formats"] = list(config.all_formats)
+    return metadata
+
+
+def _encode(img: Image.Image, fmt: str, config: PyramidConfig) -> bytes:
+    buffer = BytesIO()
+    img.save(buffer, _PIL_FORMATS[fmt], **config.save_options(fmt))
+    return buffer.getvalue()
+
+
+def _save(img: Image.Image, path: Path, fmt: str, config: PyramidConfig) -> int:
+    data = _encode(img, fmt, config)
+    path.write_bytes(data)
+    return len(data)
+
+
+def convert_image(source: Path, rel: Path, layout: FacsimileLayout, config: PyramidConfig) -> dict:
+    """
+    Converts a single source image to the scaled images, the preview, the tiles, and the JSON metadata.
+
+    The scaled images and tiles are written in each of config.all_formats. If config.pack_tiles is set,
+    the tiles are written to a single tile pack per format instead of separate files.
+    The JSON file is written last, so its existence marks a complete conversion.
+
+    Returns:
+        the image metadata, and the encoded bytes as dictionary format → {'scaled': [bytes per level],
+        'tiles': [bytes per level]}
+    """
+    with Image.open(source) as img:
+        img.seek(0)
+        img.load()
+        width, height = img.size
+        levels = pyramid(_jpeg_compatible(img), config.zoom_levels)
+
+    layout.preview(rel).parent.mkdir(parents=True, exist_ok=True)
+    _save(preview(levels, config.preview_size), layout.preview(rel), 'jpg', config)
+    sizes = {}
+    for fmt in config.all_formats:
+        layout.scaled(rel, 0, fmt).parent.mkdir(parents=True, exist_ok=True)
+        layout.tile(rel, 0, 0, 0, fmt).parent.mkdir(parents=True, exist_ok=True)
+        sizes[fmt] = {'scaled': [], 'tiles': []}
+        packed = {}
+        for level, scaled in enumerate(levels):
+            sizes[fmt]['scaled'].append(_save(scaled, layout.scaled(rel, level, fmt), fmt, config))
+            tile_bytes = 0
+            for x, y, tile in tiles(scaled, config.tile_width, config.tile_height):
+                if config.pack_tiles:
+                    packed[level, x, y] = _encode(tile, fmt, config)
+                    tile_bytes += len(packed[level, x, y])
+                else:
+                    tile_bytes += _save(tile, layout.tile(rel, level, x, y, fmt), fmt, config)
+            sizes[fmt]['tiles'].append(tile_bytes)
+        if config.pack_tiles:
+            write_pack(layout.pack(rel, fmt), width, height, config.tile_width, config.tile_height,
+                       config.zoom_levels, lambda level, x, y: packed.get((level, x, y)))
+
+    metadata = image_metadata(width, height, config)
+    json_file = layout.json(rel)
+    json_file.parent.mkdir(parents=True, exist_ok=True)
+    with json_file.open('wt') as f:
+        json.dump(metadata, f, indent=2)
+    return metadata, sizes
+
+
+def commit(rel: Path, staging: FacsimileLayout, layout: FacsimileLayout, width: int, height: int,
+           config: PyramidConfig, previous: Optional[list[Path]] = None):
+    """
+    Moves a conversion from the staging layout to its final location.
+
+    The old JSON file is removed first and the new one is moved last, so the
+    JSON file only exists while the image's files are complete. Files from the
+    previous conversion that are not part of the new one are removed.
+    """
+    files = list(layout.files(rel, width, height, config))
+    layout.json(rel).unlink(missing_ok=True)
+    for staged, final in zip(staging.files(rel, width, height, config), files):
+        final.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(staged, final)
+    if previous:
+        remove_files(set(previous).difference(files))
+
+
+def remove_files(files):
+    for file in files:
+        try:
+            os.unlink(file)
+        except FileNotFoundError:
+            pass
+
+
+# Manifest
+
+def file_hash(path: Path) -> str:
+    digest = hashlib.sha256()
+    with path.open('rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _config_record(config: PyramidConfig) -> dict:
+    return json.loads(json.dumps(asdict(config)))
+
+
+def _config_from_record(record: dict) -> PyramidConfig:
+    return PyramidConfig(**dict(record, preview_size=tuple(record['preview_size']),
+                                formats=tuple(record.get('formats', ()))))
+
+
+def _same_config(entry: dict, config: PyramidConfig) -> bool:
+    return _config_from_record(entry['config']) == config
+
+
+def _entry_files(rel: Path, entry: dict, layout: FacsimileLayout) -> list[Path]:
+    return list(layout.files(rel, entry['width'], entry['height'], _config_from_record(entry['config'])))
+
+
+def _stat_matches(stat: os.stat_result, entry: dict) -> bool:
+    return entry.get('size') == stat.st_size and entry.get('mtime_ns') == stat.st_mtime_ns
+
+
+def load_manifest(path: Path) -> dict:
+    """Loads the conversion manifest, or returns an empty one."""
+    try:
+        with path.open(encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+        logger.warning('Ignoring manifest %s with unknown version %s', path, manifest.get('version'))
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        logger.warning('Ignoring broken manifest %s: %s', path, e)
+    return {'version': MANIFEST_VERSION, 'images': {}}
+
+
+def save_manifest(manifest: dict, path: Path):
+    tmp_file = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with tmp_file.open('wt', encoding='utf-8') as f:
+        json.dump(manifest, f, separators=(',', ':'), sort_keys=True)
+    os.replace(tmp_file, path)
+
+
+def legacy_entry(source: Path, rel: Path, layout: FacsimileLayout, config: PyramidConfig) -> Optional[dict]:
+    """
+    Describes a conversion that is not in the manifest, from its metadata JSON.
+
+    This is used for output from earlier versions of the conversion. The
+    quality and preview size are not recorded there and are assumed to match
+    the given config.
+
+    Returns:
+        a manifest entry without the source fields, or None if there is no (complete) conversion
+    """
+    json_file = layout.json(rel)
+    try:
+        with json_file.open(encoding='utf-8') as f:
+            metadata = json.load(f)
+        legacy_config = replace(config, zoom_levels=metadata['zoomLevels'],
+                                tile_width=metadata['tileWidth'], tile_height=metadata['tileHeight'],
+                                pack_tiles=layout.pack(rel).exists(),
+                                formats=tuple(fmt for fmt in metadata.get('formats', ()) if fmt != 'jpg'))
+        return {'width': metadata['imageWidth'], 'height': metadata['imageHeight'],
+                'config': _config_record(legacy_config),
+                'outdated': json_file.stat().st_mtime_ns < source.stat().st_mtime_ns}
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _update_job(args):
+    """
+    Brings the output for a single source image up to date.
+
+    Returns:
+        (rel, manifest entry, converted, error)
+    """
+    source, rel, entry, output_dir, staging_dir, config, force = args
+    layout = FacsimileLayout(output_dir)
+    try:
+        stat = source.stat()
+        record = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_hash(source)}
+        if entry is None:
+            entry = legacy_entry(source, rel, layout, config)
+            if entry is not None and not entry.pop('outdated'):
+                entry['sha256'] = record['sha256']
+        if not force and entry and entry.get('sha256') == record['sha256'] and _same_config(entry, config):
+            return rel, dict(entry, **record), False, None
+
+        previous = _entry_files(rel, entry, layout) if entry else None
+        with tempfile.TemporaryDirectory(dir=staging_dir) as tmp:
+            staging = FacsimileLayout(Path(tmp))
+            metadata, sizes = convert_image(source, rel, staging, config)
+            width, height = metadata['imageWidth'], metadata['imageHeight']
+            commit(rel, staging, layout, width, height, config, previous)
+        return rel, dict(record, width=width, height=height, config=_config_record(config), bytes=sizes), True, None
+    except Exception as e:
+        return rel, None, False, e
+
+
+def prune(images: dict, orphans, layout: FacsimileLayout):
+    """Removes the output for the given manifest entries, and the entries."""
+    for key in orphans:
+        logger.info('Removing output for deleted source %s', key)
+        remove_files(_entry_files(Path(key), images.pop(key), layout))
+
+
+def convert_all(input_dir: Path, output_dir: Path, config: PyramidConfig, pattern='*.tif', processes=None, force=False,
+                manifest_file: Optional[Path] = None, prune_orphans=True):
+    """
+    Converts all source images below input_dir that are new or have changed since their last conversion, in parallel.
+
+    The state of the conversion is recorded in a manifest, by default `.manifest.json` in the output directory.
+    Each conversion is written to a staging directory first and then moved to its final location.
+
+    Args:
+        manifest_file: the manifest to use, default: output_dir/.manifest.json
+        prune_orphans: remove the output for source images that have been converted before but no longer exist
+
+    Returns:
+        list of (relative path, exception) for the images that failed to convert
+    """
+    output_dir = Path(output_dir)
+    layout = FacsimileLayout(output_dir)
+    manifest_file = Path(manifest_file) if manifest_file else output_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_file)
+    images = manifest['images']
+
+    staging_dir = output_dir / STAGING_NAME
+    shutil.rmtree(staging_dir, ignore_errors=True)     # leftovers from interrupted runs
+    staging_dir.mkdir(parents=True)
+
+    jobs = []
+    seen = set()
+    for source, rel in find_sources(input_dir, pattern):
+        key = rel.as_posix()
+        seen.add(key)
+        entry = images.get(key)
+        if not force and entry and _same_config(entry, config) and _stat_matches(source.stat(), entry):
+            continue
+        jobs.append((source, rel, entry, output_dir, staging_dir, config, force))
+
+    orphans = images.keys() - seen
+    if orphans and prune_orphans:
+        if seen:
+            prune(images, orphans, layout)
+        else:
+            logger.warning('No source images found in %s, not removing the output for %d images',
+                           input_dir, len(orphans))
+
+    logger.info('Checking %d of %d images from %s for conversion to %s ...',
+                len(jobs), len(seen), input_dir, output_dir)
+    failures = []
+    converted = 0
+    try:
+        with Pool(processes, maxtasksperchild=64) as pool:
+            for done, (rel, entry, was_converted, error) in enumerate(
+                    tqdm(pool.imap_unordered(_update_job, jobs), total=len(jobs), unit='image'), start=1):
+                if error is not None:
+                    logger.error('Failed to convert %s: %s', rel, error)
+                    failures.append((rel, error))
+                else:
+                    images[rel.as_posix()] = entry
+                    converted += was_converted
+                if done % MANIFEST_SAVE_INTERVAL == 0:
+                    save_manifest(manifest, manifest_file)
+    finally:
+        save_manifest(manifest, manifest_file)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+    logger.info('%d images converted, %d failed, %d unchanged', converted, len(failures), len(seen) - converted - len(failures))
+    return failures
+
+
+def size_report(manifest: dict, formats: tuple[str, ...], page_images=None) -> dict:
+    """
+    Compares the encoded bytes of the given formats per zoom level and per witness, using the sizes recorded in the manifest.
+
+    Only images that have been converted to all of the formats are considered.
+
+    Args:
+        manifest: the conversion manifest
+        formats: the formats to compare, the first one is the reference (usually jpg)
+        page_images: the flattened document metadata (see document_metadata.py), for the per witness comparison
+
+    Returns:
+        dictionary with the number of images, the bytes and ratios per level, and the bytes and ratios per witness
+    """
+    reference = formats[0]
+    levels = {}
+    per_image = {}
+    skipped = 0
+    for key, entry in manifest['images'].items():
+        sizes = entry.get('bytes', {})
+        if not all(fmt in sizes for fmt in formats):
+            skipped += 1
+            continue
+        per_image[key] = {fmt: sum(sizes[fmt]['scaled']) + sum(sizes[fmt]['tiles']) for fmt in formats}
+        for fmt in formats:
+            for level, (scaled, tiles) in enumerate(zip(sizes[fmt]['scaled'], sizes[fmt]['tiles'])):
+                level_bytes = levels.setdefault(level, {}).setdefault(fmt, {'scaled': 0, 'tiles': 0})
+                level_bytes['scaled'] += scaled
+                level_bytes['tiles'] += tiles
+
+    def with_ratios(total_bytes: dict) -> dict:
+        result = dict(total_bytes)
+        for fmt in formats[1:]:
+            if total_bytes[reference]:
+                result[fmt + '_ratio'] = round(total_bytes[fmt] / total_bytes[reference], 4)
+        return result
+
+    report = dict(formats=list(formats), images=len(per_image), images_without_sizes=skipped, levels={})
+    for level in sorted(levels):
+        report['levels'][level] = {kind: with_ratios({fmt: levels[level][fmt][kind] for fmt in formats})
+                                   for kind in ('scaled', 'tiles')}
+    report['total'] = with_ratios({fmt: sum(image[fmt] for image in per_image.values()) for fmt in formats})
+
+    if page_images is not None:
+        witness_images = {}
+        for page_image in page_images:
+            witness_images.setdefault(page_image.sigil, set()).add(page_image.img)
+        report['witnesses'] = {}
+        for sigil, imgs in sorted(witness_images.items(), key=lambda item: str(item[0])):
+            imgs = [img for img in imgs if img in per_image]
+            if imgs:
+                report['witnesses'][sigil] = dict(
+                        images=len(imgs),
+                        **with_ratios({fmt: sum(per_image[img][fmt] for img in imgs) for fmt in formats}))
+    return report
+
+
+def log_size_report(report: dict):
+    formats = report['formats']
+    logger.info('Bytes of %d images: %s', report['images'],
+                ', '.join(f'{fmt} {report["total"][fmt]:,}' for fmt in formats))
+    for level, level_report in report['levels'].items():
+        logger.info('  level %s tiles: %s', level,
+                    ', '.join(f'{fmt} {level_report["tiles"][fmt]:,}'
+                              + (f' ({level_report["tiles"][fmt + "_ratio"]:.0%})'
+                                 if fmt + '_ratio' in level_report['tiles'] else '')
+                              for fmt in formats))
+
+
+def getargparser():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('input_dir', type=Path, help='directory containing the original scans, in subdirectories')
+    p.add_argument('output_dir', type=Path, help='target directory for the jpg, jpg_tiles and metadata directories')
+    p.add_argument('-g', '--glob', default='*.tif', help='file name pattern for the source images')
+    p.add_argument('-z', '--zoom-levels', type=int, default=PyramidConfig.zoom_levels,
+                   help='number of zoom levels beyond the original size')
+    p.add_argument('-t', '--tile-size', type=int, default=PyramidConfig.tile_width, help='width and height of the tiles')
+    p.add_argument('-q', '--quality', type=int, default=PyramidConfig.quality, help='JPEG quality')
+    p.add_argument('-p', '--pack-tiles', action='store_true',
+                   help=f'write one tile pack (jpg_tiles/<path>{PACK_SUFFIX}, see tilepack.py) per image instead of '
+                        'single tile files')
+    p.add_argument('-F', '--formats', default='',
+                   help=f'comma separated list of additional formats for scaled images and tiles ({", ".join(VARIANT_FORMATS)})')
+    p.add_argument('--webp-quality', type=int, default=PyramidConfig.webp_quality, help='WebP quality')
+    p.add_argument('--avif-quality', type=int, default=PyramidConfig.avif_quality, help='AVIF quality')
+    p.add_argument('-j', '--jobs', type=int, help='number of parallel conversions (default: number of CPUs)')
+    p.add_argument('-f', '--force', action='store_true', help='convert images even if they have not changed')
+    p.add_argument('-m', '--manifest', type=Path,
+                   help=f'manifest recording the converted images (default: {MANIFEST_NAME} in the output directory)')
+    p.add_argument('--no-prune', dest='prune', action='store_false',
+                   help='keep the output for source images that no longer exist')
+    p.add_argument('-r', '--report', type=Path,
+                   help='write a JSON report comparing the bytes of the formats per zoom level (and witness) to this file')
+    p.add_argument('-d', '--document-metadata', type=Path,
+                   help='document_metadata.js[on], to include a comparison per witness in the report')
+    return p
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    options = getargparser().parse_args()
+    if options.zoom_levels < 1:
+        getargparser().error('zoom levels must be larger than 0')
+    formats = tuple(fmt.strip().lower() for fmt in options.formats.split(',') if fmt.strip())
+    for fmt in formats:
+        if fmt not in VARIANT_FORMATS:
+            getargparser().error(f'unknown format {fmt}, choose from {", ".join(VARIANT_FORMATS)}')
+        if not format_available(fmt):
+            getargparser().error(f'Pillow cannot write {fmt} in this installation')
+    config = PyramidConfig(zoom_levels=options.zoom_levels,
+                           tile_width=options.tile_size, tile_height=options.tile_size,
+                           quality=options.quality, pack_tiles=options.pack_tiles,
+                           formats=formats, webp_quality=options.webp_quality, avif_quality=options.avif_quality)
+    failures = convert_all(options.input_dir, options.output_dir, config, options.glob, options.jobs, options.force,
+                           options.manifest, options.prune)
+    if options.report:
+        manifest = load_manifest(options.manifest or options.output_dir / MANIFEST_NAME)
+        page_images = load_page_images(options.document_metadata) if options.document_metadata else None
+        report = size_report(manifest, config.all_formats, page_images)
+        log_size_report(report)
+        with options.report.open('wt', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    if failures:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -4,36 +4,244 @@ from skimage.io import imread
 from skimage.filters import gaussian, threshold_otsu
 from skimage.segmentation import clear_border
 from skimage.measure import label, regionprops
+from PIL import Image
 from pathlib import Path
+from dataclasses import dataclass, field
 from os import fspath
+import os
 import argparse
 from joblib import Parallel, delayed
+import numpy as np
+import re
 import sys
 import json
 from tqdm import tqdm
 
+from instrumentation import add_profile_arguments, profile, stage
+
+SIGMA = 10
+THRESHOLD = 0.2  # threshold_otsu(image)
+_LEVEL_0 = re.compile(r'_0(\.[^.]+)$')
+
 
 def find_page_in(imfile):
     image = imread(fspath(imfile), as_gray=True)
-    image = gaussian(image, sigma=10)
-    thresh = 0.2 #threshold_otsu(image)
-    bw = image > thresh
+    image = gaussian(image, sigma=SIGMA)
+    return _largest_bbox(image > THRESHOLD)
+
+
+def _largest_bbox(bw):
+    """
+    Returns the bounding box (x, y, xx, yy) of the connected component of bw with the largest bounding box.
+    """
     labels = label(bw)
     regions = regionprops(labels)
-    largest = max(regions, key=lambda rp: rp.bbox_area)
-    y, x, yy, xx = largest.bbox
+    y, x, yy, xx = max((region.bbox for region in regions), key=lambda bbox: (bbox[2] - bbox[0]) * (bbox[3] - bbox[1]))
     return x, y, xx, yy
 
 
-def process_dir(path, glob='*_0.jpg', verbose=1):
-    files = list(path.glob(glob))
-    results = parallel(delayed(find_page_in)(file) for file in tqdm(files,
-                                                                    unit='image',
-                                                                    desc=f'Analyzing images in {path.stem}',
-                                                                    colour='blue',
-                                                                    leave=False))
-    return dict(zip(files, results))
+def scaled_image(imfile: Path, level: int):
+    """
+    Loads a version of imfile scaled down by 2**level, as grayscale array.
+
+    If imfile is the level 0 image of a facsimile pyramid (`*_0.jpg`) and the
+    file for the requested level exists, this is used. Otherwise, imfile is
+    decoded using JPEG draft mode, i.e. the decoder does the downscaling.
+
+    Returns:
+        the grayscale image, and the width and height of imfile
+    """
+    imfile = Path(imfile)
+    with Image.open(imfile) as img:
+        size = img.size
+        scaled_file = imfile.with_name(_LEVEL_0.sub(rf'_{level}\1', imfile.name))
+        if scaled_file != imfile and scaled_file.exists():
+            with Image.open(scaled_file) as scaled:
+                return np.asarray(scaled.convert('L')), size
+        target = (max(1, size[0] >> level), max(1, size[1] >> level))
+        img.draft('L', target)
+        img = img.convert('L')
+        factor = min(img.size[0] // target[0], img.size[1] // target[1])
+        if factor > 1:
+            img = img.reduce(factor)
+        return np.asarray(img), size
+
+
+def find_page_scaled(imfile, level=3, refine=False, margin=None):
+    """
+    Like find_page_in, but detects the page on a version of the image that is
+    scaled down by 2**level and scales the result back to the original size.
+
+    Args:
+        imfile: the (full resolution) image file
+        level: the zoom level to use for detection
+        refine: if true, refine each edge of the bounding box at full resolution,
+            searching only a narrow band around the edge found at the lower resolution
+        margin: half width of the refinement band in full resolution pixels, default: twice the scale factor
+    """
+    image, (width, height) = scaled_image(imfile, level)
+    scale_y = height / image.shape[0]
+    scale_x = width / image.shape[1]
+    image = gaussian(image, sigma=max(SIGMA / max(scale_x, scale_y), 0.5))
+    x, y, xx, yy = _largest_bbox(image > THRESHOLD)
+    bbox = (int(x * scale_x), int(y * scale_y),
+            min(width, int(np.ceil(xx * scale_x))), min(height, int(np.ceil(yy * scale_y))))
+    if refine:
+        if margin is None:
+            margin = int(2 * max(scale_x, scale_y))
+        with Image.open(imfile) as img:
+            full = np.asarray(img.convert('L'))
+        bbox = _refine_bbox(full, bbox, margin)
+    return bbox
+
+
+def _refine_bbox(image, bbox, margin, sigma=SIGMA):
+    """
+    Moves each edge of bbox to the outermost bright pixel within ±margin pixels of the edge.
+    """
+    height, width = image.shape
+    x, y, xx, yy = bbox
+    pad = int(3 * sigma)
+
+    def bright(y0, y1, x0, x1):
+        """Thresholded, smoothed region of the image. The filter sees a padded region to avoid boundary effects."""
+        py0, py1, px0, px1 = max(0, y0 - pad), min(height, y1 + pad), max(0, x0 - pad), min(width, x1 + pad)
+        smoothed = gaussian(image[py0:py1, px0:px1], sigma=sigma)
+        return smoothed[y0 - py0:y1 - py0, x0 - px0:x1 - px0] > THRESHOLD
 
+    rows = max(0, y - margin), min(height, yy + margin)
+    cols = max(0, x - margin), min(width, xx + margin)
+
+    band = max(0, x - margin), min(width, x + margin)
+    hits = np.flatnonzero(bright(*rows, *band).any(axis=0))
+    new_x = band[0] + int(hits[0]) if hits.size else x
+
+    band = max(0, xx - margin), min(width, xx + margin)
+    hits = np.flatnonzero(bright(*rows, *band).any(axis=0))
+    new_xx = band[0] + int(hits[-1]) + 1 if hits.size else xx
+
+    band = max(0, y - margin), min(height, y + margin)
+    hits = np.flatnonzero(bright(*band, *cols).any(axis=1))
+    new_y = band[0] + int(hits[0]) if hits.size else y
+
+    band = max(0, yy - margin), min(height, yy + margin)
+    hits = np.flatnonzero(bright(*band, *cols).any(axis=1))
+    new_yy = band[0] + int(hits[-1]) + 1 if hits.size else yy
+
+    return new_x, new_y, new_xx, new_yy
+
+
+def find_page(imfile, level=0, refine=False):
+    """Finds the page in imfile, at full resolution for level 0, else using find_page_scaled."""
+    if level > 0:
+        return find_page_scaled(imfile, level, refine)
+    else:
+        return find_page_in(imfile)
+
+
+@dataclass
+class _Folder:
+    """Bookkeeping for a folder whose images are being analyzed."""
+    output: Path
+    remaining: int
+    bboxes: dict = field(default_factory=dict)
+
+
+def _analyze(folder, file, level, refine):
+    try:
+        return folder, file, find_page(file, level, refine), None
+    except Exception as e:
+        return folder, file, None, e
+
+
+def read_bboxes(outpath: Path) -> dict:
+    """Reads an existing output file. Returns an empty dictionary if it does not exist or is broken."""
+    try:
+        with outpath.open() as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        tqdm.write(f'Ignoring broken {outpath}: {e}')
+        return {}
+
+
+def _jobs(folders, options, clean_path, pending: dict, progress: tqdm):
+    """
+    Lazily enumerates the images in all folders that need to be analyzed.
+
+    Unless options.force is set, an existing output file is reused: only images that are
+    missing from it or that are newer than it are analyzed, and entries for images that no
+    longer exist are dropped. Folders in which nothing needs to be analyzed are finished
+    immediately. Each other folder is registered in pending before its first image is yielded.
+    Folders are only processed once, even if they are given repeatedly or found by overlapping
+    recursive searches.
+    """
+    seen = set()
+    for folder in folders:
+        resolved = folder.resolve()
+        if resolved in seen:
+            continue
+        seen.add(resolved)
+        outpath = Path(options.output.format_map(dict(folder=folder, dirname=folder.name)))
+        files = {clean_path(file): file for file in sorted(folder.glob(options.glob))}
+        if options.force or not outpath.exists():
+            bboxes = {}
+            todo = list(files.values())
+        else:
+            existing = read_bboxes(outpath)
+            written = outpath.stat().st_mtime
+            bboxes = {key: bbox for key, bbox in existing.items() if key in files}
+            todo = [file for key, file in files.items()
+                    if key not in bboxes or file.stat().st_mtime > written]
+            if not todo:
+                if len(bboxes) < len(existing):
+                    write_bboxes(outpath, bboxes)
+                continue
+        if not todo:
+            continue
+        pending[folder] = _Folder(outpath, len(todo), bboxes)
+        progress.total += len(todo)
+        progress.refresh()
+        for file in todo:
+            yield delayed(_analyze)(folder, file, options.level, options.refine)
+
+
+def write_bboxes(outpath: Path, bboxes: dict):
+    """Atomically replaces outpath with a JSON file containing the sorted bboxes."""
+    outpath.parent.mkdir(parents=True, exist_ok=True)
+    tmppath = outpath.with_name(f'.{outpath.name}.{os.getpid()}.tmp')
+    try:
+        with tmppath.open('wt') as f:
+            json.dump(dict(sorted(bboxes.items())), f, separators=(',', ':'))
+        os.replace(tmppath, outpath)
+    except BaseException:
+        tmppath.unlink(missing_ok=True)
+        raise
+
+
+def process_folders(folders, options, clean_path):
+    """
+    Analyzes the images in all folders using a single worker pool.
+
+    Each folder's output file is written as soon as the last of its pending images has been analyzed.
+    """
+    pending = {}
+    parallel = Parallel(options.parallel, verbose=5*options.verbose, return_as='generator_unordered')
+    with tqdm(total=0, unit='image', desc='Analyzing images', colour='blue') as progress:
+        for folder, file, bbox, error in parallel(_jobs(folders, options, clean_path, pending, progress)):
+            state = pending[folder]
+            if error is None:
+                state.bboxes[clean_path(file)] = bbox
+            else:
+                progress.write(f'Failed to analyze {file}: {error}')
+            state.remaining -= 1
+            progress.update()
+            if state.remaining == 0:
+                del pending[folder]
+                if state.bboxes or state.output.exists():
+                    with stage('write'):
+                        write_bboxes(state.output, state.bboxes)
 
 
 def _main():
@@ -45,22 +253,24 @@ def _main():
     """)
     p.add_argument('folder', nargs='+', type=Path, help='image folder')
     p.add_argument('-r', '--recursive', action='store_true', help='recursively search all directories')
-    p.add_argument('-f', '--force', action='store_true', help='overwrite existing files')
+    p.add_argument('-f', '--force', action='store_true',
+                   help='analyze all images, even if they are already listed in an up-to-date output file')
     p.add_argument('-g', '--glob', default='*_0.jpg', help='glob pattern to search through each folder')
     p.add_argument('-o', '--output', default='{folder}/zoom.json', help="""
         Pattern for the output file names. Available expansions: {folder} - full path to folder, more TODO
     """)
     p.add_argument('-p', '--parallel', nargs='?', const=-1, type=int, metavar='JOBS', help='Run multiple jobs in parallel.')
+    p.add_argument('-l', '--level', type=int, default=0, help="""
+        Detect the page on an image scaled down by 2**LEVEL. Uses the corresponding level from the
+        facsimile pyramid (e.g., *_3.jpg for *_0.jpg) if available, otherwise JPEG draft mode decoding.
+    """)
+    p.add_argument('--refine', action='store_true', help='with --level, refine the edges at full resolution')
     p.add_argument('-v', '--verbose', action='count', default=0)
+    add_profile_arguments(p)
     options = p.parse_args()
 
-    global parallel
-    parallel = Parallel(options.parallel, verbose=5*options.verbose)
-
     if options.recursive:
-        folders = []
-        for folder in options.folder:
-            folders.extend(folder.glob('**/'))
+        folders = (subfolder for folder in options.folder for subfolder in folder.glob('**/'))
     else:
         folders = options.folder
 
@@ -77,17 +287,9 @@ def _main():
         def clean_path(path: Path):
             return path.stem
 
-    for folder in tqdm(folders, unit='folder', desc='Processing folders'):
-        outpath = Path(options.output.format_map(dict(folder=folder, dirname=folder.name)))
-        if options.force or not outpath.exists():
-            bboxes = process_dir(folder, options.glob, options.verbose)
-            if bboxes:
-                final = {clean_path(path): bboxes for path, bboxes in bboxes.items()}
-                outpath.parent.mkdir(parents=True, exist_ok=True)
-                with outpath.open('wt') as f:
-                    json.dump(dict(sorted(final.items())), f, separators=(',', ':'))
-
+    with profile('detect_pages', options), stage('compute'):
+        process_folders(folders, options, clean_path)
 
 
 if __name__ == '__main__':
-    _main()
\ No newline at end of file
+    _main()
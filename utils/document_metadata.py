@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+
+"""
+Shared loader for the edition's document_metadata.js[on].
+
+The document metadata is a large JSON structure (optionally wrapped as
+`var documentMetadata = {…};` for the web site) that lists, for each witness,
+the pages, the transcripts on each page, and the facsimile images for each
+transcript. Most tools only need the flattened page/image table, which this
+module provides as a list of PageImage records.
+
+The flattened table is cached in a pickle file in the user's cache directory
+(`~/.cache/faust-utils`), keyed by the source's path, size and modification
+time, so subsequent loads do not need to parse the JSON. The cache is not
+written next to the source since that usually lives in the web site's build
+directory.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import re
+from pathlib import Path
+from typing import NamedTuple, Union
+
+logger = logging.getLogger(__name__)
+
+CACHE_VERSION = 1
+_VAR_PREFIX = re.compile(r'^\s*var\s+[\w$]+\s*=\s*')
+
+
+class PageImage(NamedTuple):
+    """A single facsimile image of a transcript on a page of a witness."""
+    sigil: str          # human readable sigil (idno_faustedition)
+    sigil_t: str        # machine readable sigil, as used in URLs
+    repository: str     # id of the holding repository, as in archives.xml
+    base: str           # base path of the witness' transcripts
+    page: int           # page number, starting at 1
+    doc: int            # number of the transcript on the page, starting at 1
+    img_index: int      # number of the image for the transcript, starting at 0
+    img: str            # path to the image, relative to the facsimile root, without extension
+
+
+def parse_document_metadata(text: str) -> dict:
+    """Parses the contents of document_metadata.js or .json. A leading `var x =` and a trailing `;` are ignored."""
+    text = _VAR_PREFIX.sub('', text, count=1).rstrip()
+    if text.endswith(';'):
+        text = text[:-1]
+    return json.loads(text)
+
+
+def read_document_metadata(path: Union[str, Path]) -> list[dict]:
+    """Reads the given document metadata file and returns the list of witness metadata."""
+    with open(path, encoding='utf-8') as f:
+        return parse_document_metadata(f.read())['metadata']
+
+
+def flatten(documents: list[dict]) -> list[PageImage]:
+    """Flattens the witness metadata to a list with one entry for each image."""
+    result = []
+    for document in documents:
+        sigils = document.get('sigils', {})
+        sigil = sigils.get('idno_faustedition')
+        sigil_t = document.get('sigil')
+        repository = sigils.get('repository')
+        base = document.get('base')
+        for page_number, page in enumerate(document.get('page', []), start=1):
+            for doc_number, doc in enumerate(page.get('doc', []), start=1):
+                for img_index, img in enumerate(doc.get('img', [])):
+                    result.append(PageImage(sigil, sigil_t, repository, base, page_number, doc_number, img_index, img))
+    return result
+
+
+def _cache_file(path: Path) -> Path:
+    cache_dir = Path(os.environ.get('XDG_CACHE_HOME') or Path.home() / '.cache') / 'faust-utils'
+    digest = hashlib.sha1(os.fsencode(path.resolve())).hexdigest()[:16]
+    return cache_dir / f'{path.name}.{digest}.pages.pickle'
+
+
+def _cache_key(path: Path):
+    stat = path.stat()
+    return CACHE_VERSION, stat.st_size, stat.st_mtime_ns
+
+
+def load_page_images(path: Union[str, Path], cache: bool = True) -> list[PageImage]:
+    """
+    Returns the flattened page/image table for the given document_metadata.js[on].
+
+    Args:
+        path: path to the document metadata
+        cache: if True, read the table from and store it to the binary cache, if possible.
+    """
+    path = Path(path)
+    cache_file = _cache_file(path)
+    key = _cache_key(path)
+    if cache:
+        try:
+            with cache_file.open('rb') as f:
+                cached_key, rows = pickle.load(f)
+            if cached_key == key:
+                return [PageImage._make(row) for row in rows]
+        except FileNotFoundError:
+            pass
+        except (OSError, pickle.UnpicklingError, ValueError, EOFError) as e:
+            logger.debug('Ignoring broken cache %s: %s', cache_file, e)
+
+    table = flatten(read_document_metadata(path))
+
+    if cache:
+        tmp_file = cache_file.with_name(f'.{cache_file.name}.{os.getpid()}.tmp')
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            with tmp_file.open('wb') as f:
+                pickle.dump((key, [tuple(row) for row in table]), f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError as e:
+            logger.debug('Could not write cache %s: %s', cache_file, e)
+            tmp_file.unlink(missing_ok=True)
+    return table
@@ -17,6 +17,9 @@ import logging
 from rich.logging import RichHandler
 from rich.progress import track
 
+from document_metadata import load_page_images
+from instrumentation import add_profile_arguments, profile, stage
+
 logger = logging.getLogger(__name__)
 
 ns = {"f": "http://www.faustedition.net/ns"}
@@ -106,33 +109,23 @@ def is_forbidden(width: int, resolution: int, rules: dict[str, str]) -> str:
 
 
 def per_documents_data(metadata_json="../build/www/data/document_metadata.json"):
-    md_path = Path(metadata_json)
-    with md_path.open() as f:
-        if md_path.suffix == ".js":
-            f.readline()
-        _md = json.load(f)
-    mss = _md["metadata"]
     pages = []
-    for ms in mss:
-        sigil_t = ms["sigil"]
-        repo_id = ms["sigils"]["repository"]
-        base = Path(*Path(ms["base"]).parts[1:])
-        for page_number, page in enumerate(ms["page"], start=1):
-            doc = page["doc"]
-            if len(doc) > 1:
-                logger.warning(f"{sigil_t:>6} {page_number}: {len(doc)} docs")
-            if doc and doc[0]:
-                imgs = doc[0]["img"]
-                for img in imgs:
-                    pages.append(
-                            {
-                                "repo": repo_id,
-                                "sigil": sigil_t,
-                                "base": base,
-                                "page": page_number,
-                                "img": img,
-                            }
-                    )
+    multi_doc_pages = set()
+    for row in load_page_images(metadata_json):
+        if row.doc > 1:
+            multi_doc_pages.add((row.sigil_t, row.page))
+            continue
+        pages.append(
+                {
+                    "repo": row.repository,
+                    "sigil": row.sigil_t,
+                    "base": Path(*Path(row.base).parts[1:]),
+                    "page": row.page,
+                    "img": row.img,
+                }
+        )
+    for sigil_t, page_number in sorted(multi_doc_pages):
+        logger.warning(f"{sigil_t:>6} {page_number}: more than one doc with images")
     return pages
 
 
@@ -173,6 +166,7 @@ def getargparser():
             help="Target for the JSON files"
     )
     p.add_argument("-l", "--log", metavar="LOGFILE", help="Write a debug log")
+    add_profile_arguments(p)
     return p
 
 
@@ -229,21 +223,29 @@ def main():
         logger.addHandler(console)
     else:
         logging.basicConfig(level=logging.INFO, format="%(message)s", handlers=[console_handler])
-    rules = download_config(options.archives)
-    if logger.isEnabledFor(logging.INFO):
-        logger.info('Rules:\n%s', pformat(rules))
-    page_data = per_documents_data(options.document_metadata)
-    for page in track(page_data, description='Analyzing images ...'):
-        page.update(find_allowed_facsimile(
-                options.image_root, page["img"], rules.get(page["repo"], {})
-        )._asdict())
-    if options.output:
-        write_json(page_data, options.output)
-
-    writer = csv.DictWriter(options.csv, fieldnames=list(page_data[0]))
-    writer.writeheader()
-    writer.writerows(page_data)
-    options.csv.close()
+    with profile('find-download-image', options):
+        find_download_images(options)
+
+
+def find_download_images(options):
+    with stage('load'):
+        rules = download_config(options.archives)
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('Rules:\n%s', pformat(rules))
+        page_data = per_documents_data(options.document_metadata)
+    with stage('compute'):
+        for page in track(page_data, description='Analyzing images ...'):
+            page.update(find_allowed_facsimile(
+                    options.image_root, page["img"], rules.get(page["repo"], {})
+            )._asdict())
+    with stage('write'):
+        if options.output:
+            write_json(page_data, options.output)
+
+        writer = csv.DictWriter(options.csv, fieldnames=list(page_data[0]))
+        writer.writeheader()
+        writer.writerows(page_data)
+        options.csv.close()
 
 
 
@@ -0,0 +1,325 @@
+#!/usr/bin/env python3
+
+"""
+Finds (and optionally links) mentions of witness sigils in the generated site.
+
+All sigils (every idno of every witness) are read from the document metadata
+and compiled into a single Aho-Corasick automaton, so each text is scanned
+once, independent of the number of sigils. The HTML and XML files below
+build/www are scanned in parallel: the text content of each file (not the
+markup, and not the text of existing links, scripts and styles) is matched
+against the automaton. Only whole sigils count, i.e. the characters around a
+match must not be letters or digits, and of overlapping matches the longest
+wins, so `H P1` is not found in `H P12`.
+
+The result is a count per sigil and per file. With `--link`, the mentions in
+HTML files are wrapped in links to the witness (`/document?sigil=…`, with the
+class `sigil-ref`) and the files are rewritten. Links inserted by a previous
+run are counted, but not linked again.
+
+The automaton is pyahocorasick's if that package is installed, otherwise a
+pure Python implementation, which is much slower on a full site.
+
+`encode_sigil` is the canonical transformation of a human readable sigil to
+the machine readable form used in URLs and file names.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+from collections import Counter, deque
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Iterable, Iterator, Optional, Union
+
+from lxml import etree, html
+from tqdm import tqdm
+
+from document_metadata import read_document_metadata
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+DOCUMENT_URL = '/document?sigil={}'
+SKIP_ELEMENTS = {'a', 'script', 'style', 'head', 'title'}
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param', 'source',
+                 'track', 'wbr'}
+_non_sigil_chars = re.compile(r'[^A-Za-z0-9.-]')
+
+
+def encode_sigil(sigil: str) -> str:
+    """Returns the machine readable form of the given sigil, e.g. `H_alpha_2` for `H α 2`."""
+    return _non_sigil_chars.sub('_', sigil.replace('α', 'alpha'))
+
+
+def load_sigils(document_metadata: Union[str, Path], min_length: int = 2) -> dict[str, str]:
+    """
+    Reads all sigils from the document metadata.
+
+    Returns:
+        dictionary sigil (any idno of the witness) → machine readable sigil of the witness
+    """
+    sigils = {}
+    for document in read_document_metadata(document_metadata):
+        target = document.get('sigil') or encode_sigil(document['sigils']['idno_faustedition'])
+        for key, value in document.get('sigils', {}).items():
+            if key.startswith('idno') and isinstance(value, str) and value != 'none' and len(value) >= min_length:
+                if sigils.get(value, target) != target:
+                    logger.debug('Ambiguous sigil %s (%s, %s), using the faustedition sigil', value, sigils[value], target)
+                    if key != 'idno_faustedition':
+                        continue
+                sigils[value] = target
+    return sigils
+
+
+class PyAutomaton:
+    """A minimal Aho-Corasick automaton, used if pyahocorasick is not available."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output: list[list[str]] = [[]]
+
+    def add_word(self, word: str):
+        state = 0
+        for char in word:
+            next_state = self.goto[state].get(char)
+            if next_state is None:
+                next_state = len(self.goto)
+                self.goto[state][char] = next_state
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+            state = next_state
+        self.output[state].append(word)
+
+    def make_automaton(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                if state:
+                    fallback = self.fail[state]
+                    while fallback and char not in self.goto[fallback]:
+                        fallback = self.fail[fallback]
+                    self.fail[next_state] = self.goto[fallback].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    def iter(self, text: str) -> Iterator[tuple[int, str]]:
+        """Yields (end index, word) for all occurrences of all words in text."""
+        goto, fail, output = self.goto, self.fail, self.output
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for word in output[state]:
+                yield index, word
+
+
+class SigilScanner:
+    """Finds whole sigils in texts."""
+
+    def __init__(self, sigils: dict[str, str]):
+        self.sigils = sigils
+        if ahocorasick is not None:
+            self.automaton = ahocorasick.Automaton()
+            for sigil in sigils:
+                self.automaton.add_word(sigil, sigil)
+        else:
+            self.automaton = PyAutomaton()
+            for sigil in sigils:
+                self.automaton.add_word(sigil)
+        if sigils:
+            self.automaton.make_automaton()
+
+    def find(self, text: str) -> list[tuple[int, int, str]]:
+        """Returns the non-overlapping whole-sigil matches in text as (start, end, sigil), preferring the longest."""
+        if not self.sigils:
+            return []
+        candidates = []
+        for end, sigil in self.automaton.iter(text):
+            start = end - len(sigil) + 1
+            if (start == 0 or not text[start - 1].isalnum()) and (end + 1 == len(text) or not text[end + 1].isalnum()):
+                candidates.append((start, end + 1, sigil))
+        candidates.sort(key=lambda match: (match[0], match[0] - match[1]))
+        matches, last_end = [], 0
+        for start, end, sigil in candidates:
+            if start >= last_end:
+                matches.append((start, end, sigil))
+                last_end = end
+        return matches
+
+
+def _text_slots(root: etree._Element) -> Iterator[tuple[etree._Element, str]]:
+    """Yields (element, 'text'|'tail') for all text nodes that are not inside skipped elements."""
+    def local_name(el):
+        return etree.QName(el).localname.lower() if isinstance(el.tag, str) else None
+
+    def visit(el, skip):
+        name = local_name(el)
+        inner_skip = skip or name in SKIP_ELEMENTS or name is None
+        if not inner_skip and el.text:
+            yield el, 'text'
+        for child in el:
+            yield from visit(child, inner_skip)
+            if not skip and child.tail:
+                yield child, 'tail'
+    yield from visit(root, False)
+
+
+def _link_slot(el: etree._Element, slot: str, matches, sigils: dict[str, str], url: str):
+    text = getattr(el, slot)
+    links = []
+    lead = text[:matches[0][0]]
+    for i, (start, end, sigil) in enumerate(matches):
+        link = el.makeelement('a', {'href': url.format(sigils[sigil]), 'class': 'sigil-ref'})
+        if etree.QName(el).namespace:
+            link.tag = f'{{{etree.QName(el).namespace}}}a'
+        link.text = text[start:end]
+        link.tail = text[end:matches[i + 1][0] if i + 1 < len(matches) else len(text)] or None
+        links.append(link)
+    if slot == 'text':
+        el.text = lead or None
+        for i, link in enumerate(links):
+            el.insert(i, link)
+    else:
+        el.tail = lead or None
+        for link in reversed(links):
+            el.addnext(link)
+
+
+def _keep_end_tags(root: etree._Element):
+    """Makes the XML serializer write empty non-void HTML elements as `<x></x>`, not as `<x/>`."""
+    for el in root.iter('*'):
+        if el.text is None and len(el) == 0 and etree.QName(el).localname.lower() not in VOID_ELEMENTS:
+            el.text = ''
+
+
+def scan_file(path: Path, scanner: SigilScanner, link: bool = False, url: str = DOCUMENT_URL) -> Counter:
+    """Counts the sigil mentions in the given file and, if link is true and it is an HTML file, links them."""
+    is_html = path.suffix in ('.html', '.htm', '.php')
+    try:
+        tree = etree.parse(os.fspath(path), etree.XMLParser(huge_tree=True))
+        xml = True
+    except etree.XMLSyntaxError:
+        if not is_html:
+            raise
+        tree = html.parse(os.fspath(path))
+        xml = False
+    counts = Counter(el.text for el in tree.iter('{*}a') if el.get('class') == 'sigil-ref' and el.text in scanner.sigils)
+    changed = False
+    for el, slot in list(_text_slots(tree.getroot())):
+        matches = scanner.find(getattr(el, slot))
+        if matches:
+            counts.update(sigil for _, _, sigil in matches)
+            if link and is_html:
+                _link_slot(el, slot, matches, scanner.sigils, url)
+                changed = True
+    if changed:
+        tmp_file = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        if xml:
+            # keep the original XML declaration and trailing newline, lxml would rewrite or drop them
+            original = path.read_bytes()
+            declaration = original[:original.index(b'?>') + 2] + b'\n' if original.startswith(b'<?xml') else b''
+            _keep_end_tags(tree.getroot())
+            with tmp_file.open('wb') as f:
+                f.write(declaration)
+                tree.write(f, encoding='utf-8', xml_declaration=False)
+                f.write(original[len(original.rstrip()):])
+        else:
+            tree.write(os.fspath(tmp_file), method='html', encoding='utf-8')
+        os.replace(tmp_file, path)
+    return counts
+
+
+_scanner: Optional[SigilScanner] = None
+
+
+def _init_worker(sigils: dict[str, str]):
+    global _scanner
+    _scanner = SigilScanner(sigils)
+
+
+def _scan_job(args) -> tuple[str, Optional[Counter], Optional[str]]:
+    path, link, url = args
+    try:
+        return os.fspath(path), scan_file(path, _scanner, link, url), None
+    except Exception as e:
+        return os.fspath(path), None, f'{type(e).__name__}: {e}'
+
+
+def find_files(root: Path, extensions: Iterable[str] = ('.html', '.xml')) -> list[Path]:
+    extensions = tuple(extensions)
+    return sorted(Path(dirpath, filename)
+                  for dirpath, _, filenames in os.walk(root)
+                  for filename in filenames if filename.endswith(extensions))
+
+
+def scan_site(root: Path, sigils: dict[str, str], link=False, url=DOCUMENT_URL, processes=None,
+              extensions=('.html', '.xml')) -> dict[str, Counter]:
+    """
+    Scans all HTML/XML files below root in parallel.
+
+    Returns:
+        dictionary file (relative to root) → Counter sigil → number of mentions, for files with mentions
+    """
+    files = find_files(root, extensions)
+    result = {}
+    with Pool(processes, initializer=_init_worker, initargs=(sigils,)) as pool:
+        for path, counts, error in tqdm(pool.imap_unordered(_scan_job, [(file, link, url) for file in files],
+                                                            chunksize=16),
+                                        total=len(files), unit='file'):
+            if error:
+                logger.warning('%s: %s', path, error)
+            elif counts:
+                result[os.path.relpath(path, root)] = counts
+    return result
+
+
+def getargparser():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('root', nargs='?', type=Path, default=ROOT / 'build/www', help='directory to scan')
+    p.add_argument('-m', '--document-metadata', type=Path,
+                   help='document_metadata.js[on] (default: data/document_metadata.js below the root)')
+    p.add_argument('-e', '--extensions', default='.html,.xml', help='comma separated file extensions to scan')
+    p.add_argument('-l', '--link', action='store_true', help='link the sigils in the HTML files (rewrites them)')
+    p.add_argument('-u', '--url', default=DOCUMENT_URL, help='link target, {} is replaced with the encoded sigil')
+    p.add_argument('--min-length', type=int, default=2, help='ignore sigils shorter than this')
+    p.add_argument('-j', '--jobs', type=int, help='number of parallel processes (default: number of CPUs)')
+    p.add_argument('-o', '--output', type=Path, help='write the counts per sigil and per file to this JSON file')
+    return p
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    options = getargparser().parse_args()
+    sigils = load_sigils(options.document_metadata or options.root / 'data' / 'document_metadata.js',
+                         options.min_length)
+    logger.info('Scanning %s for %d sigils (%s) ...', options.root, len(sigils),
+                'pyahocorasick' if ahocorasick else 'pure Python automaton')
+    by_file = scan_site(options.root, sigils, options.link, options.url, options.jobs,
+                        options.extensions.split(','))
+    totals = Counter()
+    for counts in by_file.values():
+        totals.update(counts)
+    logger.info('%d mentions of %d sigils in %d files', sum(totals.values()), len(totals), len(by_file))
+    for sigil, count in totals.most_common(10):
+        logger.info('  %-20s %6d', sigil, count)
+    if options.output:
+        with options.output.open('wt', encoding='utf-8') as f:
+            json.dump(dict(sigils=dict(totals.most_common()),
+                           files={file: dict(counts) for file, counts in sorted(by_file.items())}),
+                      f, indent=1, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
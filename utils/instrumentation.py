@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+
+"""
+Shared instrumentation for the faust-utils scripts.
+
+Scripts add the common options using `add_profile_arguments(parser)` and run
+their main work inside `with profile(name, options):`. Within that block,
+`with stage('parse'):` measures wall-clock and CPU time of a part of the run;
+stages with the same name are accumulated, and `stage` can be used anywhere
+(e.g., in library functions), it does nothing if profiling is not active.
+Stages may be nested; the inner stage's time is then included in the outer.
+
+With `--profile FILE`, a JSON metrics file is written at the end of the run,
+containing:
+
+- wall-clock and CPU time of the whole run and of each stage, including the
+  CPU time of finished child processes (e.g., Pool workers),
+- peak resident set size of the process and of its children,
+- tracemalloc's peak and top allocation sites (unless `--profile-top 0`;
+  tracemalloc slows Python code down noticeably).
+
+If FILE is a directory, a new file `<script>-<timestamp>.json` is created in
+it for each run, so metrics can be collected across builds.
+`--profile-cprofile FILE` additionally dumps cProfile statistics for use with
+pstats or snakeviz; line-profiler can still be used as before.
+"""
+
+import argparse
+import cProfile
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+_active: Optional['Profiler'] = None
+
+
+def _cpu_times():
+    children = os.times()
+    return time.process_time(), children.children_user + children.children_system
+
+
+def _peak_rss(who) -> Optional[int]:
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(who).ru_maxrss
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024    # bytes on macOS, KiB elsewhere
+
+
+class Profiler:
+    """Collects the metrics of a single run. Use `profile()` to create and activate one."""
+
+    def __init__(self, name: str, metrics_file: Optional[Path] = None, cprofile_file: Optional[Path] = None,
+                 tracemalloc_top: int = 10):
+        self.name = name
+        self.metrics_file = metrics_file
+        self.cprofile_file = cprofile_file
+        self.tracemalloc_top = tracemalloc_top if metrics_file else 0
+        self.stages = {}    # name → {'wall', 'cpu', 'children_cpu', 'calls'}
+        self._cprofile = None
+
+    def start(self):
+        self.started = datetime.now()
+        if self.tracemalloc_top:
+            tracemalloc.start()
+        if self.cprofile_file:
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+        self._wall = time.perf_counter()
+        self._cpu, self._children_cpu = _cpu_times()
+
+    @contextmanager
+    def stage(self, name: str):
+        wall = time.perf_counter()
+        cpu, children_cpu = _cpu_times()
+        try:
+            yield
+        finally:
+            end_cpu, end_children_cpu = _cpu_times()
+            entry = self.stages.setdefault(name, dict(wall=0.0, cpu=0.0, children_cpu=0.0, calls=0))
+            entry['wall'] += time.perf_counter() - wall
+            entry['cpu'] += end_cpu - cpu
+            entry['children_cpu'] += end_children_cpu - children_cpu
+            entry['calls'] += 1
+
+    def stop(self) -> dict:
+        """Stops profiling, writes the output files, and returns the metrics."""
+        wall = time.perf_counter() - self._wall
+        cpu, children_cpu = _cpu_times()
+        if self._cprofile:
+            self._cprofile.disable()
+            self._cprofile.dump_stats(self.cprofile_file)
+            logger.info('cProfile statistics written to %s', self.cprofile_file)
+        metrics = dict(
+            script=self.name,
+            argv=sys.argv[1:],
+            started=self.started.isoformat(timespec='seconds'),
+            python=platform.python_version(),
+            host=platform.node(),
+            wall=wall,
+            cpu=cpu - self._cpu,
+            children_cpu=children_cpu - self._children_cpu,
+            peak_rss=_peak_rss(resource.RUSAGE_SELF) if resource else None,
+            children_peak_rss=_peak_rss(resource.RUSAGE_CHILDREN) if resource else None,
+            stages=self.stages,
+        )
+        if self.tracemalloc_top:
+            snapshot = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            metrics['tracemalloc'] = dict(
+                peak=peak,
+                top=[dict(location=f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                          size=stat.size, count=stat.count)
+                     for stat in snapshot.statistics('lineno')[:self.tracemalloc_top]])
+        if self.metrics_file:
+            path = self.metrics_file
+            if path.is_dir():
+                path = path / f'{self.name}-{self.started:%Y%m%dT%H%M%S}-{os.getpid()}.json'
+            with path.open('wt', encoding='utf-8') as f:
+                json.dump(metrics, f, indent=2)
+            logger.info('Metrics written to %s', path)
+        return metrics
+
+
+class _NoProfiler:
+    @contextmanager
+    def stage(self, name: str):
+        yield
+
+
+@contextmanager
+def profile(name: str, options: Optional[argparse.Namespace] = None):
+    """
+    Profiles the enclosed block according to the options from `add_profile_arguments`.
+
+    Args:
+        name: the script's name, recorded in the metrics
+        options: the parsed command line options; without options or profiling options, this does nothing.
+    """
+    global _active
+    metrics_file = getattr(options, 'profile', None)
+    cprofile_file = getattr(options, 'profile_cprofile', None)
+    if not (metrics_file or cprofile_file) or _active is not None:
+        yield _NoProfiler()
+        return
+    profiler = Profiler(name, metrics_file, cprofile_file, getattr(options, 'profile_top', 10))
+    _active = profiler
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        _active = None
+        profiler.stop()
+
+
+def stage(name: str):
+    """Measures the enclosed block as a stage of the active profiler, if any."""
+    return (_active or _NoProfiler()).stage(name)
+
+
+def add_profile_arguments(parser: argparse.ArgumentParser):
+    """Adds the common profiling options to the given parser."""
+    group = parser.add_argument_group('profiling')
+    group.add_argument('--profile', type=Path, metavar='JSON',
+                       help='write timing and memory metrics to this JSON file (or to a new file in this directory)')
+    group.add_argument('--profile-top', type=int, default=10, metavar='N',
+                       help='number of top allocation sites (tracemalloc) to include in the metrics, 0 to disable')
+    group.add_argument('--profile-cprofile', type=Path, metavar='FILE', help='write cProfile statistics to this file')
+    return group
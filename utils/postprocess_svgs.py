@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+"""
+Post-processes and minifies the rendered diplomatic SVGs, in parallel.
+
+With `--output-dir`, each `<input_dir>/<witness>/page_<n>.svg` is prepared for
+print like src/main/resources/postprocess-svgs.xsl does, and written to the
+same relative path below the output directory:
+
+- the CSS file (`--css`) is embedded as `<defs><style>` at the start of the SVG,
+- text is NFC normalized, characters only available in Symbola are wrapped in
+  `<tspan class="symbola">`, unresolved combining characters in
+  `<tspan class="unknown-char">$…</tspan>`,
+- the background boxes (`rect.bgBox`) are removed, as are the duplicated text
+  groups that render the outline of erased or rewritten text in the web app.
+
+Without `--output-dir`, the SVGs (e.g., the diplomatic transcripts and the
+overlays in build/www/transcript) are only minified, in place.
+
+Minification is applied in both cases and does not change the rendering:
+
+- comments and indentation whitespace outside of text elements are removed,
+- coordinates (positions, sizes, transforms, paths, view boxes) are rounded to
+  `--precision` decimal places,
+- identity transforms, empty class and style attributes and zero x/y on
+  rect, text, image and use elements are dropped,
+- repeated `<style>` blocks and repeated definitions in `<defs>` are
+  deduplicated; references to a removed definition are redirected to the
+  first one.
+
+A manifest (`.svg-manifest.json` in the output directory) records the input
+and output hash of each file, so files whose input is unchanged are skipped.
+The bytes saved are reported per witness (`--report` for a JSON report).
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import re
+import unicodedata
+from collections import defaultdict
+from dataclasses import asdict, dataclass
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Optional
+
+from lxml import etree
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+MANIFEST_NAME = '.svg-manifest.json'
+MANIFEST_VERSION = 1
+
+SVG_NS = 'http://www.w3.org/2000/svg'
+XLINK_HREF = '{http://www.w3.org/1999/xlink}href'
+_ns = {'svg': SVG_NS}
+
+SYMBOLA_CHARS = re.compile('[\u203F\u20B0\u2191\u2193\u22A2\u22A8\u2308\u2309\u23B1\u2E13]+')
+SPECIAL_CHARS = re.compile(SYMBOLA_CHARS.pattern + '|[\u07E0\u0301\u0304\u035C]')
+
+BG_BOXES = etree.XPath('//svg:rect[contains(concat(" ", normalize-space(@class), " "), " bgBox ")]', namespaces=_ns)
+DECORATION_DUPLICATES = etree.XPath('''
+    //svg:g[(contains(concat(" ", normalize-space(@class), " "), " text-decoration-type-erase ")
+             or contains(concat(" ", normalize-space(@class), " "), " text-decoration-type-rewrite "))
+            and svg:text
+            and preceding-sibling::*[1]/self::svg:text
+            and svg:text/text() = preceding-sibling::svg:text[1]/text()]''', namespaces=_ns)
+
+TEXT_ELEMENTS = {f'{{{SVG_NS}}}{name}' for name in ('text', 'tspan', 'textPath', 'style', 'title', 'desc')}
+COORDINATE_ATTRIBUTES = {'x', 'y', 'x1', 'y1', 'x2', 'y2', 'cx', 'cy', 'r', 'rx', 'ry', 'dx', 'dy', 'width', 'height',
+                         'transform', 'points', 'd', 'viewBox', 'stroke-width'}
+ZERO_DEFAULT_ELEMENTS = {f'{{{SVG_NS}}}{name}' for name in ('rect', 'text', 'image', 'use')}
+NUMBER = re.compile(r'-?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?')
+IDENTITY_TRANSFORM = re.compile(r'\s*(?:matrix\(\s*1[\s,]+0[\s,]+0[\s,]+1[\s,]+0[\s,]+0\s*\)'
+                                r'|translate\(\s*0(?:[\s,]+0)?\s*\)|scale\(\s*1(?:[\s,]+1)?\s*\))*\s*')
+URL_REFERENCE = re.compile(r'url\(#([^)]+)\)')
+
+
+@dataclass
+class PostprocessConfig:
+    precision: int = 2
+    css: Optional[str] = None       # CSS text to embed; None → minify only
+
+    @property
+    def prepare_print(self) -> bool:
+        return self.css is not None
+
+    def record(self) -> dict:
+        return dict(precision=self.precision,
+                    css=hashlib.sha256(self.css.encode()).hexdigest() if self.css is not None else None)
+
+
+def _remove(el: etree._Element):
+    """Removes el, but keeps its tail"""
+    parent = el.getparent()
+    if el.tail:
+        previous = el.getprevious()
+        if previous is not None:
+            previous.tail = (previous.tail or '') + el.tail
+        else:
+            parent.text = (parent.text or '') + el.tail
+    parent.remove(el)
+
+
+def _special_char_spans(text: str) -> tuple[str, list[etree._Element]]:
+    """Splits text into the leading plain text and tspans for the special chars, with the plain text in between as tails"""
+    lead, spans, pos = None, [], 0
+    for match in SPECIAL_CHARS.finditer(text):
+        plain = text[pos:match.start()]
+        if spans:
+            spans[-1].tail = plain or None
+        else:
+            lead = plain
+        span = etree.Element(f'{{{SVG_NS}}}tspan')
+        if SYMBOLA_CHARS.fullmatch(match.group()):
+            span.set('class', 'symbola')
+            span.text = match.group()
+        else:
+            span.set('class', 'unknown-char')
+            span.text = '$' + match.group()
+        spans.append(span)
+        pos = match.end()
+    if not spans:
+        return text, []
+    spans[-1].tail = text[pos:] or None
+    return lead, spans
+
+
+def prepare_print(root: etree._Element, css: str):
+    """The transformations of postprocess-svgs.xsl"""
+    for el in DECORATION_DUPLICATES(root) + BG_BOXES(root):
+        _remove(el)
+
+    for el in list(root.iter(etree.Element)):
+        if el.text:
+            el.text, spans = _special_char_spans(unicodedata.normalize('NFC', el.text))
+            for i, span in enumerate(spans):
+                el.insert(i, span)
+        if el.tail and el is not root:
+            el.tail, spans = _special_char_spans(unicodedata.normalize('NFC', el.tail))
+            for span in reversed(spans):
+                el.addnext(span)
+        for name, value in el.attrib.items():
+            normalized = unicodedata.normalize('NFC', value)
+            if normalized != value:
+                el.set(name, normalized)
+
+    defs = etree.Element(f'{{{SVG_NS}}}defs')
+    style = etree.SubElement(defs, f'{{{SVG_NS}}}style', type='text/css')
+    style.text = css
+    root.insert(0, defs)
+
+
+def _format_number(match: re.Match, precision: int) -> str:
+    number = match.group()
+    if '.' not in number and 'e' not in number.lower():
+        return number
+    formatted = f'{round(float(number), precision):.{precision}f}'.rstrip('0').rstrip('.')
+    return '0' if formatted in ('-0', '') else formatted
+
+
+def _deduplicate(root: etree._Element):
+    seen_styles = set()
+    for style in list(root.iterfind(f'.//{{{SVG_NS}}}style')):
+        key = (style.text or '').strip()
+        if key in seen_styles:
+            _remove(style)
+        else:
+            seen_styles.add(key)
+
+    seen_defs, renamed = {}, {}
+    for defs in list(root.iterfind(f'.//{{{SVG_NS}}}defs')):
+        for definition in list(defs):
+            if not isinstance(definition.tag, str) or definition.tag == f'{{{SVG_NS}}}style':
+                continue
+            definition_id = definition.get('id')
+            copy = etree.fromstring(etree.tostring(definition, with_tail=False))
+            copy.attrib.pop('id', None)
+            key = etree.tostring(copy)
+            if key in seen_defs:
+                original = seen_defs[key]
+                if definition_id:
+                    if original.get('id'):
+                        renamed[definition_id] = original.get('id')
+                    else:   # the first copy is anonymous, so it takes over the references to this one
+                        original.set('id', definition_id)
+                _remove(definition)
+            else:
+                seen_defs[key] = definition
+        if len(defs) == 0 and not (defs.text or '').strip():
+            _remove(defs)
+
+    if renamed:
+        def replace_url(match):
+            return f'url(#{renamed.get(match.group(1), match.group(1))})'
+        for el in root.iter(etree.Element):
+            for name, value in el.attrib.items():
+                if name in (XLINK_HREF, 'href') and value.startswith('#') and value[1:] in renamed:
+                    el.set(name, '#' + renamed[value[1:]])
+                elif 'url(#' in value:
+                    el.set(name, URL_REFERENCE.sub(replace_url, value))
+
+
+def minify(root: etree._Element, precision: int = 2):
+    for comment in root.xpath('//comment()'):
+        _remove(comment)
+
+    for el in root.iter(etree.Element):
+        if el.tag not in TEXT_ELEMENTS and el.text is not None and not el.text.strip():
+            el.text = None
+        parent = el.getparent()
+        if parent is not None and parent.tag not in TEXT_ELEMENTS and el.tail is not None and not el.tail.strip():
+            el.tail = None
+
+        for name, value in el.attrib.items():
+            if name in COORDINATE_ATTRIBUTES:
+                value = NUMBER.sub(lambda match: _format_number(match, precision), value)
+                el.set(name, value)
+            if (name == 'transform' and IDENTITY_TRANSFORM.fullmatch(value)
+                    or name in ('class', 'style') and not value.strip()
+                    or name in ('x', 'y') and value == '0' and el.tag in ZERO_DEFAULT_ELEMENTS):
+                del el.attrib[name]
+
+    _deduplicate(root)
+
+
+def process_svg(source: bytes, config: PostprocessConfig) -> bytes:
+    parser = etree.XMLParser(huge_tree=True)
+    root = etree.fromstring(source, parser)
+    if config.prepare_print:
+        prepare_print(root, config.css)
+    minify(root, config.precision)
+    for style in root.iterfind(f'.//{{{SVG_NS}}}style'):
+        if style.text:
+            style.text = etree.CDATA(style.text)
+    return etree.tostring(root, xml_declaration=True, encoding='UTF-8')
+
+
+_config: Optional[PostprocessConfig] = None
+
+
+def _init_worker(config: PostprocessConfig):
+    global _config
+    _config = config
+
+
+def _process_file(job: tuple[str, Path, Path]) -> tuple[str, Optional[dict], Optional[str]]:
+    rel, source, target = job
+    try:
+        data = source.read_bytes()
+        result = process_svg(data, _config)
+        target.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = target.with_name(f'.{target.name}.{os.getpid()}.tmp')
+        tmp_file.write_bytes(result)
+        os.replace(tmp_file, target)
+        return rel, dict(input=hashlib.sha256(data).hexdigest(), output=hashlib.sha256(result).hexdigest(),
+                         in_bytes=len(data), out_bytes=len(result)), None
+    except Exception as e:
+        return rel, None, f'{type(e).__name__}: {e}'
+
+
+def load_manifest(path: Path) -> dict:
+    try:
+        with path.open(encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        logger.warning('Ignoring broken manifest %s: %s', path, e)
+    return dict(version=MANIFEST_VERSION, config=None, files={})
+
+
+def save_manifest(path: Path, manifest: dict):
+    tmp_file = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    with tmp_file.open('wt', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    os.replace(tmp_file, path)
+
+
+def _file_hash(path: Path) -> str:
+    with path.open('rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def postprocess_all(input_dir: Path, output_dir: Optional[Path], config: PostprocessConfig, processes=None,
+                    force=False, manifest_file: Optional[Path] = None) -> dict:
+    """
+    Post-processes all SVGs below input_dir, writing them to output_dir (or in place if output_dir is None).
+
+    Returns:
+        the manifest, with an entry rel. path → {input, output, in_bytes, out_bytes} per file
+    """
+    in_place = output_dir is None
+    output_dir = input_dir if in_place else output_dir
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_file = manifest_file or output_dir / MANIFEST_NAME
+    manifest = load_manifest(manifest_file)
+    if manifest['config'] != config.record():
+        force = True
+    manifest['config'] = config.record()
+    files = manifest['files']
+
+    sources = {path.relative_to(input_dir).as_posix(): path for path in sorted(input_dir.rglob('*.svg'))}
+    for rel in set(files) - set(sources):
+        del files[rel]
+        if not in_place:
+            (output_dir / rel).unlink(missing_ok=True)
+
+    jobs = []
+    for rel, source in sources.items():
+        entry = files.get(rel)
+        if entry and not force:
+            current = _file_hash(source)
+            if in_place and current == entry['output'] or not in_place and current == entry['input'] \
+                    and (output_dir / rel).exists():
+                continue
+        jobs.append((rel, source, output_dir / rel))
+
+    logger.info('Post-processing %d of %d SVGs ...', len(jobs), len(sources))
+    failed = 0
+    try:
+        if jobs:
+            with Pool(processes, initializer=_init_worker, initargs=(config,)) as pool:
+                for rel, entry, error in tqdm(pool.imap_unordered(_process_file, jobs, chunksize=16),
+                                              total=len(jobs), unit='svg'):
+                    if error:
+                        logger.error('%s: %s', rel, error)
+                        files.pop(rel, None)
+                        failed += 1
+                    else:
+                        files[rel] = entry
+    finally:
+        save_manifest(manifest_file, manifest)
+    if failed:
+        logger.error('%d SVGs failed', failed)
+    return manifest
+
+
+def savings_report(manifest: dict) -> dict:
+    """Bytes before and after post-processing per witness (the first directory level)."""
+    witnesses = defaultdict(lambda: dict(files=0, in_bytes=0, out_bytes=0))
+    for rel, entry in manifest['files'].items():
+        witness = rel.split('/')[0] if '/' in rel else '.'
+        for stats in witnesses[witness], witnesses['*']:
+            stats['files'] += 1
+            stats['in_bytes'] += entry['in_bytes']
+            stats['out_bytes'] += entry['out_bytes']
+    for stats in witnesses.values():
+        stats['saved'] = stats['in_bytes'] - stats['out_bytes']
+    total = witnesses.pop('*', dict(files=0, in_bytes=0, out_bytes=0, saved=0))
+    return dict(total=total, witnesses=dict(sorted(witnesses.items(), key=lambda item: -item[1]['saved'])))
+
+
+def log_savings_report(report: dict, top=10):
+    total = report['total']
+    if not total['files']:
+        return
+    logger.info('%d SVGs: %d → %d bytes, %d bytes (%.1f%%) saved', total['files'], total['in_bytes'],
+                total['out_bytes'], total['saved'], 100 * total['saved'] / max(total['in_bytes'], 1))
+    for witness, stats in list(report['witnesses'].items())[:top]:
+        logger.info('  %-30s %6d files, %10d bytes saved (%.1f%%)', witness, stats['files'], stats['saved'],
+                    100 * stats['saved'] / max(stats['in_bytes'], 1))
+
+
+def getargparser():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('input_dir', nargs='?', type=Path, default=ROOT / 'build/www/transcript/diplomatic',
+                   help='directory containing the rendered SVGs, one subdirectory per witness')
+    p.add_argument('-o', '--output-dir', type=Path,
+                   help='write print SVGs (like postprocess-svgs.xsl) here. Without this option, the SVGs are minified in place.')
+    p.add_argument('--css', type=Path, default=ROOT / 'svg_rendering/page/css/document-transcript.css',
+                   help='CSS to embed in the print SVGs')
+    p.add_argument('-p', '--precision', type=int, default=PostprocessConfig.precision,
+                   help='number of decimal places for coordinates')
+    p.add_argument('-j', '--jobs', type=int, help='number of parallel processes (default: number of CPUs)')
+    p.add_argument('-f', '--force', action='store_true', help='process all files, even if they have not changed')
+    p.add_argument('-m', '--manifest', type=Path, help=f'manifest file (default: {MANIFEST_NAME} in the output directory)')
+    p.add_argument('-r', '--report', type=Path, help='write the bytes saved per witness to this JSON file')
+    return p
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    options = getargparser().parse_args()
+    config = PostprocessConfig(precision=options.precision,
+                               css=options.css.read_text(encoding='utf-8') if options.output_dir else None)
+    manifest = postprocess_all(options.input_dir, options.output_dir, config, options.jobs, options.force,
+                               options.manifest)
+    report = savings_report(manifest)
+    log_savings_report(report)
+    if options.report:
+        with options.report.open('wt', encoding='utf-8') as f:
+            json.dump(dict(report, config=asdict(config) | dict(css=options.css.name if config.css else None)),
+                      f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
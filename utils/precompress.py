@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+
+"""
+Writes precompressed siblings for the static text assets in build/www.
+
+For every compressible file (HTML, SVG, XML, JSON, JS, CSS, …) of at least
+`--min-size` bytes, `<file>.gz` and `<file>.br` are written next to it, so the
+web server can deliver them directly (e.g., nginx' `gzip_static` and
+`brotli_static`, Apache's MultiViews / rewrite rules) instead of compressing
+on every request:
+
+- `.gz` is compressed with zopfli if the `zopfli` package is installed, which
+  is slow but produces ~5% smaller files than `gzip -9`, otherwise with gzip
+  level 9. The gzip header carries no timestamp, so the output only depends
+  on the input.
+- `.br` is compressed with brotli at quality 11 if the `brotli` package is
+  installed, otherwise it is skipped.
+
+Files are compressed in parallel. A manifest (by default
+`build/precompress-manifest.json`, outside of the deployed directory) records
+size, modification time and hash of each source and the size of its
+siblings. Files whose size and modification time are unchanged are skipped
+without being read, files with an unchanged hash only get their stat data
+updated. Siblings of deleted files or of files that are no longer compressed
+are removed. Finally, the bytes saved are reported per file type.
+
+Run this after the build and before `gradle deployRSync`.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import os
+from collections import defaultdict
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Optional
+
+from tqdm import tqdm
+
+try:
+    import zopfli.gzip
+except ImportError:
+    zopfli = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+MANIFEST_VERSION = 1
+COMPRESSIBLE = ('.html', '.htm', '.svg', '.xml', '.json', '.js', '.css', '.txt', '.csv', '.tsv', '.md', '.map',
+                '.ico', '.ttf', '.otf', '.eot', '.xhtml', '.rdf')
+SUFFIXES = ('.gz', '.br')
+
+
+def compress_gzip(data: bytes) -> bytes:
+    if zopfli is not None:
+        return zopfli.gzip.compress(data)
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def compress_brotli(data: bytes) -> bytes:
+    return brotli.compress(data, quality=11)
+
+
+def encoders() -> dict:
+    """The available encoders, by sibling suffix"""
+    result = {'.gz': compress_gzip}
+    if brotli is not None:
+        result['.br'] = compress_brotli
+    return result
+
+
+def _write_sibling(source: Path, suffix: str, data: bytes, stat: os.stat_result):
+    target = source.with_name(source.name + suffix)
+    tmp_file = target.with_name(f'.{target.name}.{os.getpid()}.tmp')
+    tmp_file.write_bytes(data)
+    os.utime(tmp_file, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(tmp_file, target)
+
+
+def _compress_job(job: tuple[str, Path, Optional[str]]) -> tuple[str, Optional[dict], Optional[str]]:
+    """Compresses a single file, unless its hash is known_hash and its siblings exist."""
+    rel, source, known_hash = job
+    try:
+        stat = source.stat()
+        data = source.read_bytes()
+        digest = hashlib.sha256(data).hexdigest()
+        entry = dict(size=stat.st_size, mtime=stat.st_mtime_ns, hash=digest)
+        available = encoders()
+        if digest == known_hash and all(source.with_name(source.name + suffix).exists() for suffix in available):
+            return rel, entry, None
+        for suffix, encode in available.items():
+            compressed = encode(data)
+            _write_sibling(source, suffix, compressed, stat)
+            entry[suffix[1:]] = len(compressed)
+        for suffix in SUFFIXES:
+            if suffix not in available:     # e.g., brotli is no longer installed: do not leave outdated siblings
+                source.with_name(source.name + suffix).unlink(missing_ok=True)
+        entry['compressed'] = True
+        return rel, entry, None
+    except Exception as e:
+        return rel, None, f'{type(e).__name__}: {e}'
+
+
+def find_sources(www: Path, min_size: int, extensions=COMPRESSIBLE) -> dict[str, Path]:
+    sources = {}
+    for dirpath, dirnames, filenames in os.walk(www):
+        for filename in filenames:
+            if os.path.splitext(filename)[1].lower() not in extensions or filename.startswith('.'):
+                continue
+            path = Path(dirpath, filename)
+            if path.stat().st_size >= min_size:
+                sources[path.relative_to(www).as_posix()] = path
+    return sources
+
+
+def _remove_siblings(www: Path, rel: str):
+    for suffix in SUFFIXES:
+        (www / (rel + suffix)).unlink(missing_ok=True)
+
+
+def load_manifest(path: Path) -> dict:
+    try:
+        with path.open(encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') == MANIFEST_VERSION:
+            return manifest
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        logger.warning('Ignoring broken manifest %s: %s', path, e)
+    return dict(version=MANIFEST_VERSION, encoders=None, files={})
+
+
+def save_manifest(path: Path, manifest: dict):
+    tmp_file = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    with tmp_file.open('wt', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, ensure_ascii=False)
+    os.replace(tmp_file, path)
+
+
+def precompress(www: Path, manifest_file: Path, min_size=1024, processes=None, force=False) -> dict:
+    """
+    Creates or updates the precompressed siblings of all compressible files below www.
+
+    Returns:
+        the manifest, with an entry rel. path → {size, mtime, hash, gz, br} per compressed file
+    """
+    manifest = load_manifest(manifest_file)
+    encoder_names = ['zopfli' if zopfli else 'gzip'] + (['brotli'] if brotli else [])
+    if brotli is None:
+        logger.warning('brotli is not installed, only writing .gz files')
+    if manifest['encoders'] != encoder_names:
+        force = True
+    manifest['encoders'] = encoder_names
+    files = manifest['files']
+
+    sources = find_sources(www, min_size)
+    for rel in set(files) - set(sources):
+        _remove_siblings(www, rel)
+        del files[rel]
+
+    jobs = []
+    for rel, source in sources.items():
+        entry = files.get(rel)
+        if entry and not force:
+            stat = source.stat()
+            if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime'] \
+                    and all((www / (rel + f'.{name}')).exists() for name in ('gz', 'br') if name in entry):
+                continue
+        jobs.append((rel, source, None if force or not entry else entry['hash']))
+
+    logger.info('Checking %d of %d compressible files (%s) ...', len(jobs), len(sources), ', '.join(encoder_names))
+    compressed = failed = 0
+    try:
+        if jobs:
+            with Pool(processes) as pool:
+                for rel, entry, error in tqdm(pool.imap_unordered(_compress_job, jobs, chunksize=8),
+                                              total=len(jobs), unit='file'):
+                    if error:
+                        logger.error('%s: %s', rel, error)
+                        files.pop(rel, None)
+                        failed += 1
+                    elif entry.pop('compressed', False):
+                        files[rel] = entry
+                        compressed += 1
+                    else:
+                        files[rel] = dict(files[rel], **entry)
+    finally:
+        save_manifest(manifest_file, manifest)
+    logger.info('Compressed %d files, %d unchanged, %d failed', compressed, len(sources) - compressed - failed, failed)
+    return manifest
+
+
+def savings_report(manifest: dict) -> dict:
+    """Original and compressed bytes per file type and in total."""
+    types = defaultdict(lambda: defaultdict(int))
+    for rel, entry in manifest['files'].items():
+        for stats in types[os.path.splitext(rel)[1].lower()], types['*']:
+            stats['files'] += 1
+            stats['bytes'] += entry['size']
+            for name in ('gz', 'br'):
+                if name in entry:
+                    stats[name] += entry[name]
+    total = types.pop('*', {})
+    return dict(encoders=manifest['encoders'], total=dict(total),
+                types={ext: dict(stats) for ext, stats in sorted(types.items(), key=lambda item: -item[1]['bytes'])})
+
+
+def log_savings_report(report: dict):
+    def line(label, stats):
+        ratios = ', '.join(f'{name} {100 * stats[name] / stats["bytes"]:.1f}%' for name in ('gz', 'br') if stats.get(name))
+        logger.info('%-8s %7d files, %12d bytes → %s', label, stats['files'], stats['bytes'], ratios)
+    if report['total']:
+        line('total', report['total'])
+        for ext, stats in report['types'].items():
+            line(ext, stats)
+
+
+def getargparser():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('www', nargs='?', type=Path, default=ROOT / 'build/www', help='directory to precompress')
+    p.add_argument('-s', '--min-size', type=int, default=1024, help='only compress files of at least this many bytes')
+    p.add_argument('-m', '--manifest', type=Path, help='manifest file (default: precompress-manifest.json next to the directory)')
+    p.add_argument('-j', '--jobs', type=int, help='number of parallel processes (default: number of CPUs)')
+    p.add_argument('-f', '--force', action='store_true', help='recompress all files')
+    p.add_argument('--clean', action='store_true', help='remove all siblings listed in the manifest and the manifest')
+    p.add_argument('-r', '--report', type=Path, help='write the savings report to this JSON file')
+    return p
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    options = getargparser().parse_args()
+    manifest_file = options.manifest or options.www.resolve().parent / 'precompress-manifest.json'
+    if options.clean:
+        for rel in load_manifest(manifest_file)['files']:
+            _remove_siblings(options.www, rel)
+        manifest_file.unlink(missing_ok=True)
+        return
+    manifest = precompress(options.www, manifest_file, options.min_size, options.jobs, options.force)
+    report = savings_report(manifest)
+    log_savings_report(report)
+    if options.report:
+        with options.report.open('wt', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
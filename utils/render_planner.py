@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+"""
+Change-aware planning and execution of the diplomatic transcript rendering.
+
+DiplomaticConversion (`gradle generateSVGs`) converts each transcript page to
+JSON and renders every witness with render-multi-pages.js: one job per witness
+that writes an SVG (and an image-link overlay) per page and the witness' HTML
+and PDF. Run with `-Pfaust.diplo.jobsOnly=true`, it only writes the page JSON
+files and the job descriptions (`build/pages/<basename>/job.json`), and this
+script takes over:
+
+- Each page is fingerprinted from its JSON, its text-image links file, its
+  page number and sigil, and the renderer assets (svg_rendering/page/js-gen,
+  css, transcript-generation.html, render-multi-pages.js). A witness'
+  fingerprint combines the fingerprints of its pages.
+- Witnesses whose fingerprint matches the last rendering and whose outputs
+  exist are left alone.
+- Outputs are kept in a content-addressed cache (objects by SHA-256, plus a
+  manifest per witness fingerprint). A witness whose fingerprint is in the
+  cache – e.g., after reverting a change, or in a fresh build directory – is
+  restored from the cache instead of being rendered.
+- Only the remaining witnesses are rendered. Since the PDF and HTML contain all
+  pages, a witness is rendered as a whole, but the plan lists the pages whose
+  fingerprint actually changed.
+
+Usage:
+
+    render_planner.py plan    # show what would be rendered, optionally write the plan as JSON
+    render_planner.py run     # restore from the cache, render the rest, update the cache
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Optional
+
+from render_scheduler import (HISTORY_NAME, RenderHistory, RenderTask, efficiency_report, log_efficiency, merge_parts,
+                              schedule)
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+RENDER_ASSETS = ('svg_rendering/page/js-gen', 'svg_rendering/page/css',
+                 'svg_rendering/page/transcript-generation.html', 'render-multi-pages.js')
+STATE_VERSION = 1
+
+
+def file_hash(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _write_atomically(path: Path, write):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = path.with_name(f'.{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        write(tmp_file)
+        os.replace(tmp_file, path)
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
+
+
+def _write_json(path: Path, data):
+    def write(tmp_file):
+        with tmp_file.open('wt', encoding='utf-8') as f:
+            json.dump(data, f, indent=1, ensure_ascii=False)
+    _write_atomically(path, write)
+
+
+def assets_fingerprint(root: Path = ROOT, assets=RENDER_ASSETS) -> str:
+    """Fingerprints the renderer, i.e. all files of the given asset files and directories below root."""
+    digest = hashlib.sha256()
+    for asset in assets:
+        path = root / asset
+        files = sorted(file for file in path.rglob('*') if file.is_file()) if path.is_dir() else [path]
+        for file in files:
+            if file.exists():
+                digest.update(f'{file.relative_to(root).as_posix()}\0{file_hash(file)}\n'.encode())
+            else:
+                logger.warning('Renderer asset %s is missing', file)
+    return digest.hexdigest()
+
+
+def page_fingerprint(page: dict, sigil: str, assets: str) -> str:
+    digest = hashlib.sha256(f'{assets}\0{sigil}\0{page["pageNo"]}\0'.encode())
+    digest.update(file_hash(page['json']).encode())
+    if page.get('links'):
+        digest.update(b'\0' + file_hash(page['links']).encode())
+    return digest.hexdigest()
+
+
+def witness_fingerprint(job: dict, page_fingerprints: dict[str, str]) -> str:
+    digest = hashlib.sha256(f'{job["sigil"]}\0{job["pdfname"]}\0'.encode())
+    for page_no, fingerprint in page_fingerprints.items():
+        digest.update(f'{page_no}\0{fingerprint}\n'.encode())
+    return digest.hexdigest()
+
+
+def job_outputs(job: dict) -> list[str]:
+    """All files render-multi-pages.js writes for the given job."""
+    outputs = []
+    for page in job['transcripts']:
+        outputs.append(page['out'])
+        if page.get('links'):
+            outputs.append(page['overlayOut'])
+    outputs.append(job['pdfname'])
+    outputs.append(job['pdfname'][:-3] + 'html')
+    return outputs
+
+
+def read_jobs(pages_dir: Path) -> dict[str, dict]:
+    """Reads the job descriptions written by DiplomaticConversion, as dictionary basename → job."""
+    jobs = {}
+    for job_file in sorted(Path(pages_dir).glob('*/job.json')):
+        with job_file.open(encoding='utf-8') as f:
+            job = json.load(f)
+        job['file'] = os.fspath(job_file)
+        jobs[job.get('basename') or job_file.parent.name] = job
+    return jobs
+
+
+class RenderCache:
+    """
+    Content-addressed store for rendered outputs.
+
+    Files are stored as `objects/<hash[:2]>/<hash>`, and for each witness fingerprint,
+    `witnesses/<fingerprint>.json` maps the witness' output paths to object hashes.
+    """
+
+    def __init__(self, cache_dir: Path):
+        self.cache_dir = Path(cache_dir)
+
+    def _object(self, digest: str) -> Path:
+        return self.cache_dir / 'objects' / digest[:2] / digest
+
+    def _manifest(self, fingerprint: str) -> Path:
+        return self.cache_dir / 'witnesses' / f'{fingerprint}.json'
+
+    def __contains__(self, fingerprint: str) -> bool:
+        return self._manifest(fingerprint).exists()
+
+    def store(self, fingerprint: str, outputs: list[str]) -> bool:
+        """Stores the given outputs under the fingerprint. Returns False if an output is missing."""
+        manifest = {}
+        for output in outputs:
+            try:
+                digest = file_hash(output)
+            except FileNotFoundError:
+                logger.error('Cannot cache %s: output %s is missing', fingerprint[:12], output)
+                return False
+            target = self._object(digest)
+            if not target.exists():
+                _write_atomically(target, partial(shutil.copyfile, output))
+            manifest[output] = digest
+        _write_json(self._manifest(fingerprint), manifest)
+        return True
+
+    def restore(self, fingerprint: str) -> bool:
+        """Copies the outputs for the fingerprint to their locations. Returns False if they are not (fully) cached."""
+        try:
+            with self._manifest(fingerprint).open(encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        if not all(self._object(digest).exists() for digest in manifest.values()):
+            return False
+        for output, digest in manifest.items():
+            if os.path.exists(output) and file_hash(output) == digest:
+                continue
+            # copy, don't link: the renderer overwrites its outputs in place
+            _write_atomically(Path(output), partial(shutil.copyfile, self._object(digest)))
+        return True
+
+
+@dataclass
+class WitnessPlan:
+    basename: str
+    job: dict
+    fingerprint: str
+    pages: dict[str, str]                                   # page number → fingerprint
+    changed_pages: list[str] = field(default_factory=list)
+    action: str = 'render'                                  # 'unchanged', 'restore' or 'render'
+
+
+def load_state(path: Path) -> dict:
+    try:
+        with path.open(encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('version') == STATE_VERSION:
+            return state
+    except FileNotFoundError:
+        pass
+    except ValueError as e:
+        logger.warning('Ignoring broken render state %s: %s', path, e)
+    return {'version': STATE_VERSION, 'witnesses': {}}
+
+
+def plan(jobs: dict[str, dict], state: dict, cache: Optional[RenderCache], assets: str, force=False) -> list[WitnessPlan]:
+    """Decides for each witness whether it is unchanged, can be restored from the cache, or must be rendered."""
+    result = []
+    for basename, job in jobs.items():
+        pages = {str(page['pageNo']): page_fingerprint(page, job['sigil'], assets) for page in job['transcripts']}
+        fingerprint = witness_fingerprint(job, pages)
+        previous = state['witnesses'].get(basename, {})
+        witness = WitnessPlan(basename, job, fingerprint, pages,
+                              changed_pages=[page for page, fp in pages.items() if previous.get('pages', {}).get(page) != fp])
+        if force:
+            witness.action = 'render'
+        elif previous.get('fingerprint') == fingerprint and all(os.path.exists(output) for output in job_outputs(job)):
+            witness.action = 'unchanged'
+        elif cache is not None and fingerprint in cache:
+            witness.action = 'restore'
+        result.append(witness)
+    return result
+
+
+def _record(state: dict, witness: WitnessPlan):
+    state['witnesses'][witness.basename] = dict(fingerprint=witness.fingerprint, pages=witness.pages)
+
+
+class RenderServer:
+    """Serves the render web app (svg_rendering/page) on localhost, like DiplomaticConversion does."""
+
+    def __init__(self, webapp: Path):
+        handler = partial(SimpleHTTPRequestHandler, directory=os.fspath(webapp))
+        handler.log_message = lambda *args: None
+        self.server = ThreadingHTTPServer(('localhost', 0), handler)
+        self.url = f'http://localhost:{self.server.server_port}/transcript-generation.html'
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def render(job_file: str, outputs: list[str], backend: str, node='node', script=ROOT / 'render-multi-pages.js') -> Optional[str]:
+    """
+    Runs render-multi-pages.js for a job description.
+
+    Returns:
+        None on success, otherwise an error message. render-multi-pages.js does not report errors via its exit code,
+        so the job only counts as successful if all outputs have been written.
+    """
+    started = time.time() - 1      # file system timestamps are coarser than time.time()
+    process = subprocess.run([node, os.fspath(script), backend, job_file],
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True)
+    stale = [output for output in outputs if not os.path.exists(output) or os.path.getmtime(output) < started]
+    if process.returncode or stale:
+        return f'exit code {process.returncode}, {len(stale)} outputs not written. Output:\n{process.stdout}'
+    if process.stdout.strip():
+        logger.debug('%s: %s', job_file, process.stdout)
+    return None
+
+
+def _render_task(task: RenderTask, backend: str, options, started: float) -> tuple[Optional[str], float, float]:
+    start = time.perf_counter()
+    error = render(task.job_file, job_outputs(task.job), backend, options.node, options.script)
+    return error, start - started, time.perf_counter() - start
+
+
+def run(witnesses: list[WitnessPlan], state: dict, state_file: Path, cache: Optional[RenderCache], options) -> list[str]:
+    """
+    Restores and renders the witnesses according to their plan and updates the state and the cache.
+
+    The render jobs are scheduled by render_scheduler, i.e. longest first, with large witnesses split into parts.
+
+    Returns:
+        the basenames of the witnesses that failed to render
+    """
+    for witness in witnesses:
+        if witness.action == 'restore':
+            if cache.restore(witness.fingerprint):
+                _record(state, witness)
+            else:
+                witness.action = 'render'
+    _write_json(state_file, state)
+
+    todo = {witness.basename: witness for witness in witnesses if witness.action == 'render'}
+    failed = []
+    if not todo:
+        return failed
+    history = RenderHistory(options.build_dir / HISTORY_NAME)
+    tasks = schedule({basename: witness.job for basename, witness in todo.items()}, history, options.jobs,
+                     options.split_seconds, options.min_part_pages)
+    for task in tasks:
+        if task.parts > 1:
+            _write_json(Path(task.job_file), task.job)
+    logger.info('Rendering %d witnesses as %d jobs in %d parallel processes ...', len(todo), len(tasks), options.jobs)
+
+    done = defaultdict(list)      # basename → finished tasks
+    seconds_by_witness = defaultdict(float)
+    errors = defaultdict(list)
+    durations = []
+    with RenderServer(options.root / 'svg_rendering' / 'page') as server, ThreadPoolExecutor(options.jobs) as executor:
+        started = time.perf_counter()
+        # the executor's queue is FIFO, so the tasks start in schedule order
+        futures = {executor.submit(_render_task, task, server.url, options, started): task for task in tasks}
+        for future in as_completed(futures):
+            task = futures[future]
+            error, start, seconds = future.result()
+            durations.append((start, seconds))
+            done[task.basename].append(task)
+            seconds_by_witness[task.basename] += seconds
+            if error:
+                errors[task.basename].append(error)
+            if len(done[task.basename]) < task.parts:
+                continue
+
+            witness = todo[task.basename]
+            if not errors[task.basename] and task.parts > 1:
+                try:
+                    merge_parts(witness.job, done[task.basename])
+                except Exception as e:
+                    errors[task.basename].append(f'merging {task.parts} parts failed: {e}')
+            if errors[task.basename]:
+                logger.error('%s: rendering failed: %s', witness.job['sigil'], '\n'.join(errors[task.basename]))
+                failed.append(witness.basename)
+                state['witnesses'].pop(witness.basename, None)
+                continue
+            history.record(witness.basename, seconds_by_witness[witness.basename], len(witness.job['transcripts']))
+            if cache is not None:
+                cache.store(witness.fingerprint, job_outputs(witness.job))
+            _record(state, witness)
+            _write_json(state_file, state)
+        wall = time.perf_counter() - started
+    _write_json(state_file, state)
+    history.last_run = efficiency_report(durations, options.jobs, wall)
+    history.save()
+    log_efficiency(history.last_run)
+    return failed
+
+
+def summarize(witnesses: list[WitnessPlan]) -> dict:
+    summary = {action: [w.basename for w in witnesses if w.action == action] for action in ('unchanged', 'restore', 'render')}
+    logger.info('%d witnesses unchanged, %d to restore from the cache, %d to render (%d changed pages)',
+                len(summary['unchanged']), len(summary['restore']), len(summary['render']),
+                sum(len(w.changed_pages) for w in witnesses if w.action == 'render'))
+    return summary
+
+
+def getargparser():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('command', choices=['plan', 'run'])
+    p.add_argument('-b', '--build-dir', type=Path, default=ROOT / 'build', help='Gradle build directory')
+    p.add_argument('-c', '--cache', type=Path, help='render cache directory (default: <build dir>/render-cache)')
+    p.add_argument('--no-cache', action='store_true', help='neither restore from nor store to the cache')
+    p.add_argument('-o', '--output', type=Path, help='plan: write the plan as JSON to this file')
+    p.add_argument('-f', '--force', action='store_true', help='render all witnesses')
+    p.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of parallel render jobs')
+    p.add_argument('--split-seconds', type=float, default=120,
+                   help='only split witnesses whose estimated render time exceeds this (and the ideal makespan)')
+    p.add_argument('--min-part-pages', type=int, default=10,
+                   help='minimum number of pages per part of a split witness, 0 to never split')
+    p.add_argument('--node', default='node', help='node binary')
+    p.add_argument('--script', type=Path, default=ROOT / 'render-multi-pages.js', help='render script')
+    p.add_argument('--root', type=Path, default=ROOT, help='faust-gen directory, for the renderer assets')
+    return p
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    options = getargparser().parse_args()
+    jobs = read_jobs(options.build_dir / 'pages')
+    if not jobs:
+        logger.error('No job descriptions in %s. Run gradle generateSVGs -Pfaust.diplo.jobsOnly=true first.',
+                     options.build_dir / 'pages')
+        raise SystemExit(1)
+    state_file = options.build_dir / 'render-state.json'
+    state = load_state(state_file)
+    cache = None if options.no_cache else RenderCache(options.cache or options.build_dir / 'render-cache')
+    witnesses = plan(jobs, state, cache, assets_fingerprint(options.root), options.force)
+    summary = summarize(witnesses)
+    if options.command == 'plan':
+        if options.output:
+            _write_json(options.output, dict(
+                summary,
+                jobs=[dict(job=w.job['file'], sigil=w.job['sigil'], changedPages=w.changed_pages)
+                      for w in witnesses if w.action == 'render']))
+    elif run(witnesses, state, state_file, cache, options):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
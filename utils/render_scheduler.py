@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+
+"""
+Duration-balanced scheduling of the render-multi-pages.js jobs, used by render_planner.py.
+
+Render times differ widely between witnesses, from a few seconds for a
+single leaf to many minutes for the large manuscripts and prints. If these
+start late, most workers are idle at the end of the render phase. So:
+
+- The render time and page count of each witness are recorded in
+  `build/render-history.json`. Witnesses without history are estimated from
+  their page count and the median time per page.
+- Jobs are started longest first (LPT scheduling), which keeps the tail short.
+- Witnesses whose estimate exceeds the ideal makespan (total estimate / number
+  of workers, but at least `split_seconds`) are split into page-range parts.
+  Each part renders a subset of the pages to their final SVG locations and its
+  own part PDF and HTML, only the last part adds the about page. When all parts
+  are done, their PDFs (pypdf or pdfunite) and HTML documents are merged.
+- After the run, the parallel efficiency (busy time / (workers × wall time))
+  and the tail (wall time after the last job has been started) are reported.
+"""
+
+import json
+import logging
+import math
+import os
+import shutil
+import statistics
+import subprocess
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional
+
+from lxml import etree
+
+try:
+    from pypdf import PdfWriter
+except ImportError:
+    PdfWriter = None
+
+logger = logging.getLogger(__name__)
+
+HISTORY_NAME = 'render-history.json'
+DEFAULT_PAGE_SECONDS = 2.0
+
+
+class RenderHistory:
+    """Render time and page count per witness from previous runs."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        try:
+            with self.path.open(encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            data = {}
+        except ValueError as e:
+            logger.warning('Ignoring broken render history %s: %s', self.path, e)
+            data = {}
+        self.witnesses: dict[str, dict] = data.get('witnesses', {})
+        self.last_run: Optional[dict] = data.get('last_run')
+
+    def page_seconds(self) -> float:
+        rates = [entry['seconds'] / entry['pages'] for entry in self.witnesses.values() if entry.get('pages')]
+        return statistics.median(rates) if rates else DEFAULT_PAGE_SECONDS
+
+    def estimate(self, basename: str, pages: int) -> float:
+        """Estimated render time in seconds for the witness with the given number of pages."""
+        entry = self.witnesses.get(basename)
+        if entry and entry.get('pages'):
+            return entry['seconds'] * pages / entry['pages']
+        return pages * self.page_seconds()
+
+    def record(self, basename: str, seconds: float, pages: int):
+        self.witnesses[basename] = dict(seconds=round(seconds, 3), pages=pages)
+
+    def save(self):
+        tmp_file = self.path.with_name(f'.{self.path.name}.{os.getpid()}.tmp')
+        with tmp_file.open('wt', encoding='utf-8') as f:
+            json.dump(dict(witnesses=self.witnesses, last_run=self.last_run), f, indent=1, ensure_ascii=False)
+        os.replace(tmp_file, self.path)
+
+
+@dataclass
+class RenderTask:
+    """A single render-multi-pages.js run: a whole witness or a page range of it."""
+    basename: str
+    job: dict               # the job description to render
+    job_file: str
+    estimate: float
+    part: int = 0
+    parts: int = 1
+
+
+def merging_available() -> bool:
+    return PdfWriter is not None or shutil.which('pdfunite') is not None
+
+
+def split_job(job: dict, parts: int) -> list[tuple[dict, str]]:
+    """
+    Splits the job into `parts` contiguous page ranges.
+
+    Returns:
+        list of (part job, part job file); the part PDFs and HTML files are written next to the job file
+    """
+    job_dir = Path(job['file']).parent
+    pages = job['transcripts']
+    bounds = [round(i * len(pages) / parts) for i in range(parts + 1)]
+    result = []
+    for i in range(parts):
+        part = {key: value for key, value in job.items() if key != 'file'}
+        part['transcripts'] = pages[bounds[i]:bounds[i + 1]]
+        part['pdfname'] = os.fspath(job_dir / f'part-{i}.pdf')
+        part['aboutPage'] = i == parts - 1
+        result.append((part, os.fspath(job_dir / f'job-part-{i}.json')))
+    return result
+
+
+def schedule(jobs: dict[str, dict], history: RenderHistory, workers: int, split_seconds: float = 120,
+             min_part_pages: int = 10) -> list[RenderTask]:
+    """
+    Creates the render tasks for the given jobs (basename → job description), longest first.
+
+    Args:
+        jobs: the witnesses to render
+        history: the render history used for the estimates
+        workers: number of parallel render processes
+        split_seconds: witnesses are only split if they take longer than this (and than the ideal makespan)
+        min_part_pages: minimum number of pages of a part; 0 to disable splitting
+    """
+    estimates = {basename: history.estimate(basename, len(job['transcripts'])) for basename, job in jobs.items()}
+    target = max(sum(estimates.values()) / max(workers, 1), split_seconds)
+    can_split = min_part_pages > 0 and merging_available()
+    if min_part_pages > 0 and not can_split:
+        logger.warning('Neither pypdf nor pdfunite is available, large witnesses will not be split')
+    tasks = []
+    for basename, job in jobs.items():
+        estimate = estimates[basename]
+        parts = min(math.ceil(estimate / target), len(job['transcripts']) // min_part_pages) if can_split else 1
+        if parts > 1:
+            for i, (part, part_file) in enumerate(split_job(job, parts)):
+                tasks.append(RenderTask(basename, part, part_file, estimate * len(part['transcripts']) / len(job['transcripts']),
+                                        part=i, parts=parts))
+        else:
+            tasks.append(RenderTask(basename, job, job['file'], estimate))
+    tasks.sort(key=lambda task: task.estimate, reverse=True)
+    return tasks
+
+
+def merge_pdfs(parts: list[str], target: str):
+    if PdfWriter is not None:
+        writer = PdfWriter()
+        for part in parts:
+            writer.append(part)
+        with open(target, 'wb') as f:
+            writer.write(f)
+        writer.close()
+    else:
+        subprocess.run(['pdfunite', *parts, target], check=True)
+
+
+def _is_page(el: etree._Element) -> bool:
+    return 'rendercontainer' in (el.get('class') or '').split()
+
+
+def _is_about_page(el: etree._Element) -> bool:
+    return etree.QName(el).localname == 'section' and 'aboutpage' in (el.get('class') or '').split()
+
+
+def merge_html(parts: list[str], target: str):
+    """
+    Appends the rendered pages (div.rendercontainer) of the later parts to the first part's body.
+
+    Everything else in the later parts' bodies (#container, #preload, the about page template) is a copy of the
+    first part's page skeleton and is skipped, except for the about page section, which only the last part has.
+    """
+    parser = etree.XMLParser(huge_tree=True)
+    root = etree.parse(parts[0], parser).getroot()
+    body = root.find('{*}body')
+    for part in parts[1:]:
+        part_body = etree.parse(part, parser).getroot().find('{*}body')
+        for child in list(part_body):
+            if isinstance(child.tag, str) and (_is_page(child) or (part == parts[-1] and _is_about_page(child))):
+                body.append(child)
+    with open(target, 'wt', encoding='utf-8') as f:
+        f.write(etree.tostring(root, encoding='unicode'))
+
+
+def merge_parts(job: dict, parts: list[RenderTask]):
+    """Merges the part PDFs and HTML files of the split job and removes the part files."""
+    parts = sorted(parts, key=lambda task: task.part)
+    pdfs = [task.job['pdfname'] for task in parts]
+    htmls = [pdf[:-3] + 'html' for pdf in pdfs]
+    merge_pdfs(pdfs, job['pdfname'])
+    merge_html(htmls, job['pdfname'][:-3] + 'html')
+    for file in pdfs + htmls + [task.job_file for task in parts]:
+        os.unlink(file)
+
+
+def efficiency_report(durations: list[tuple[float, float]], workers: int, wall: float) -> dict:
+    """
+    Summarizes a render run.
+
+    Args:
+        durations: (start, seconds) for each task, start relative to the start of the run
+        workers: number of parallel workers
+        wall: wall time of the run
+    """
+    busy = sum(seconds for _, seconds in durations)
+    workers = min(workers, len(durations)) or 1
+    last_start = max((start for start, _ in durations), default=0.0)
+    longest = max((seconds for _, seconds in durations), default=0.0)
+    return dict(tasks=len(durations), workers=workers, wall=round(wall, 3), busy=round(busy, 3),
+                efficiency=round(busy / (workers * wall), 4) if wall else None,
+                tail=round(wall - last_start, 3),
+                lower_bound=round(max(busy / workers, longest), 3))
+
+
+def log_efficiency(report: dict):
+    logger.info('Rendered %d jobs on %d workers in %.1f s (%.1f s busy, at least %.1f s needed): '
+                'parallel efficiency %.0f%%, tail %.1f s',
+                report['tasks'], report['workers'], report['wall'], report['busy'], report['lower_bound'],
+                100 * (report['efficiency'] or 0), report['tail'])
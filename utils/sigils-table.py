@@ -5,13 +5,20 @@ import os
 import re
 import pandas as pd
 import argparse
+import json
+from multiprocessing import Pool
 import sys
 import logging
+
+from instrumentation import add_profile_arguments, profile, stage
+from xml_batch import XMLBatch
+
 logging.basicConfig(level=logging.WARNING,
                     format='%(levelname)s:%(funcName)s:%(message)s')
 logger = logging.getLogger(__name__ if __name__ != '__main__' else sys.argv[0])
 
 NS={"f": "http://www.faustedition.net/ns", "tei": "http://www.tei-c.org/ns/1.0"}
+TEI_L = '{%s}l' % NS['tei']
 
 _number = re.compile(r'\b\d+\b')
 def extract_numbers(items):
@@ -20,32 +27,141 @@ def extract_numbers(items):
             yield int(match)
 
 
+class VerseRangeCache:
+    """
+    Minimum and maximum verse numbers of textual transcripts.
+
+    Each transcript is scanned at most once per run, and the results are
+    persisted in a JSON file together with the transcript's modification time,
+    so unchanged transcripts are not scanned again on subsequent runs.
+    """
+
+    def __init__(self, cache_file=None):
+        self.cache_file = cache_file
+        self.entries = {}  # absolute path → [mtime_ns, minVerse, maxVerse]
+        if cache_file:
+            try:
+                with open(cache_file, encoding='utf-8') as f:
+                    self.entries = json.load(f)
+            except FileNotFoundError:
+                pass
+            except ValueError as e:
+                logger.warning('Ignoring broken verse range cache %s: %s', cache_file, e)
+
+    def lookup(self, transcripts, pool=None):
+        """
+        Returns a dictionary transcript → (minVerse, maxVerse) for all given transcripts.
+
+        Transcripts that are missing from the cache or have been modified are scanned, in the given pool if any.
+        """
+        result = {}
+        todo = {}
+        for transcript in set(transcripts):
+            key = os.path.abspath(transcript)
+            try:
+                mtime = os.stat(key).st_mtime_ns
+            except OSError as e:
+                logger.error('Cannot read textual transcript %s: %s', transcript, e)
+                result[transcript] = (None, None)
+                continue
+            entry = self.entries.get(key)
+            if entry and entry[0] == mtime:
+                result[transcript] = tuple(entry[1:])
+            else:
+                todo[transcript] = (key, mtime)
+        if todo:
+            logger.info('Scanning %d of %d textual transcripts for verse numbers ...', len(todo), len(todo) + len(result))
+            if pool is None:
+                ranges = map(verse_range, todo)
+            else:
+                ranges = pool.imap(verse_range, todo, chunksize=8)
+            for transcript, verses in zip(todo, ranges):
+                key, mtime = todo[transcript]
+                self.entries[key] = [mtime, *verses]
+                result[transcript] = verses
+        return result
+
+    def save(self):
+        if self.cache_file:
+            with open(self.cache_file, 'w', encoding='utf-8') as f:
+                json.dump(self.entries, f)
+
+
+def verse_range(transcript):
+    """
+    Returns the minimum and maximum verse number (from tei:l/@n) in the given TEI file, or (None, None)
+    """
+    min_verse = max_verse = None
+    for _, l in etree.iterparse(transcript, events=('end',), tag=TEI_L):
+        for verse in extract_numbers([l.get('n', '')]):
+            if min_verse is None or verse < min_verse:
+                min_verse = verse
+            if max_verse is None or verse > max_verse:
+                max_verse = verse
+        # discard everything parsed so far, so only the current path stays in memory
+        l.clear(keep_tail=True)
+        for el in (l, *l.iterancestors()):
+            while el.getprevious() is not None:
+                del el.getparent()[0]
+    return min_verse, max_verse
+
+
+def read_metadata(filepath, directory, column_name):
+    """
+    Reads a single metadata file.
+
+    Returns:
+        a record for the sigils table, a dictionary column → value, and the
+        list of textual transcripts referenced by the document. minVerse and
+        maxVerse are left to be filled from the transcripts.
+    """
+    rel = os.path.relpath(filepath, start=directory)
+    uri = "faust://xml/" + rel
+    logger.debug('Reading metadata %s (URI %s)', filepath, uri)
+    meta = etree.parse(filepath)
+    record = {'URI': uri, 'type': meta.getroot().tag.split('}')[1]}
+
+    transcripts = []
+    for textTranscript in meta.xpath('//f:textTranscript', namespaces=NS):
+        transcript = os.path.join(directory, textTranscript.base[12:] + textTranscript.attrib["uri"])
+        logger.debug('  - textual transcript %s ...', transcript)
+        transcripts.append(transcript)
+    if transcripts:
+        record['minVerse'] = None
+        record['maxVerse'] = None
+
+    record[column_name] = ''
+    for idno in meta.xpath('//f:idno', namespaces=NS):
+        if idno.text != 'none':
+            record[idno.attrib["type"]] = idno.text
+    return record, transcripts
+
+
+def _read_metadata_job(args):
+    return read_metadata(*args)
+
+
 def write_sigils_table(options):
-    df = pd.DataFrame()
     docdir = os.path.join(options.directory, 'document')
     logger.info('Reading metadata from %s ...', docdir)
-    for path, dirs, files in os.walk(docdir):
-        for file in files:
-            filepath = os.path.join(path, file)
-            rel = os.path.relpath(filepath, start=options.directory)
-            uri = "faust://xml/" + rel
-            logger.debug('Reading metadata %s (URI %s)', filepath, uri)
-            meta = etree.parse(filepath)
-            df.at[uri, "type"] = meta.getroot().tag.split('}')[1]
-
-            textTranscripts = meta.xpath('//f:textTranscript', namespaces=NS)
-            for textTranscript in textTranscripts:
-                transcript = os.path.join(options.directory, textTranscript.base[12:] + textTranscript.attrib["uri"])
-                logger.debug('  - textual transcript %s ...', transcript)
-                text = etree.parse(transcript)
-                lines = list(extract_numbers(text.xpath('//tei:l/@n', namespaces=NS)))
-                df.at[uri, 'minVerse'] = min(lines, default=None)
-                df.at[uri, 'maxVerse'] = max(lines, default=None)
-
-            df.at[uri, options.column_name] = ''
-            for idno in meta.xpath('//f:idno', namespaces=NS):
-                if idno.text != 'none':
-                    df.at[uri, idno.attrib["type"]] = idno.text
+    jobs = [(os.path.join(path, file), options.directory, options.column_name)
+            for path, dirs, files in os.walk(docdir)
+            for file in files]
+    verse_ranges = VerseRangeCache(options.verse_cache)
+    with Pool(options.jobs) as pool:
+        with stage('parse'):
+            results = list(pool.imap(_read_metadata_job, jobs, chunksize=16))
+        with stage('verses'):
+            ranges = verse_ranges.lookup((transcript for _, transcripts in results for transcript in transcripts), pool)
+    verse_ranges.save()
+
+    with stage('compute'):
+        records = []
+        for record, transcripts in results:
+            for transcript in transcripts:
+                record['minVerse'], record['maxVerse'] = ranges[transcript]
+            records.append(record)
+        df = pd.DataFrame.from_records(records, index='URI') if records else pd.DataFrame()
 
     df.index.name = 'URI'
     logger.debug(df.describe())
@@ -55,14 +171,57 @@ def write_sigils_table(options):
     else:
         logger.info('Writing %d records to excel file %s, sheet %s', len(df),
                     options.excel_file, options.excel_sheet)
-        df.to_excel(options.excel_file, sheet_name=options.excel_sheet)
+        with stage('write'):
+            df.to_excel(options.excel_file, sheet_name=options.excel_sheet)
+
+def set_sigil(meta, uri, newsigil, idno_type, overwrite=False):
+    """
+    Edit for XMLBatch: Sets the idno of the given type in the metadata tree to newsigil.
+
+    Returns:
+        True iff the tree has been modified
+    """
+    exsigil = meta.xpath('//f:idno[@type="%s"]' % idno_type, namespaces=NS)
+    if exsigil:
+        if exsigil[0].text == newsigil:
+            logger.info('%s: idno %s already present.', uri, newsigil)
+            return False
+        elif overwrite:
+            logger.warn('%s: Replacing sigil "%s" with "%s"', uri,
+                        exsigil[0].text, newsigil)
+            exsigil[0].text = newsigil
+        else:
+            logger.error('%s: Refusing to replace sigil "%s" with "%s"',
+                         uri, exsigil[0].text, newsigil)
+            return False
+    else:
+        idnos = meta.xpath('/*/f:metadata/f:idno', namespaces=NS)
+        if idnos:
+            parent = idnos[0].getparent()
+            position = parent.index(idnos[0])
+            tail = idnos[0].tail
+        else:
+            parent = meta.xpath('/*/f:metadata', namespaces=NS)[0]
+            position = 0
+            tail = '\n   '
+        idno = parent.makeelement('idno',
+                                  attrib={'type': idno_type},
+                                  nsmap=NS)
+        idno.text = newsigil
+        idno.tail = tail
+        parent.insert(position, idno)
+        logger.info('%s: Added sigil %s', uri, newsigil)
+    return True
+
 
 def write_new_sigils(options):
     sheet = int(options.excel_sheet) \
         if options.excel_sheet.isnumeric() else options.excel_sheet
-    df = pd.read_excel(options.excel_file, sheet, index_col=options.uri_column,
-                       na_values=['?'])
+    with stage('load'):
+        df = pd.read_excel(options.excel_file, sheet, index_col=options.uri_column,
+                           na_values=['?'])
 
+    batch = XMLBatch()
     for uri in df.index:
         newsigil = df.at[uri, options.column_name]
         if not(isinstance(uri, str)) or len(uri) <= 12:
@@ -73,38 +232,10 @@ def write_new_sigils(options):
         if not(newsigil) or not(isinstance(newsigil, str)):
             logger.warn('%s: No valid sigil: %s', uri, newsigil)
             continue
-        meta = etree.parse(filename)
-        exsigil = meta.xpath('//f:idno[@type="%s"]' % options.idno_type, namespaces=NS)
-        if exsigil:
-            if exsigil[0].text == newsigil:
-                logger.info('%s: idno %s already present.', uri, newsigil)
-                continue
-            elif options.overwrite_sigils:
-                logger.warn('%s: Replacing sigil "%s" with "%s"', uri,
-                            exsigil[0].text, newsigil)
-                exsigil[0].text = newsigil
-            else:
-                logger.error('%s: Refusing to replace sigil "%s" with "%s"',
-                             uri, exsigil[0].text, newsigil)
-                continue
-        else:
-            idnos = meta.xpath('/*/f:metadata/f:idno', namespaces=NS)
-            if idnos:
-                parent = idnos[0].getparent()
-                position = parent.index(idnos[0])
-                tail = idnos[0].tail
-            else:
-                parent = meta.xpath('/*/f:metadata', namespaces=NS)[0]
-                position = 0
-                tail = '\n   '
-            idno = parent.makeelement('idno',
-                                      attrib={'type': options.idno_type},
-                                      nsmap=NS)
-            idno.text = newsigil
-            idno.tail = tail
-            parent.insert(position, idno)
-            logger.info('%s: Added sigil %s', uri, newsigil)
-        meta.write(filename, encoding='utf-8', xml_declaration=True)
+        batch.add(filename, set_sigil, uri, newsigil, options.idno_type, options.overwrite_sigils)
+    logger.info('Writing sigils to %d metadata files ...', len(batch))
+    with stage('write'):
+        batch.apply(options.jobs)
 
 
 def get_argparser():
@@ -126,10 +257,15 @@ def get_argparser():
                         help='Overwrite existing sigils')
     parser.add_argument('-i', '--idno-type', default='faustedition',
                         help='Sigil type for new sigil')
+    parser.add_argument('-c', '--verse-cache', default='.sigils-verse-cache.json',
+                        help='File to cache the verse ranges of the textual transcripts in. Empty string to disable')
+    parser.add_argument('-j', '--jobs', type=int,
+                        help='number of parallel jobs for reading the metadata (default: number of CPUs)')
     parser.add_argument('-v', '--verbose', action='count', default=0,
                         help='increase verbosity')
     parser.add_argument('-q', '--quiet', action='count', default=0,
                         help='decrease verbosity')
+    add_profile_arguments(parser)
     return parser
 
 def main():
@@ -138,10 +274,11 @@ def main():
                     - (10*options.verbose)
                     + (10*options.quiet))
     logger.debug("Options: %s", options)
-    if options.write_sigils:
-        write_new_sigils(options)
-    else:
-        write_sigils_table(options)
+    with profile('sigils-table', options):
+        if options.write_sigils:
+            write_new_sigils(options)
+        else:
+            write_sigils_table(options)
 
 if __name__ == '__main__':
     main()
@@ -17,6 +17,8 @@ from lxml import etree, objectify
 from lxml.builder import E, ElementMaker
 from ruamel.yaml import YAML
 
+from instrumentation import add_profile_arguments, profile, stage
+
 DOC = """
 An opinionated and configurable converter from tables (Excel, csv) to XML input.
 
@@ -85,6 +87,7 @@ def getargparser() -> argparse.ArgumentParser:
         help="Convert to XML and write file",
     )
     p.add_argument('--debug-columns', action='store_true', help="Dump the final columns config")
+    add_profile_arguments(p)
     return p
 
 
@@ -225,10 +228,16 @@ class Converter:
 
 def _main():
     options = getargparser().parse_args()
+    with profile('table2xml', options):
+        _convert(options)
+
+
+def _convert(options):
     converter = Converter()
-    if options.config:
-        converter.load_config(options.config)
-    table = read_table(options.table)
+    with stage('load'):
+        if options.config:
+            converter.load_config(options.config)
+        table = read_table(options.table)
     if converter.config.get("transpose"):
         converter.fit_columns(table.index)
     else:
@@ -238,8 +247,10 @@ def _main():
     if options.debug_columns:
         yaml.dump(list(converter.columns.values()), stream=sys.stdout)
     if options.output:
-        et = converter.table2xml(table).getroottree()
-        et.write(options.output, encoding="utf-8", pretty_print=True)
+        with stage('compute'):
+            et = converter.table2xml(table).getroottree()
+        with stage('write'):
+            et.write(options.output, encoding="utf-8", pretty_print=True)
 
 if __name__ == "__main__":
     _main()
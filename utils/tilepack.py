@@ -0,0 +1,328 @@
+#!/usr/bin/env python3
+
+"""
+Packed tile archives for the facsimile viewer.
+
+The `jpg_tiles` tree contains one small JPEG file per tile, `<img>_<level>_<x>_<y>.jpg`,
+which adds up to millions of files for the whole edition. A tile pack replaces
+all tile files of one image with a single file, `<img>.tilepack`, next to where
+the tiles would be.
+
+Format (all numbers little endian):
+
+- header: magic `FTPK`, version (u16), number of levels (u16), tile width and
+  height (u16 each), image width and height at level 0 (u32 each)
+- index: one entry (offset u64, length u32) per tile, ordered by level, x, y.
+  The number of tiles per level follows from the image and tile size (each
+  level is half the size of the previous, rounded up), so the entry for a tile
+  is found by computing its position. Missing tiles have length 0.
+- the tiles' JPEG data
+
+Packs are read via mmap, a tile is a zero-copy slice of the mapped file.
+
+Usage:
+
+    tilepack.py pack <facsimile dir>   # pack the jpg_tiles tree, optionally removing the tile files
+    tilepack.py serve <jpg_tiles dir>  # serve tiles from the packs via HTTP, for testing
+
+`TilePackApp` is a WSGI application that serves `…/<img>_<level>_<x>_<y>.jpg` requests from the packs.
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+from collections import OrderedDict
+from multiprocessing import Pool
+from pathlib import Path
+from typing import Callable, Optional
+
+from tqdm import tqdm
+
+logger = logging.getLogger(__name__)
+
+PACK_SUFFIX = '.tilepack'
+MAGIC = b'FTPK'
+VERSION = 1
+HEADER = struct.Struct('<4sHHHHII')
+INDEX_ENTRY = struct.Struct('<QI')
+
+TILE_PATH = re.compile(r'^/*(?P<img>.+)_(?P<level>\d+)_(?P<x>\d+)_(?P<y>\d+)\.(?P<ext>jpg|webp|avif)$')
+CONTENT_TYPES = {'jpg': 'image/jpeg', 'webp': 'image/webp', 'avif': 'image/avif'}
+
+
+def grid(width: int, height: int, tile_width: int, tile_height: int, levels: int) -> list[tuple[int, int]]:
+    """Returns (columns, rows) of tiles for each level."""
+    result = []
+    for _ in range(levels):
+        result.append((-(-width // tile_width), -(-height // tile_height)))
+        width, height = -(-width // 2), -(-height // 2)
+    return result
+
+
+class TilePack:
+    """Read access to a tile pack."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with self.path.open('rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._data = memoryview(self._mmap)
+        magic, version, self.levels, self.tile_width, self.tile_height, self.width, self.height = \
+            HEADER.unpack_from(self._data)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f'{path} is not a tile pack (version {VERSION})')
+        self.grid = grid(self.width, self.height, self.tile_width, self.tile_height, self.levels)
+        self._level_start = []
+        start = 0
+        for columns, rows in self.grid:
+            self._level_start.append(start)
+            start += columns * rows
+
+    @property
+    def zoom_levels(self):
+        return self.levels - 1
+
+    def __len__(self):
+        columns, rows = self.grid[-1]
+        return self._level_start[-1] + columns * rows
+
+    def _position(self, level: int, x: int, y: int) -> Optional[int]:
+        if not 0 <= level < self.levels:
+            return None
+        columns, rows = self.grid[level]
+        if not (0 <= x < columns and 0 <= y < rows):
+            return None
+        return self._level_start[level] + x * rows + y
+
+    def tile(self, level: int, x: int, y: int) -> Optional[memoryview]:
+        """Returns the JPEG data for the given tile, or None if there is no such tile."""
+        position = self._position(level, x, y)
+        if position is None:
+            return None
+        offset, length = INDEX_ENTRY.unpack_from(self._data, HEADER.size + position * INDEX_ENTRY.size)
+        if not length:
+            return None
+        return self._data[offset:offset + length]
+
+    def __contains__(self, key: tuple[int, int, int]) -> bool:
+        return self.tile(*key) is not None
+
+    def close(self):
+        self._data.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass    # tiles returned by tile() are still in use, the mapping is closed when they are released
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def write_pack(path: Path, width: int, height: int, tile_width: int, tile_height: int, zoom_levels: int,
+               get_tile: Callable[[int, int, int], Optional[bytes]]) -> int:
+    """
+    Writes a tile pack, atomically.
+
+    Args:
+        get_tile: function (level, x, y) → JPEG data or None for each tile
+
+    Returns:
+        the number of missing tiles
+    """
+    path = Path(path)
+    levels = zoom_levels + 1
+    tiles = [(level, x, y)
+             for level, (columns, rows) in enumerate(grid(width, height, tile_width, tile_height, levels))
+             for x in range(columns) for y in range(rows)]
+    index = bytearray(INDEX_ENTRY.size * len(tiles))
+    offset = HEADER.size + len(index)
+    missing = 0
+    tmp_file = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    try:
+        with tmp_file.open('wb') as f:
+            f.write(HEADER.pack(MAGIC, VERSION, levels, tile_width, tile_height, width, height))
+            f.write(index)
+            for position, (level, x, y) in enumerate(tiles):
+                data = get_tile(level, x, y)
+                if data is None:
+                    missing += 1
+                    continue
+                f.write(data)
+                INDEX_ENTRY.pack_into(index, position * INDEX_ENTRY.size, offset, len(data))
+                offset += len(data)
+            f.seek(HEADER.size)
+            f.write(index)
+        os.replace(tmp_file, path)
+    except BaseException:
+        tmp_file.unlink(missing_ok=True)
+        raise
+    return missing
+
+
+def _read_file(path: Path) -> Optional[bytes]:
+    try:
+        return path.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def pack_image(facsimile_dir: Path, img: str, remove_tiles=False) -> int:
+    """
+    Packs the tile files of a single image from the jpg_tiles tree.
+
+    Args:
+        facsimile_dir: root of the facsimile tree, with metadata and jpg_tiles subdirectories
+        img: path of the image, relative to the subdirectories and without suffix
+        remove_tiles: remove the tile files after the pack has been written
+
+    Returns:
+        the number of tiles missing from the tree
+    """
+    with (facsimile_dir / 'metadata' / f'{img}.json').open(encoding='utf-8') as f:
+        md = json.load(f)
+    tiles_dir = facsimile_dir / 'jpg_tiles'
+    tile_file = lambda level, x, y: tiles_dir / f'{img}_{level}_{x}_{y}.jpg'
+    missing = write_pack(tiles_dir / f'{img}{PACK_SUFFIX}', md['imageWidth'], md['imageHeight'],
+                         md['tileWidth'], md['tileHeight'], md['zoomLevels'],
+                         lambda level, x, y: _read_file(tile_file(level, x, y)))
+    if remove_tiles:
+        for level, (columns, rows) in enumerate(grid(md['imageWidth'], md['imageHeight'],
+                                                     md['tileWidth'], md['tileHeight'], md['zoomLevels'] + 1)):
+            for x in range(columns):
+                for y in range(rows):
+                    tile_file(level, x, y).unlink(missing_ok=True)
+    return missing
+
+
+def _pack_job(args):
+    facsimile_dir, img, remove_tiles = args
+    try:
+        return img, pack_image(facsimile_dir, img, remove_tiles), None
+    except Exception as e:
+        return img, 0, e
+
+
+def pack_tree(facsimile_dir: Path, processes=None, remove_tiles=False, force=False) -> list[tuple[str, Exception]]:
+    """
+    Packs the tiles for all images in the facsimile tree, in parallel.
+
+    Images that already have a pack that is newer than their metadata JSON are skipped unless force is true.
+
+    Returns:
+        list of (img, exception) for the images that could not be packed
+    """
+    facsimile_dir = Path(facsimile_dir)
+    metadata_dir = facsimile_dir / 'metadata'
+    jobs = []
+    for md_file in sorted(metadata_dir.rglob('*.json')):
+        img = md_file.relative_to(metadata_dir).with_suffix('').as_posix()
+        pack = facsimile_dir / 'jpg_tiles' / f'{img}{PACK_SUFFIX}'
+        if not force and pack.exists() and pack.stat().st_mtime_ns >= md_file.stat().st_mtime_ns:
+            continue
+        jobs.append((facsimile_dir, img, remove_tiles))
+    logger.info('Packing the tiles of %d images in %s ...', len(jobs), facsimile_dir)
+    failures = []
+    with Pool(processes) as pool:
+        for img, missing, error in tqdm(pool.imap_unordered(_pack_job, jobs), total=len(jobs), unit='image'):
+            if error is not None:
+                logger.error('Failed to pack %s: %s', img, error)
+                failures.append((img, error))
+            elif missing:
+                logger.warning('%s: %d tiles missing', img, missing)
+    return failures
+
+
+class TilePackApp:
+    """
+    WSGI application that serves tiles from the packs below tiles_dir.
+
+    A request for `/<img>_<level>_<x>_<y>.jpg` is answered from `<tiles_dir>/<img>.tilepack`. The
+    .webp and .avif variants are served from packs in the respective `webp_tiles`/`avif_tiles` directory
+    next to tiles_dir, or from the directories given in format_dirs (extension → directory).
+    Recently used packs are kept open; a pack that has been replaced is reopened. The app may be used by a
+    threaded server: packs that are evicted from the cache or replaced are not closed explicitly, but unmapped
+    when the last request that still uses them has finished.
+    """
+
+    def __init__(self, tiles_dir, max_open=256, format_dirs: Optional[dict] = None):
+        self.tiles_dir = Path(tiles_dir)
+        self.max_open = max_open
+        self.format_dirs = {ext: self.tiles_dir.parent / f'{ext}_tiles' for ext in CONTENT_TYPES}
+        self.format_dirs['jpg'] = self.tiles_dir
+        self.format_dirs.update({ext: Path(directory) for ext, directory in (format_dirs or {}).items()})
+        self._packs = OrderedDict()     # (ext, img) → (stat key, TilePack)
+        self._lock = threading.Lock()
+
+    def pack(self, img: str, ext: str = 'jpg') -> Optional[TilePack]:
+        path = self.format_dirs[ext] / f'{img}{PACK_SUFFIX}'
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        key = stat.st_ino, stat.st_mtime_ns
+        with self._lock:
+            cached = self._packs.get((ext, img))
+            if cached and cached[0] == key:
+                self._packs.move_to_end((ext, img))
+                return cached[1]
+            pack = TilePack(path)
+            self._packs[ext, img] = key, pack
+            self._packs.move_to_end((ext, img))
+            if len(self._packs) > self.max_open:
+                self._packs.popitem(last=False)
+            return pack
+
+    def __call__(self, environ, start_response):
+        match = TILE_PATH.match(environ.get('PATH_INFO', ''))
+        if match and '..' not in match['img'].split('/'):
+            pack = self.pack(match['img'], match['ext'])
+            data = pack and pack.tile(int(match['level']), int(match['x']), int(match['y']))
+            if data is not None:
+                start_response('200 OK', [('Content-Type', CONTENT_TYPES[match['ext']]),
+                                          ('Content-Length', str(len(data))),
+                                          ('Cache-Control', 'public, max-age=86400')])
+                return [bytes(data)]    # PEP 3333 requires bytes
+        start_response('404 Not Found', [('Content-Type', 'text/plain')])
+        return [b'Not Found']
+
+
+def getargparser():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = p.add_subparsers(dest='command', required=True)
+
+    pack = commands.add_parser('pack', help='pack the tile files of a facsimile tree')
+    pack.add_argument('facsimile_dir', type=Path, help='directory containing the metadata and jpg_tiles directories')
+    pack.add_argument('-r', '--remove-tiles', action='store_true', help='remove the tile files after packing')
+    pack.add_argument('-f', '--force', action='store_true', help='repack images that already have a current pack')
+    pack.add_argument('-j', '--jobs', type=int, help='number of parallel jobs (default: number of CPUs)')
+
+    serve = commands.add_parser('serve', help='serve tiles from packs via HTTP')
+    serve.add_argument('tiles_dir', type=Path, help='directory containing the packs, i.e. jpg_tiles')
+    serve.add_argument('-p', '--port', type=int, default=8000)
+    return p
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    options = getargparser().parse_args()
+    if options.command == 'pack':
+        if pack_tree(options.facsimile_dir, options.jobs, options.remove_tiles, options.force):
+            raise SystemExit(1)
+    elif options.command == 'serve':
+        from wsgiref.simple_server import make_server
+        with make_server('', options.port, TilePackApp(options.tiles_dir)) as server:
+            logger.info('Serving tiles from %s on port %d', options.tiles_dir, options.port)
+            server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
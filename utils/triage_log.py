@@ -0,0 +1,361 @@
+#!/usr/bin/env python3
+
+"""
+Streaming triage of a build log, using the rules from .error-rules.txt.
+
+The rules file has the format of Jenkins' log parser plugin: one rule per
+line, `kind /regular expression/`, with kind one of error, warning, info, ok
+or start; empty lines and lines starting with # are ignored. As in the plugin,
+a log line is classified by the first rule that matches anywhere in the line.
+All rules are compiled into a single regular expression, so each line is
+matched once, independent of the number of rules.
+
+A `start` rule begins a new section (task) of the log; its first group (or
+the whole match) is the section's name, everything before the first start
+line is the `(preamble)`. For each section, the number of lines, errors and
+warnings and the first few error and warning lines are collected. If the log
+lines carry timestamps (ISO 8601 date and time or a time of day, optionally
+in brackets, at the beginning of the line, as written by Jenkins'
+timestamper or `ts`; see `--timestamp`), each section's wall time is the
+time from its start to the start of the next section.
+
+The log is read line by line, so memory use does not depend on its size.
+With `--follow`, the tool keeps reading a log that is still being written
+(like `tail -f`), reports new errors and sections as they appear and writes
+the report on Ctrl-C or after `--idle` seconds without new lines. `-` reads
+the log from stdin, e.g. `./gradlew build 2>&1 | triage_log.py - -o triage.json`.
+
+The result is printed as a short summary (totals, sections with errors,
+slowest sections) and, with `-o`, written as JSON.
+"""
+
+import argparse
+import json
+import logging
+import os
+import re
+import sys
+import time
+from dataclasses import dataclass, field, asdict
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional, TextIO
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+KINDS = ('error', 'warning', 'info', 'ok', 'start')
+PREAMBLE = '(preamble)'
+TIMESTAMP = (r'^\[?\s*(?P<timestamp>(?:\d{4}-\d{2}-\d{2}[T ])?\d{2}:\d{2}:\d{2}(?:[.,]\d+)?'
+             r'(?:Z|[+-]\d{2}:?\d{2})?)\]?')
+
+
+class Rule(NamedTuple):
+    kind: str
+    pattern: str
+
+
+def read_rules(path: Path) -> list[Rule]:
+    """Reads a log parser rules file."""
+    rules = []
+    with Path(path).open(encoding='utf-8') as f:
+        for number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            kind, _, rest = line.partition(' ')
+            rest = rest.strip()
+            if kind not in KINDS or len(rest) < 2 or rest[0] != '/' or rest[-1] != '/':
+                raise ValueError(f'{path}:{number}: cannot parse rule {line!r}')
+            rules.append(Rule(kind, rest[1:-1]))
+    return rules
+
+
+class RuleSet:
+    """All rules, compiled into a single regular expression."""
+
+    def __init__(self, rules: list[Rule]):
+        self.rules = rules
+        alternatives = []
+        for index, rule in enumerate(rules):
+            re.compile(rule.pattern)        # fails early with a clear error for a broken rule
+            alternatives.append(f'.*?(?P<r{index}>{rule.pattern})')
+        self.regex = re.compile('|'.join(alternatives)) if alternatives else None
+        # most lines match no rule at all, which an unanchored search of all patterns finds out much faster
+        self._any = re.compile('|'.join(f'(?:{rule.pattern})' for rule in rules)) if rules else None
+        # The rule's group closes last, so match.lastindex identifies the rule. Its first inner group names a section.
+        self._rules_by_group = {}
+        for index, rule in enumerate(rules):
+            group = self.regex.groupindex[f'r{index}']
+            self._rules_by_group[group] = (rule.kind, group + 1 if re.compile(rule.pattern).groups else group)
+
+    def classify(self, line: str) -> Optional[tuple[str, str]]:
+        """Returns (kind, name) for the first rule matching line, or None. name is the start rule's first group."""
+        if self.regex is None:
+            return None
+        if self._any.search(line) is None:
+            return None
+        match = self.regex.match(line)
+        if match is None:
+            return None
+        kind, name_group = self._rules_by_group[match.lastindex]
+        return kind, match.group(name_group) or match.group(match.lastindex)
+
+
+@dataclass
+class Section:
+    """A section of the log, from one start line to the next."""
+    name: str
+    first_line: int
+    header: Optional[str] = None
+    lines: int = 0
+    counts: dict[str, int] = field(default_factory=dict)
+    started: Optional[float] = None     # first timestamp in the section
+    ended: Optional[float] = None       # start of the next section, or the last timestamp in the section
+    examples: list[tuple[int, str, str]] = field(default_factory=list)   # line number, kind, text
+
+    @property
+    def seconds(self) -> Optional[float]:
+        return self.ended - self.started if self.started is not None and self.ended is not None else None
+
+    def as_dict(self) -> dict:
+        result = asdict(self)
+        result['seconds'] = round(self.seconds, 3) if self.seconds is not None else None
+        for key in 'started', 'ended':
+            if result[key] is not None:
+                result[key] = datetime.fromtimestamp(result[key]).isoformat(timespec='milliseconds')
+        result['examples'] = [dict(line=number, kind=kind, text=text) for number, kind, text in self.examples]
+        return result
+
+
+class TimestampParser:
+    """Parses the timestamps at the start of the log lines to POSIX time, handling day changes for times of day."""
+
+    def __init__(self, pattern: Optional[str] = TIMESTAMP):
+        self.regex = re.compile(pattern) if pattern else None
+        self._day = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self._last: Optional[float] = None
+
+    def find(self, line: str) -> Optional[str]:
+        """The timestamp at the start of line, unparsed."""
+        if self.regex is None:
+            return None
+        match = self.regex.match(line)
+        return match.group('timestamp') if match else None
+
+    def parse(self, text: Optional[str]) -> Optional[float]:
+        """Converts a timestamp found by find(). Times of day must be parsed in log order."""
+        if text is None:
+            return None
+        text = text.replace(',', '.')
+        if text.endswith('Z'):
+            text = text[:-1] + '+00:00'
+        try:
+            if len(text) > 8 and text[2] != ':':
+                result = datetime.fromisoformat(text).timestamp()
+            else:
+                result = datetime.combine(self._day.date(), datetime.strptime(text[:15], '%H:%M:%S.%f' if '.' in text
+                                                                              else '%H:%M:%S').time()).timestamp()
+                if self._last is not None and result < self._last - 12 * 3600:
+                    self._day += timedelta(days=1)
+                    result += 24 * 3600
+        except ValueError:
+            return None
+        self._last = result
+        return result
+
+    def __call__(self, line: str) -> Optional[float]:
+        return self.parse(self.find(line))
+
+
+class Triage:
+    """Classifies a stream of log lines, section by section."""
+
+    def __init__(self, rules: RuleSet, timestamps: TimestampParser, examples: int = 3, on_event=None):
+        self.rules = rules
+        self.timestamps = timestamps
+        self.max_examples = examples
+        self.on_event = on_event        # called with (section, kind, line number, line) for starts, errors and warnings
+        self.line_number = 0
+        self.first_timestamp: Optional[float] = None
+        self.current = Section(PREAMBLE, 1)
+        self.sections: list[Section] = [self.current]
+        self._last_stamp: Optional[str] = None      # unparsed; timestamps are only parsed at section boundaries
+        self._examples: dict[str, int] = {}
+
+    def _close_section(self, next_stamp: Optional[str] = None):
+        """Sets the current section's end to the next section's start, or to its own last timestamp."""
+        if self.current.started is not None:
+            self.current.ended = self.timestamps.parse(next_stamp or self._last_stamp)
+
+    def feed(self, line: str):
+        self.line_number += 1
+        line = line.rstrip('\r\n')
+        stamp = self.timestamps.find(line)
+        classified = self.rules.classify(line)
+        kind = classified[0] if classified else None
+        if kind == 'start':
+            self._close_section(stamp)
+            self.current = Section(classified[1], self.line_number, header=line.strip())
+            self.sections.append(self.current)
+            self._examples = {}
+            if self.on_event:
+                self.on_event(self.current, kind, self.line_number, line)
+        section = self.current
+        section.lines += 1
+        if stamp is not None:
+            if section.started is None:
+                section.started = self.timestamps.parse(stamp)
+                if self.first_timestamp is None:
+                    self.first_timestamp = section.started
+            self._last_stamp = stamp
+        if kind and kind != 'start':
+            section.counts[kind] = section.counts.get(kind, 0) + 1
+            if kind in ('error', 'warning'):
+                if self._examples.get(kind, 0) < self.max_examples:
+                    self._examples[kind] = self._examples.get(kind, 0) + 1
+                    section.examples.append((self.line_number, kind, line.strip()[:500]))
+                if self.on_event:
+                    self.on_event(section, kind, self.line_number, line)
+
+    def feed_all(self, lines: Iterable[str]):
+        for line in lines:
+            self.feed(line)
+
+    def totals(self) -> dict[str, int]:
+        totals = {}
+        for section in self.sections:
+            for kind, count in section.counts.items():
+                totals[kind] = totals.get(kind, 0) + count
+        return totals
+
+    def report(self) -> dict:
+        """The triage result so far. Completes the current section, so call it after the last line."""
+        self._close_section()
+        last_timestamp = self.timestamps.parse(self._last_stamp)
+        sections = [section for section in self.sections if section.lines]
+        return dict(lines=self.line_number,
+                    sections=len(sections),
+                    totals=self.totals(),
+                    seconds=round(last_timestamp - self.first_timestamp, 3)
+                    if self.first_timestamp is not None and last_timestamp is not None else None,
+                    failed=[section.name for section in sections if section.counts.get('error')],
+                    details=[section.as_dict() for section in sections])
+
+
+def follow(f: TextIO, poll: float = 0.5, idle: Optional[float] = None, path: Optional[Path] = None) -> Iterator[str]:
+    """
+    Yields the complete lines of f, waiting for more at its end, like `tail -f`.
+
+    Stops after idle seconds without new data. If path is given and the file at path is replaced or truncated,
+    continues with the new file.
+    """
+    partial = ''
+    last_data = time.monotonic()
+    while True:
+        chunk = f.readline()
+        if chunk:
+            last_data = time.monotonic()
+            partial += chunk
+            if partial.endswith('\n'):
+                yield partial
+                partial = ''
+            continue
+        if idle is not None and time.monotonic() - last_data >= idle:
+            break
+        if path is not None:
+            try:
+                stat = path.stat()
+                if stat.st_ino != _inode(f) or stat.st_size < f.tell():
+                    logger.info('%s has been replaced or truncated, reopening', path)
+                    f.close()
+                    f = path.open(encoding='utf-8', errors='replace')
+                    continue
+            except FileNotFoundError:
+                pass
+        time.sleep(poll)
+    if partial:
+        yield partial
+
+
+def _inode(f: TextIO) -> Optional[int]:
+    try:
+        return os.fstat(f.fileno()).st_ino
+    except (OSError, ValueError):
+        return None
+
+
+def summary(report: dict, top: int = 10) -> str:
+    totals = report['totals']
+    lines = [f'{report["lines"]} lines, {report["sections"]} sections, {totals.get("error", 0)} errors, '
+             f'{totals.get("warning", 0)} warnings'
+             + (f', {timedelta(seconds=round(report["seconds"]))} wall time' if report['seconds'] is not None else '')]
+    failed = [section for section in report['details'] if section['counts'].get('error')]
+    if failed:
+        lines.append('')
+        lines.append('Sections with errors:')
+        for section in failed:
+            lines.append(f'  {section["name"]} (line {section["first_line"]}): {section["counts"]["error"]} errors, '
+                         f'{section["counts"].get("warning", 0)} warnings')
+            for example in section['examples']:
+                if example['kind'] == 'error':
+                    lines.append(f'    {example["line"]:>8}: {example["text"][:160]}')
+    timed = sorted((section for section in report['details'] if section['seconds'] is not None),
+                   key=lambda section: -section['seconds'])[:top]
+    if timed:
+        lines.append('')
+        lines.append('Slowest sections:')
+        for section in timed:
+            lines.append(f'  {section["seconds"]:10.1f} s  {section["name"]} (line {section["first_line"]}, '
+                         f'{section["counts"].get("warning", 0)} warnings)')
+    return '\n'.join(lines)
+
+
+def getargparser():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('log', help='build log, - for stdin')
+    p.add_argument('-r', '--rules', type=Path, default=ROOT / '.error-rules.txt', help='rules file (default: %(default)s)')
+    p.add_argument('-o', '--output', type=Path, help='write the JSON report to this file')
+    p.add_argument('-t', '--timestamp', default=TIMESTAMP,
+                   help='regular expression for the timestamp at the start of a line, with a group named timestamp; '
+                        'empty to ignore timestamps')
+    p.add_argument('-e', '--examples', type=int, default=3, help='number of error and of warning lines kept per section')
+    p.add_argument('--top', type=int, default=10, help='number of slowest sections in the summary')
+    p.add_argument('-f', '--follow', action='store_true', help='keep reading the growing log, like tail -f')
+    p.add_argument('--idle', type=float, help='with --follow, stop after this many seconds without new lines')
+    p.add_argument('--quiet', action='store_true', help='with --follow, do not report errors and sections as they appear')
+    return p
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    options = getargparser().parse_args()
+
+    def report_event(section, kind, number, line):
+        if kind == 'start':
+            logger.info('%8d: section %s', number, section.name)
+        else:
+            logger.log(logging.ERROR if kind == 'error' else logging.WARNING, '%8d: [%s] %s', number, section.name,
+                       line.strip()[:200])
+
+    triage = Triage(RuleSet(read_rules(options.rules)), TimestampParser(options.timestamp or None), options.examples,
+                    on_event=report_event if options.follow and not options.quiet else None)
+    path = None if options.log == '-' else Path(options.log)
+    f = sys.stdin if path is None else path.open(encoding='utf-8', errors='replace')
+    try:
+        triage.feed_all(follow(f, idle=options.idle, path=path) if options.follow else f)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    report = triage.report()
+    if options.output:
+        with options.output.open('wt', encoding='utf-8') as out:
+            json.dump(report, out, indent=1, ensure_ascii=False)
+    print(summary(report, options.top))
+    sys.exit(1 if report['failed'] else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,474 @@
+#!/usr/bin/env python3
+
+"""
+Offline verse-level full text index of the reading text (downloads/faust.xml).
+
+`verse_index.py build` reads the TEI reading text, as verse_stats.py does, and
+writes a compact binary index with one entry per 'line' (verse, part of an
+antilabial verse, stage direction, speaker, … – every element with @n except
+the sections). The textcrit notes are not indexed. Each line records its @n,
+element, innermost section, speaker and plain text. The index contains
+
+- the normalized tokens (case folded, Unicode NFKC) with the line and token
+  position of each occurrence, sorted, so exact terms, prefixes and phrases
+  can be looked up by binary search, and
+- the character n-grams (trigrams by default) of the tokens with the lines
+  they occur in, for substring queries.
+
+The index file consists of a small JSON header and flat arrays of unsigned
+32 bit integers and UTF-8 string tables. It is memory mapped when opened, so
+opening is instantaneous and a query only touches the pages it needs.
+
+`verse_index.py query` (or `VerseIndex.search`) searches the index. A query
+consists of clauses that must all match the same line:
+
+    habe              the term `habe`
+    hab*              a term starting with `hab`
+    *eist*            a term containing `eist`
+    "habe nun ach"    the phrase, i.e. these terms at consecutive positions
+    section:1.1       only lines in section 1.1 or its subsections
+    speaker:faust     only lines spoken by Faust
+
+The index is rebuilt automatically by `VerseIndex.for_source` when the
+source has changed.
+"""
+
+import argparse
+import json
+import logging
+import mmap
+import os
+import re
+import shlex
+import sys
+import time
+import unicodedata
+from array import array
+from collections import defaultdict
+from pathlib import Path
+from typing import Iterable, Iterator, NamedTuple, Optional, Union
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+ROOT = Path(__file__).resolve().parent.parent
+DEFAULT_SOURCE = ROOT / 'build/www/downloads/faust.xml'
+DEFAULT_INDEX = ROOT / 'build/verse-index.bin'
+MAGIC = b'FVINDEX\0'
+FORMAT_VERSION = 1
+NGRAM = 3
+
+_ns = {'tei': 'http://www.tei-c.org/ns/1.0'}
+_token = re.compile(r'\w+')
+_clause = re.compile(r'"([^"]*)"|(\S+)')
+
+assert array('I').itemsize == 4, 'unsigned int must have 32 bits'
+
+
+class Line(NamedTuple):
+    """A line of the reading text, as found in the index."""
+    id: int                 # position of the line in the index (document order)
+    n: str                  # @n, e.g. 1234 or before_1178_b
+    element: str            # local name of the TEI element, e.g. l, stage or speaker
+    section: str            # innermost section, e.g. 2.3.1
+    speaker: str            # speaker of the enclosing speech act, '' if none
+    text: str               # plain text, whitespace normalized
+
+
+def normalize(text: str) -> str:
+    return unicodedata.normalize('NFKC', text).casefold()
+
+
+def tokenize(text: str) -> list[str]:
+    """The normalized tokens of the given text."""
+    return _token.findall(normalize(text))
+
+
+def ngrams(token: str, n: int = NGRAM) -> set[str]:
+    return {token[i:i + n] for i in range(len(token) - n + 1)}
+
+
+def _normalize_space(text: str) -> str:
+    return ' '.join(text.split())
+
+
+def read_lines(source: Union[str, Path]) -> list[tuple[str, str, str, str, str]]:
+    """Reads the lines (n, element, section, speaker, text) from the TEI reading text."""
+    tei = etree.parse(os.fspath(source), etree.XMLParser(huge_tree=True))
+    for note in tei.xpath('//tei:note[@type="textcrit"]', namespaces=_ns):
+        note.getparent().remove(note)
+    lines = []
+    speakers = {}
+    for el in tei.xpath('//*[@n][not(self::tei:div)]', namespaces=_ns):
+        sp = next(el.iterancestors('{*}sp'), None)
+        if sp not in speakers:
+            speakers[sp] = '' if sp is None else \
+                _normalize_space(' '.join(''.join(speaker.itertext()) for speaker in sp.iter('{*}speaker')))
+        section = next(el.iterancestors('{*}div'), None)
+        lines.append((el.get('n'), etree.QName(el).localname, section.get('n', '') if section is not None else '',
+                      speakers[sp], _normalize_space(''.join(el.itertext()))))
+    return lines
+
+
+class _Writer:
+    """Collects the sections of an index file."""
+
+    def __init__(self):
+        self.sections: dict[str, tuple[str, bytes]] = {}
+
+    def ints(self, name: str, values: Iterable[int]):
+        self.sections[name] = ('I', array('I', values).tobytes())
+
+    def strings(self, name: str, values: Iterable[str]):
+        offsets, data = [0], bytearray()
+        for value in values:
+            data += value.encode('utf-8')
+            offsets.append(len(data))
+        self.ints(name + '_offsets', offsets)
+        self.sections[name] = ('B', bytes(data))
+
+    def write(self, path: Path, header: dict):
+        layout, position = {}, 0
+        for name, (kind, data) in self.sections.items():
+            layout[name] = [kind, position, len(data)]
+            position += len(data) + (-len(data) % 8)
+        header = dict(header, version=FORMAT_VERSION, byteorder=sys.byteorder, sections=layout)
+        header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+        header_bytes += b' ' * (-(len(MAGIC) + 4 + len(header_bytes)) % 8)
+        tmp_file = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+        with tmp_file.open('wb') as f:
+            f.write(MAGIC)
+            f.write(len(header_bytes).to_bytes(4, 'little'))
+            f.write(header_bytes)
+            for kind, data in self.sections.values():
+                f.write(data)
+                f.write(b'\0' * (-len(data) % 8))
+        os.replace(tmp_file, path)
+
+
+def build_index(source: Union[str, Path], target: Union[str, Path], n: int = NGRAM) -> dict:
+    """
+    Builds the index for the given TEI file.
+
+    Returns:
+        the header of the index, with some statistics
+    """
+    source, target = Path(source), Path(target)
+    stat = source.stat()
+    lines = read_lines(source)
+
+    strings: dict[str, int] = {}
+
+    def string_id(value: str) -> int:
+        return strings.setdefault(value, len(strings))
+
+    line_fields = []
+    postings: dict[str, list[int]] = defaultdict(list)
+    gram_lines: dict[str, list[int]] = defaultdict(list)
+    for line_id, fields in enumerate(lines):
+        line_fields.extend(string_id(value) for value in fields)
+        tokens = tokenize(fields[-1])
+        grams = set()
+        for position, token in enumerate(tokens):
+            postings[token].extend((line_id, position))
+            grams |= ngrams(token, n)
+        for gram in grams:
+            gram_lines[gram].append(line_id)
+
+    terms = sorted(postings, key=lambda term: term.encode('utf-8'))
+    grams = sorted(gram_lines, key=lambda gram: gram.encode('utf-8'))
+
+    writer = _Writer()
+    writer.strings('strings', strings)
+    writer.ints('lines', line_fields)
+    writer.strings('terms', terms)
+    writer.ints('term_postings_offsets', _cumulative(len(postings[term]) // 2 for term in terms))
+    writer.ints('term_postings', (value for term in terms for value in postings[term]))
+    writer.strings('grams', grams)
+    writer.ints('gram_postings_offsets', _cumulative(len(gram_lines[gram]) for gram in grams))
+    writer.ints('gram_postings', (line_id for gram in grams for line_id in gram_lines[gram]))
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    header = dict(source=os.fspath(source.resolve()), source_size=stat.st_size, source_mtime=stat.st_mtime_ns,
+                  ngram=n, lines=len(lines), terms=len(terms), grams=len(grams),
+                  tokens=sum(len(postings[term]) // 2 for term in terms))
+    writer.write(target, header)
+    return header
+
+
+def _cumulative(counts: Iterable[int]) -> Iterator[int]:
+    total = 0
+    yield total
+    for count in counts:
+        total += count
+        yield total
+
+
+class _StringTable:
+    """A memory mapped table of UTF-8 strings."""
+
+    def __init__(self, data: memoryview, offsets: memoryview):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def raw(self, index: int) -> bytes:
+        return bytes(self.data[self.offsets[index]:self.offsets[index + 1]])
+
+    def __getitem__(self, index: int) -> str:
+        return self.raw(index).decode('utf-8')
+
+    def bisect(self, key: bytes) -> int:
+        """Index of the first string that is not less than key (in UTF-8 byte order)."""
+        low, high = 0, len(self)
+        while low < high:
+            middle = (low + high) // 2
+            if self.raw(middle) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def find(self, value: str) -> Optional[int]:
+        key = value.encode('utf-8')
+        index = self.bisect(key)
+        return index if index < len(self) and self.raw(index) == key else None
+
+    def prefix_range(self, prefix: str) -> range:
+        key = prefix.encode('utf-8')
+        start = end = self.bisect(key)
+        while end < len(self) and self.raw(end).startswith(key):
+            end += 1
+        return range(start, end)
+
+
+class VerseIndex:
+    """
+    A memory mapped verse index, as written by build_index.
+
+    Use as a context manager or call close() when done.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        with self.path.open('rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f'{self.path} is not a verse index')
+        header_length = int.from_bytes(self._mmap[len(MAGIC):len(MAGIC) + 4], 'little')
+        base = len(MAGIC) + 4 + header_length
+        self.header = json.loads(self._mmap[len(MAGIC) + 4:base].decode('utf-8'))
+        if self.header.get('version') != FORMAT_VERSION or self.header.get('byteorder') != sys.byteorder:
+            self._mmap.close()
+            raise ValueError(f'{self.path} has an incompatible format, rebuild it')
+        self._view = memoryview(self._mmap)
+        self._sections = {}
+        for name, (kind, offset, length) in self.header['sections'].items():
+            view = self._view[base + offset:base + offset + length]
+            self._sections[name] = view.cast('I') if kind == 'I' else view
+        self.strings = _StringTable(self._sections['strings'], self._sections['strings_offsets'])
+        self.terms = _StringTable(self._sections['terms'], self._sections['terms_offsets'])
+        self.grams = _StringTable(self._sections['grams'], self._sections['grams_offsets'])
+        self.ngram = self.header['ngram']
+
+    @classmethod
+    def for_source(cls, source: Union[str, Path] = DEFAULT_SOURCE, index: Union[str, Path] = DEFAULT_INDEX) \
+            -> 'VerseIndex':
+        """Opens the index for the given source, (re)building it if it is missing or outdated."""
+        source, index = Path(source), Path(index)
+        stat = source.stat()
+        try:
+            verse_index = cls(index)
+            if verse_index.header['source_size'] == stat.st_size and verse_index.header['source_mtime'] == stat.st_mtime_ns:
+                return verse_index
+            verse_index.close()
+        except (FileNotFoundError, ValueError):
+            pass
+        logger.info('Building the verse index %s from %s ...', index, source)
+        build_index(source, index)
+        return cls(index)
+
+    def close(self):
+        if self._mmap.closed:
+            return
+        for view in self._sections.values():
+            view.release()
+        for table in self.strings, self.terms, self.grams:
+            table.data = table.offsets = None
+        self._sections = {}
+        self._view.release()
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.header['lines']
+
+    def line(self, line_id: int) -> Line:
+        fields = self._sections['lines'][5 * line_id:5 * line_id + 5]
+        return Line(line_id, *(self.strings[field] for field in fields))
+
+    def _postings(self, term_index: int) -> memoryview:
+        offsets = self._sections['term_postings_offsets']
+        return self._sections['term_postings'][2 * offsets[term_index]:2 * offsets[term_index + 1]]
+
+    def term_positions(self, term: str) -> dict[int, list[int]]:
+        """line id → token positions of the given (normalized) term"""
+        index = self.terms.find(term)
+        result = defaultdict(list)
+        if index is not None:
+            postings = self._postings(index)
+            for i in range(0, len(postings), 2):
+                result[postings[i]].append(postings[i + 1])
+        return result
+
+    def term(self, term: str) -> set[int]:
+        """ids of the lines containing the given term"""
+        index = self.terms.find(normalize(term))
+        return set(self._postings(index)[::2]) if index is not None else set()
+
+    def prefix(self, prefix: str) -> set[int]:
+        """ids of the lines containing a term starting with prefix"""
+        result = set()
+        for index in self.terms.prefix_range(normalize(prefix)):
+            result.update(self._postings(index)[::2])
+        return result
+
+    def phrase(self, phrase: str) -> set[int]:
+        """ids of the lines containing the terms of phrase at consecutive positions"""
+        tokens = tokenize(phrase)
+        if not tokens:
+            return set()
+        positions = [self.term_positions(token) for token in tokens]
+        candidates = set(positions[0]).intersection(*positions[1:])
+        return {line_id for line_id in candidates
+                if any(all(start + offset in positions[offset][line_id] for offset in range(1, len(tokens)))
+                       for start in positions[0][line_id])}
+
+    def substring(self, substring: str) -> set[int]:
+        """ids of the lines containing a term that contains substring"""
+        substring = normalize(substring)
+        if len(substring) < self.ngram:
+            result = set()
+            for index in range(len(self.terms)):
+                if substring in self.terms[index]:
+                    result.update(self._postings(index)[::2])
+            return result
+        offsets, gram_postings = self._sections['gram_postings_offsets'], self._sections['gram_postings']
+        candidates = None
+        for gram in sorted(ngrams(substring, self.ngram)):
+            index = self.grams.find(gram)
+            if index is None:
+                return set()
+            lines = set(gram_postings[offsets[index]:offsets[index + 1]])
+            candidates = lines if candidates is None else candidates & lines
+            if not candidates:
+                return set()
+        fields = self._sections['lines']
+        if _token.fullmatch(substring):     # then it is in a token iff it is in the text
+            return {line_id for line_id in candidates if substring in normalize(self.strings[fields[5 * line_id + 4]])}
+        return {line_id for line_id in candidates
+                if any(substring in token for token in tokenize(self.strings[fields[5 * line_id + 4]]))}
+
+    def search(self, query: str, section: Optional[str] = None, speaker: Optional[str] = None,
+               limit: Optional[int] = None) -> list[Line]:
+        """
+        Finds the lines matching all clauses of the query, in document order.
+
+        Args:
+            query: the query, see the module documentation for the syntax
+            section: only lines in this section or its subsections
+            speaker: only lines of this speaker (case insensitive)
+            limit: maximum number of results
+        """
+        result: Optional[set[int]] = None
+        for phrase, word in _clause.findall(query):
+            if word.startswith('section:'):
+                section = word[len('section:'):]
+                continue
+            if word.startswith('speaker:'):
+                speaker = word[len('speaker:'):]
+                continue
+            if phrase:
+                lines = self.phrase(phrase)
+            elif word.startswith('*') and word.endswith('*') and len(word) > 2:
+                lines = self.substring(word.strip('*'))
+            elif word.endswith('*'):
+                lines = self.prefix(word.rstrip('*'))
+            elif len(tokenize(word)) > 1:
+                lines = self.phrase(word)
+            else:
+                lines = self.term(word)
+            result = lines if result is None else result & lines
+            if not result:
+                return []
+        line_ids = range(len(self)) if result is None else sorted(result)
+        speaker = normalize(speaker) if speaker else None
+        fields = self._sections['lines']
+        accepted: dict[tuple[int, int], bool] = {}  # (section, speaker) string ids → matches the filters
+        matches = []
+        for line_id in line_ids:
+            if limit is not None and len(matches) >= limit:
+                break
+            key = fields[5 * line_id + 2], fields[5 * line_id + 3]
+            if key not in accepted:
+                line_section, line_speaker = self.strings[key[0]], self.strings[key[1]]
+                accepted[key] = (not section or line_section == section or line_section.startswith(section + '.')) \
+                    and (not speaker or normalize(line_speaker) == speaker)
+            if accepted[key]:
+                matches.append(self.line(line_id))
+        return matches
+
+
+def getargparser():
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument('-i', '--index', type=Path, default=DEFAULT_INDEX, help='index file (default: %(default)s)')
+    commands = p.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help='(re)build the index')
+    build.add_argument('source', nargs='?', type=Path, default=DEFAULT_SOURCE, help='TEI reading text (default: %(default)s)')
+    build.add_argument('--ngram', type=int, default=NGRAM, help='length of the character n-grams')
+    query = commands.add_parser('query', help='search the index')
+    query.add_argument('query', nargs='+', help='query clauses (quote phrases for the shell: \'"habe nun"\')')
+    query.add_argument('-s', '--source', type=Path,
+                       help='TEI reading text; if given, the index is rebuilt when it is missing or outdated')
+    query.add_argument('--section', help='only lines in this section or its subsections')
+    query.add_argument('--speaker', help='only lines of this speaker')
+    query.add_argument('-n', '--limit', type=int, help='maximum number of results')
+    query.add_argument('--json', action='store_true', help='write the results as JSON lines')
+    return p
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    options = getargparser().parse_args()
+    if options.command == 'build':
+        started = time.perf_counter()
+        header = build_index(options.source, options.index, options.ngram)
+        logger.info('Indexed %d lines, %d tokens, %d terms and %d %d-grams in %.1f s (%d kB)',
+                    header['lines'], header['tokens'], header['terms'], header['grams'], header['ngram'],
+                    time.perf_counter() - started, options.index.stat().st_size // 1024)
+    else:
+        query = ' '.join(f'"{clause}"' if ' ' in clause and '"' not in clause else clause for clause in options.query)
+        with (VerseIndex.for_source(options.source, options.index) if options.source else VerseIndex(options.index)) \
+                as index:
+            started = time.perf_counter()
+            lines = index.search(query, options.section, options.speaker, options.limit)
+            elapsed = time.perf_counter() - started
+        for line in lines:
+            if options.json:
+                print(json.dumps(line._asdict(), ensure_ascii=False))
+            else:
+                print(f'{line.n:>14}  {line.section:<8} {line.speaker[:16]:<16} {line.text}')
+        logger.info('%d lines for %s in %.1f ms', len(lines), shlex.quote(query), 1000 * elapsed)
+
+
+if __name__ == '__main__':
+    main()
@@ -32,6 +32,8 @@ from textdistance import NeedlemanWunsch
 from string import punctuation
 from functools import lru_cache
 
+from instrumentation import add_profile_arguments, profile, stage
+
 _ns = {'tei': 'http://www.tei-c.org/ns/1.0',
        'xh': 'http://www.w3.org/1999/xhtml'}
 
@@ -222,14 +224,21 @@ def getargparser():
                    help='URL or path to the edition. If missing, try to find the build dir and fall back to the released edition.')
     p.add_argument('-o', '--output', type=Path,
                    help='output file (csv or csv.gz). if missing, write to stdout.')
+    add_profile_arguments(p)
     return p
 
 
 def main():
     options = getargparser().parse_args()
+    with profile('verse_stats', options):
+        write_stats(options)
+
+
+def write_stats(options):
     vs = VerseStats(options.edition)
     print(f'Loading from {vs.edition} ...')
-    vs.load()
+    with stage('load'):
+        vs.load()
 
     if options.output:
         if '.gz' in options.output.suffixes:
@@ -241,8 +250,9 @@ def main():
     try:
         writer = csv.DictWriter(output_file, list(field.name for field in fields(Verse)))
         writer.writeheader()
-        for verse in track(vs.lines(), total=15200, description='Analyzing'):
-            writer.writerow(asdict(verse))
+        with stage('compute'):      # includes writing the rows, which are generated lazily
+            for verse in track(vs.lines(), total=15200, description='Analyzing'):
+                writer.writerow(asdict(verse))
     finally:
         if output_file != sys.stdout:
             output_file.close()
@@ -3,12 +3,23 @@
 """
 Run `gradle tiJson assemble` to produce the taskinfo, then run this script to
 generate the dependency graphs.
+
+With task durations, either from Gradle's build profile (`gradle --profile
+assemble`, then pass build/reports/profile/profile-*.html) or from a JSON file
+mapping task paths to seconds, the script also computes the critical path
+through the task graph, i.e. the chain of tasks that bounds the build's
+wall-clock time even with unlimited parallelism, and each task's slack, i.e.
+how much longer it could take without making the build longer. Nodes are then
+annotated with duration and slack and colored by slack (red: critical,
+towards green: more slack); their saturation reflects the duration.
 """
 
+import html
 import json
+import re
 from operator import itemgetter
 from pathlib import Path
-from typing import Annotated
+from typing import Annotated, Optional
 import pygraphviz as pgv
 import typer
 
@@ -18,39 +29,160 @@ GROUP_COLORS={
     'macrogen': 'darkgreen'
 }
 
+CRITICAL_SLACK = 0.05   # seconds
+
 def is_relevant(dep: dict) -> bool:
     if dep['type'].startswith('org.gradle.execution.plan'):
         return False
     return True
 
-def add_node(graph: pgv.AGraph, node: dict):
+def build_dag(root: dict) -> tuple[dict[str, dict], dict[str, list[str]]]:
+    """
+    Deduplicates the task tree from the taskinfo JSON into a DAG, expanding each task only once.
+
+    Returns:
+        the nodes as dictionary task path → task info (without dependencies), and the edges as dictionary
+        task path → paths of the relevant dependencies, ordered by queue position
+    """
+    nodes, edges = {}, {}
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        if node['path'] in edges:
+            continue
+        nodes[node['path']] = {key: value for key, value in node.items() if key != 'dependencies'}
+        deps = [dep for dep in sorted(node.get('dependencies', []), key=itemgetter('queuePosition'))
+                if is_relevant(dep)]
+        edges[node['path']] = [dep['path'] for dep in deps]
+        stack.extend(dep for dep in reversed(deps) if dep['path'] not in edges)
+    return nodes, edges
+
+_DURATION_PART = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_DURATION_UNITS = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+_PROFILE_ROW = re.compile(r'<td>(:[^<]*)</td>\s*<td class="numeric">([^<]*)</td>')
+
+def parse_duration(text: str) -> float:
+    """Parses a duration as formatted by Gradle, e.g. 1m2.345s, into seconds."""
+    return sum(float(value) * _DURATION_UNITS[unit] for value, unit in _DURATION_PART.findall(text))
+
+def read_durations(path: Path) -> dict[str, float]:
+    """
+    Reads task durations in seconds, either from Gradle's profile report (.html) or from a JSON
+    file mapping task paths to seconds.
+    """
+    text = path.read_text(encoding='utf-8')
+    if path.suffix.lower() in ('.html', '.htm'):
+        return {html.unescape(task): parse_duration(duration) for task, duration in _PROFILE_ROW.findall(text)}
+    return {task: float(seconds) for task, seconds in json.loads(text).items()}
+
+def critical_path(edges: dict[str, list[str]], durations: dict[str, float]) -> tuple[float, dict[str, float], list[str]]:
+    """
+    Analyzes the schedule of the DAG with unlimited parallelism. Tasks without a known duration take no time.
+
+    Returns:
+        the total time, the slack of each task, and the critical path, from the first task to the last
+    """
+    order = []      # dependencies before dependents
+    visited = set()
+    for start in edges:
+        if start in visited:
+            continue
+        visited.add(start)
+        stack = [(start, iter(edges[start]))]
+        while stack:
+            task, deps = stack[-1]
+            dep = next(deps, None)
+            if dep is None:
+                stack.pop()
+                order.append(task)
+            elif dep not in visited:
+                visited.add(dep)
+                stack.append((dep, iter(edges[dep])))
+
+    finish = {}
+    for task in order:
+        finish[task] = durations.get(task, 0) + max((finish[dep] for dep in edges[task]), default=0)
+    total = max(finish.values(), default=0)
+
+    latest = {task: total for task in edges}
+    for task in reversed(order):
+        start = latest[task] - durations.get(task, 0)
+        for dep in edges[task]:
+            latest[dep] = min(latest[dep], start)
+    slack = {task: latest[task] - finish[task] for task in edges}
+
+    path = []
+    dependencies = {dep for deps in edges.values() for dep in deps}
+    task = max((task for task in edges if task not in dependencies), key=finish.get, default=None)
+    while task is not None:
+        path.append(task)
+        task = max(edges[task], key=finish.get, default=None)
+    return total, slack, path[::-1]
+
+def _duration_color(duration: float, slack: float, max_duration: float, total: float) -> str:
+    if slack <= CRITICAL_SLACK:
+        hue = 0
+    else:
+        hue = 0.05 + 0.28 * min(slack / total, 1)
+    saturation = 0.15 + 0.85 * (duration / max_duration if max_duration else 0)
+    return f'{hue:.3f} {saturation:.3f} 1.000'
+
+def add_node(graph: pgv.AGraph, node: dict, duration: Optional[float] = None, slack: Optional[float] = None,
+             fillcolor: Optional[str] = None):
     group = node['path'].split(':')[-2]
-    graph.add_node(
-        node['path'],
-        label='<<SUP>{queuePosition}</SUP>{name}>'.format_map(node),
+    timing = '' if duration is None else f'<BR/><FONT POINT-SIZE="8">{duration:.1f}s, slack {slack:.1f}s</FONT>'
+    attrs = dict(
+        label='<<SUP>{}</SUP>{}{}>'.format(node.get('queuePosition', ''), node.get('name', node['path']), timing),
         group=group,
         fontcolor=GROUP_COLORS.get(group, 'black')
     )
+    if fillcolor:
+        attrs.update(shape='box', style='rounded,filled', fillcolor=fillcolor)
+    graph.add_node(node['path'], **attrs)
 
-def add_deps(graph: pgv.AGraph, node: dict):
-    for dep in sorted(node.get('dependencies', []), key=itemgetter('queuePosition')):
-        if is_relevant(dep):
-            if not dep['path'] in graph:
-                add_node(graph, dep)
-            graph.add_edge(node['path'], dep['path'])
-            add_deps(graph, dep)
+def add_deps(graph: pgv.AGraph, nodes: dict[str, dict], edges: dict[str, list[str]], durations=None, analysis=None):
+    """Adds the DAG to the graph. With durations and their analysis (see critical_path), annotates and colors the nodes."""
+    if durations is not None:
+        total, slack, path = analysis
+        max_duration = max((durations.get(task, 0) for task in edges), default=0)
+        critical_edges = set(zip(path[1:], path))
+    for task, node in nodes.items():
+        if durations is None:
+            add_node(graph, node)
+        else:
+            duration = durations.get(task, 0)
+            add_node(graph, node, duration, slack[task],
+                     _duration_color(duration, slack[task], max_duration, total))
+    for task, deps in edges.items():
+        for dep in deps:
+            if durations is not None and (task, dep) in critical_edges:
+                graph.add_edge(task, dep, color='red', penwidth=2)
+            else:
+                graph.add_edge(task, dep)
 
 
 def main(input: Annotated[Path, typer.Argument(help="JSON file generated from gradle tiJson <target>")] = Path("../build/taskinfo/taskinfo-assemble.json"),
          output: Annotated[Path, typer.Argument(help="Output .dot file")] = Path('../build/gradle-dependencies.dot'),
+         durations: Annotated[Optional[Path], typer.Option(help="Gradle profile report (.html) or JSON file task path → seconds")] = None,
          pdf: bool = False,
          svg: bool = False):
     with input.open() as f:
         deptree = json.load(f)
+    nodes, edges = build_dag(deptree)
+    task_durations = read_durations(durations) if durations else None
     graph = pgv.AGraph(directed=True, rankdir="RL", ordering="out", ranksep="0.2", page="11.7 8.3")
     graph.node_attr.update(shape='plain')
     graph.edge_attr.update(color='gray')
-    add_deps(graph, deptree)
+    analysis = critical_path(edges, task_durations) if task_durations is not None else None
+    add_deps(graph, nodes, edges, task_durations, analysis)
+    if task_durations is not None:
+        total, slack, path = analysis
+        unknown = [task for task in edges if task not in task_durations]
+        if unknown:
+            typer.echo(f"No duration for {len(unknown)} of {len(edges)} tasks, assuming 0s", err=True)
+        typer.echo(f"Critical path ({total:.1f}s):")
+        for task in path:
+            typer.echo(f"  {task_durations.get(task, 0):8.1f}s  {task}")
     graph.write(output)
     if pdf:
         graph.draw(output.with_suffix('.pdf'), prog='dot')
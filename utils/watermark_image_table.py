@@ -1,9 +1,14 @@
 #!/usr/bin/env python3
 
 from collections import defaultdict
+from multiprocessing import Pool
 from pathlib import Path
 from typing import Union
 from lxml import etree
+from PIL import Image
+import argparse
+import hashlib
+import json
 import re
 
 from find_sigil_refs import encode_sigil
@@ -20,19 +25,45 @@ NS={'f': 'http://www.faustedition.net/ns'}
 #                             GSA_25-W_1362_wm_hand_drawn_150.jpg
 IMG_FN_PATTERN = re.compile(r'GSA_25-W_(\d+)_wm_([a-z_]+)_(.*)')
 CAT_LABELS = {'all': 'Blatt', 'detail': 'Detail', 'hand_drawn': 'Zeichnung'}
+THUMB_SIZE = 200
+IDNO = f'{{{NS["f"]}}}idno'
+WATERMARK_ID = f'{{{NS["f"]}}}watermarkID'
+COUNTERMARK_ID = f'{{{NS["f"]}}}countermarkID'
 
-def etree_by_id(root: Path, idno_type: str):
+def metadata_by_id(root: Path, idno_type: str) -> dict[str, dict]:
+    """
+    Extracts the data relevant for the watermark table from all metadata files below root.
+
+    Returns:
+        dictionary idno of the given type → record with the keys sigil (faustedition idno or None),
+        idnos (all idnos) and wmids (watermark and countermark ids, in document order)
+    """
     result = {}
     for mdfile in root.glob('**/*.xml'):
         tree = etree.parse(str(mdfile))
-        id = tree.xpath(f'//f:idno[@type="{idno_type}"]/text()', namespaces=NS)
-        if id:
-            result[id[0]] = tree
+        record = dict(sigil=None, idnos=[], wmids=[])
+        key = None
+        for el in tree.iter(IDNO, WATERMARK_ID, COUNTERMARK_ID):
+            if el.text is None:
+                continue
+            if el.tag == IDNO:
+                record['idnos'].append(el.text)
+                idtype = el.get('type')
+                if idtype == idno_type and key is None:
+                    key = el.text
+                if idtype == 'faustedition' and record['sigil'] is None:
+                    record['sigil'] = el.text
+            else:
+                record['wmids'].append(el.text)
+        if key is not None:
+            result[key] = record
     return result
 
 def collect_wm_imgs(imgfolder: Path):
     by_sigpart = defaultdict(list)
     for image in sorted(imgfolder.glob('*')):
+        if image.is_dir():
+            continue
         match = IMG_FN_PATTERN.match(image.stem)
         if match:
             sigpart = match.group(1)
@@ -45,6 +76,62 @@ def collect_wm_imgs(imgfolder: Path):
             logger.warning('Ignoring unmatched file %s', image)
     return by_sigpart
 
+
+def make_thumbnail(image: Path, thumb: Path, size: int = THUMB_SIZE) -> Path:
+    """
+    Creates a thumbnail fitting into size × size pixels for the given image.
+
+    For JPEGs, we use draft mode to let the decoder do most of the
+    downscaling, so we never decode the full resolution scan.
+    """
+    with Image.open(image) as img:
+        img.draft('RGB', (size, size))
+        if img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        img.thumbnail((size, size))
+        thumb.parent.mkdir(parents=True, exist_ok=True)
+        img.save(thumb, quality=85, optimize=True)
+    return thumb
+
+
+def _make_thumbnail_job(args):
+    image, thumb, size = args
+    try:
+        make_thumbnail(image, thumb, size)
+        return thumb, None
+    except OSError as e:
+        return thumb, str(e)
+
+
+def update_thumbnails(by_sigpart, thumbdir: Path, size: int = THUMB_SIZE, force=False, processes=None) -> list[Path]:
+    """
+    (Re-)creates missing or stale thumbnails in thumbdir in parallel.
+
+    A thumbnail is stale if it is older than its source image.
+
+    Returns:
+        list of thumbnails that have been written
+    """
+    jobs = []
+    for images in by_sigpart.values():
+        for image in images:
+            source: Path = image['path']
+            thumb = thumbdir / source.name
+            if force or not thumb.exists() or thumb.stat().st_mtime < source.stat().st_mtime:
+                jobs.append((source, thumb, size))
+    if not jobs:
+        logger.info('All thumbnails are up to date')
+        return []
+    logger.info('Generating %d thumbnails ...', len(jobs))
+    written = []
+    with Pool(processes) as pool:
+        for thumb, error in pool.imap_unordered(_make_thumbnail_job, jobs):
+            if error:
+                logger.error('Failed to create thumbnail %s: %s', thumb, error)
+            else:
+                written.append(thumb)
+    return written
+
 class WMLabels(dict):
         
     def __init__(self, watermark_map:Path=None):
@@ -53,13 +140,15 @@ class WMLabels(dict):
         self.path = watermark_map
         wm_tree = etree.parse(os.fspath(watermark_map))
         self.tree = wm_tree
-        for el in wm_tree.xpath('//f:watermark', namespaces=NS):
+        self.elements = defaultdict(list)   # id → all f:watermark elements with that id
+        for el in wm_tree.iter(f'{{{NS["f"]}}}watermark'):
             id = el.get('id')
+            self.elements[id].append(el)
             if id != "none":
                 self[id] = el.text
 
     def register_image(self, wm_id, row_ref):
-        els = self.tree.xpath(f"//f:watermark[@id='{wm_id}']", namespaces=NS)
+        els = self.elements.get(wm_id)
         if els:
             for el in els:
                 el.set('imgref', row_ref)
@@ -94,7 +183,7 @@ def reorder_images(images: list[dict]) -> dict[str, Union[list, dict]]:
 def normalize_whitespace(text: str) -> str:
     return re.sub(r'\s+', ' ', text).strip()
 
-def generate_table(by_sigpart, idmap, wmmap: WMLabels):
+def generate_table(by_sigpart, idmap: dict[str, dict], wmmap: WMLabels):
     rows = []
     for sigpart, images in by_sigpart.items():
         signature = f'GSA 25/W {sigpart}'
@@ -111,10 +200,10 @@ def generate_table(by_sigpart, idmap, wmmap: WMLabels):
                 cols.append('<td></td>')
         cols.append('<td>' + ''.join(image_cell(img, signature, td=False) for img in img_by_cat['rest']) + '</td>')
 
-        if metadata:
-            sigil = metadata.xpath('//f:idno[@type="faustedition"]/text()', namespaces=NS)[0]
+        if metadata and metadata['sigil']:
+            sigil = metadata['sigil']
             sigil_t = encode_sigil(sigil)
-            wmids = metadata.xpath('//f:watermarkID/text() | //f:countermarkID/text()', namespaces=NS)
+            wmids = metadata['wmids']
             if wmids:
                 wm_raw = normalize_whitespace(wmids[0])
                 wm_normalized = wmmap.get(wm_raw)
@@ -181,11 +270,77 @@ function(Faust, svgPanZoom, Sortable, $, $table) {
 <?php include "includes/footer.php"?>
 """
 
-if __name__ == '__main__':
-    images = collect_wm_imgs(project_root / 'src/main/web/img/watermarks')
-    metadata = etree_by_id(project_root / 'data/xml/document', 'gsa_2')
+def file_hash(path: Path) -> str:
+    return hashlib.sha256(path.read_bytes()).hexdigest()
+
+
+def input_manifest(by_sigpart, idmap: dict[str, dict], wmmap: WMLabels) -> dict:
+    """
+    Collects everything the generated table and the label file depend on:
+    the images' modification times, the idnos and watermark ids of the
+    metadata referenced by the images, and the hash of the label file.
+    """
+    images = {image['path'].name: image['path'].stat().st_mtime_ns
+              for images in by_sigpart.values() for image in images}
+    metadata = {}
+    for sigpart in sorted(by_sigpart):
+        signature = f'GSA 25/W {sigpart}'
+        record = idmap.get(signature)
+        if record is not None:
+            metadata[signature] = record['idnos'] + record['wmids']
+    return dict(images=images, metadata=metadata, labels=file_hash(wmmap.path))
+
+
+def load_manifest(path: Path) -> dict:
+    try:
+        with path.open(encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(manifest: dict, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open('w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1)
+
+
+def getargparser():
+    p = argparse.ArgumentParser(description="""
+        (Re-)generates the table of watermark images, the thumbnails for the images,
+        and the image links in the watermark labels file.""")
+    p.add_argument('-f', '--force', action='store_true',
+                   help='regenerate all thumbnails, the table, and the labels even if nothing has changed')
+    p.add_argument('-s', '--thumb-size', type=int, default=THUMB_SIZE, metavar='PIXELS',
+                   help='maximum width and height of the thumbnails')
+    p.add_argument('-j', '--jobs', type=int, help='number of parallel thumbnail jobs (default: number of CPUs)')
+    p.add_argument('-m', '--manifest', type=Path, default=project_root / 'build/watermark-manifest.json',
+                   help='file recording the inputs of the last run')
+    return p
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
+    options = getargparser().parse_args()
+    imgfolder = project_root / 'src/main/web/img/watermarks'
+    output_file = project_root / 'src/main/web/archive_watermarks.php'
+
+    images = collect_wm_imgs(imgfolder)
+    update_thumbnails(images, imgfolder / 'thumb', options.thumb_size, options.force, options.jobs)
+
+    metadata = metadata_by_id(project_root / 'data/xml/document', 'gsa_2')
     wm_map = WMLabels()
+    manifest = input_manifest(images, metadata, wm_map)
+    if not options.force and output_file.exists() and load_manifest(options.manifest) == manifest:
+        logger.info('Inputs unchanged, not rewriting %s and %s', output_file, wm_map.path)
+        return
+
     content = generate_table(images, metadata, wm_map)
-    output_file = project_root / 'src/main/web/archive_watermarks.php'
     output_file.write_text(HEAD + content + FOOT, encoding='utf-8')
-    wm_map.save()
\ No newline at end of file
+    wm_map.save()
+    manifest['labels'] = file_hash(wm_map.path)
+    save_manifest(manifest, options.manifest)
+
+
+if __name__ == '__main__':
+    main()
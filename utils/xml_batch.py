@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+
+"""
+Batched, change-aware write-back of edits to XML files.
+
+Tools that modify the metadata collect their edits in an XMLBatch, keyed by
+target file. Applying the batch parses each file once, runs all of its edits
+on the parsed tree, and replaces the file atomically, but only if the
+serialized document actually differs from what is on disk. Independent files
+are processed in parallel.
+
+An edit is a (picklable) function that receives the parsed tree as its first
+argument, followed by the arguments given to `XMLBatch.add`, and returns a
+true value iff it has modified the tree.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+from collections import defaultdict
+from io import BytesIO
+from multiprocessing import Pool
+from typing import Callable
+
+from lxml import etree
+
+logger = logging.getLogger(__name__)
+
+
+def write_atomically(path, data: bytes):
+    """Writes data to a temporary file next to path and renames it to path."""
+    directory, name = os.path.split(os.path.abspath(path))
+    fd, tmpname = tempfile.mkstemp(prefix='.' + name + '.', suffix='.tmp', dir=directory)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        if os.path.exists(path):
+            shutil.copymode(path, tmpname)
+        os.replace(tmpname, path)
+    except BaseException:
+        os.unlink(tmpname)
+        raise
+
+
+def apply_edits(path, edits) -> bool:
+    """
+    Applies the given edits to the XML file at path.
+
+    Args:
+        path: the XML file to modify
+        edits: list of (function, args) pairs
+
+    Returns:
+        True iff the file has been rewritten
+    """
+    with open(path, 'rb') as f:
+        original = f.read()
+    tree = etree.parse(BytesIO(original), base_url=os.fspath(path))
+    modified = False
+    for edit, args in edits:
+        if edit(tree, *args):
+            modified = True
+    if not modified:
+        return False
+    serialized = etree.tostring(tree, encoding='utf-8', xml_declaration=True)
+    if serialized == original:
+        return False
+    write_atomically(path, serialized)
+    return True
+
+
+def _apply_edits_job(item):
+    path, edits = item
+    try:
+        return path, apply_edits(path, edits), None
+    except Exception as e:     # a failing edit must not abort the other files
+        return path, False, f'{type(e).__name__}: {e}'
+
+
+class XMLBatch:
+    """Collects edits to XML files, grouped by target file."""
+
+    def __init__(self):
+        self.edits = defaultdict(list)
+
+    def add(self, path, edit: Callable[..., bool], *args):
+        """Schedules edit(tree, *args) for the XML file at path."""
+        self.edits[os.fspath(path)].append((edit, args))
+
+    def __len__(self):
+        return len(self.edits)
+
+    def apply(self, processes=None) -> list[str]:
+        """
+        Applies all pending edits, one job per file.
+
+        Args:
+            processes: number of parallel processes; 1 processes everything in this process
+
+        Returns:
+            list of the files that have actually been rewritten
+        """
+        items = list(self.edits.items())
+        self.edits.clear()
+        if processes == 1 or len(items) <= 1:
+            results = map(_apply_edits_job, items)
+            return self._collect(results)
+        with Pool(processes) as pool:
+            return self._collect(pool.imap_unordered(_apply_edits_job, items))
+
+    @staticmethod
+    def _collect(results) -> list[str]:
+        changed = []
+        for path, rewritten, error in results:
+            if error is not None:
+                logger.error('%s: Failed to apply edits: %s', path, error)
+            elif rewritten:
+                logger.debug('%s: rewritten', path)
+                changed.append(path)
+        logger.info('%d files changed', len(changed))
+        return changed